@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+对比证券代码转换的两种方式:
+    apply:   df['code'].apply(lambda x: ts_code(x)) 逐行调用标量函数
+    array:   toolbox.data_provider.ts_codes 只转换去重后的代码, 再按位置取回
+5min 线每只股票每天 48 行但只有一个代码, 去重后的转换次数与行数无关
+"""
+
+import timeit
+
+import numpy as np
+import pandas as pd
+
+from sz.stock_data.toolbox.data_provider import bao_code, bao_codes, ts_code, ts_codes
+
+REPEAT = 5
+
+
+def make_codes(rows: int, stocks: int, categorical: bool = False) -> pd.Series:
+    codes = np.array(['sh.%06d' % (600000 + i) for i in range(stocks)], dtype = object)
+    series = pd.Series(codes[np.random.randint(0, stocks, rows)])
+    return series.astype('category') if categorical else series
+
+
+def best_ms(fn) -> float:
+    return min(timeit.repeat(fn, number = 1, repeat = REPEAT)) * 1000
+
+
+def main():
+    print('%10s %8s %12s %12s %12s %8s' % ('rows', 'stocks', 'apply(ms)', 'array(ms)', 'category(ms)', 'speedup'))
+    for rows, stocks in [(10_000, 1), (1_000_000, 1), (1_000_000, 5_000), (5_000_000, 5_000)]:
+        codes = make_codes(rows, stocks)
+        categories = make_codes(rows, stocks, categorical = True)
+        assert (ts_codes(codes).values == codes.apply(lambda x: ts_code(x)).values).all()
+
+        apply_ms = best_ms(lambda: codes.apply(lambda x: ts_code(x)))
+        array_ms = best_ms(lambda: ts_codes(codes))
+        category_ms = best_ms(lambda: ts_codes(categories))
+        print('%10s %8s %12.2f %12.2f %12.2f %7.1fx' % (rows, stocks, apply_ms, array_ms, category_ms,
+                                                        apply_ms / array_ms))
+
+    codes = ts_codes(make_codes(1_000_000, 5_000))
+    apply_ms = best_ms(lambda: codes.apply(lambda x: bao_code(x)))
+    array_ms = best_ms(lambda: bao_codes(codes))
+    print('bao_code %8.2f ms, bao_codes %8.2f ms, %7.1fx' % (apply_ms, array_ms, apply_ms / array_ms))
+
+
+if __name__ == '__main__':
+    main()
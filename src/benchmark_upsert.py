@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+对比增量合并的两种方式:
+    concat:  pd.concat([历史, 新增]).drop_duplicates() 再整体排序
+    upsert:  toolbox.helper.upsert_tail 按主键只合并重叠的尾部
+新增记录条数固定, 历史记录条数逐步增加. upsert 只对尾部去重排序, 但拼接结果时仍然复制全部历史,
+所以两者的耗时都随历史长度线性增长, upsert 省掉的是全量去重和排序
+"""
+
+import timeit
+
+import numpy as np
+import pandas as pd
+
+from sz.stock_data.toolbox.helper import upsert_tail
+
+NEW_ROWS = 48
+REPEAT = 5
+
+
+def make_history(rows: int) -> pd.DataFrame:
+    times = pd.date_range('2011-01-04 09:35', periods = rows, freq = '5min')
+    df = pd.DataFrame({
+        'time': times,
+        'code': '600000.SH',
+        'open': np.random.rand(rows),
+        'high': np.random.rand(rows),
+        'low': np.random.rand(rows),
+        'close': np.random.rand(rows),
+        'volume': np.random.rand(rows),
+        'amount': np.random.rand(rows)
+    })
+    df.set_index(keys = 'time', drop = False, inplace = True)
+    return df
+
+
+def concat_merge(df: pd.DataFrame, df_new: pd.DataFrame) -> pd.DataFrame:
+    df = pd.concat([df, df_new]).drop_duplicates()
+    return df.sort_index()
+
+
+def upsert_merge(df: pd.DataFrame, df_new: pd.DataFrame) -> pd.DataFrame:
+    return upsert_tail(df, df_new, keys = ['time'], sort_column = 'time')
+
+
+def main():
+    print('%12s %12s %12s %8s' % ('history', 'concat(ms)', 'upsert(ms)', 'speedup'))
+    for rows in [10_000, 100_000, 1_000_000, 3_000_000]:
+        df_all = make_history(rows + NEW_ROWS)
+        # 新增记录与历史有一根 k 线重叠, 模拟重复下载最后一个交易日
+        df = df_all.iloc[:rows]
+        df_new = df_all.iloc[rows - 1:].copy()
+
+        concat_ms = min(timeit.repeat(lambda: concat_merge(df, df_new), number = 1, repeat = REPEAT)) * 1000
+        upsert_ms = min(timeit.repeat(lambda: upsert_merge(df, df_new), number = 1, repeat = REPEAT)) * 1000
+        print('%12s %12.2f %12.2f %7.1fx' % (rows, concat_ms, upsert_ms, concat_ms / upsert_ms))
+
+
+if __name__ == '__main__':
+    main()
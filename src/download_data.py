@@ -1,14 +1,12 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
+import argparse
 import logging
-from datetime import date
+from typing import Callable, List
 
 import colorama
 
-from datetime import datetime, timedelta
-
-from sz.stock_data.index.index_basic import IndexBasic
 from sz.stock_data.index.index_daily import IndexDaily
 from sz.stock_data.market.block_trade import BlockTrade
 from sz.stock_data.market.concept import StockConcept
@@ -17,6 +15,7 @@ from sz.stock_data.market.margin_detail import StockMarginDetail
 from sz.stock_data.market.stock_industry import StockIndustry
 from sz.stock_data.market.top_inst import StockTopInst
 from sz.stock_data.market.top_list import StockTopList
+from sz.stock_data.panel.daily_panel import DailyPanel
 from sz.stock_data.stock_data import StockData
 from sz.stock_data.stocks.adj_factor import AdjFactor
 from sz.stock_data.stocks.money_flow import MoneyFlow
@@ -29,7 +28,12 @@ from sz.stock_data.stocks.stock_daily import StockDaily
 from sz.stock_data.stocks.suspend import Suspend
 from sz.stock_data.stocks.top10_floatholders import Top10FloatHolders
 from sz.stock_data.stocks.top10_holders import Top10Holders
+from sz.stock_data.toolbox.bao_pool import BaoFetchPool
 from sz.stock_data.toolbox.data_provider import bao_login, bao_logout
+from sz.stock_data.toolbox.journal import set_resume
+from sz.stock_data.toolbox.limiter import ts_rate_limiters
+from sz.stock_data.toolbox.range_fetcher import range_fetcher_stats
+from sz.stock_data.toolbox.scheduler import Job, UpdateScheduler, dataset_job
 
 colorama.init(autoreset = True)
 
@@ -40,69 +44,110 @@ logging.basicConfig(
 )
 
 
-def test():
-    start_time = datetime.now()
-    StockData().stock_basic.update()
-    StockData().stock_company.update()
-    StockData().zz500.update()
-    StockData().hs300.update()
-
-    StockTopList(data_dir = StockData().data_dir).update()
-    StockTopInst(data_dir = StockData().data_dir).update()
-    BlockTrade(data_dir = StockData().data_dir).update()
-    StockConcept(data_dir = StockData().data_dir).update()
-    StockMargin(data_dir = StockData().data_dir).update()
-    StockMarginDetail(data_dir = StockData().data_dir).update()
-    StockIndustry(data_dir = StockData().data_dir).update()
-    IndexBasic(data_dir = StockData().data_dir).update()
-
-    for index_code in StockData().index_basic.default_index_pool():
-        IndexDaily(data_dir = StockData().data_dir, index_code = index_code).update()
-
-    stock_list = []
-    stock_list.extend(StockData().hs300.stock_codes())
-    stock_list.extend(StockData().zz500.stock_codes())
-
-    total_count = len(stock_list)
-    finished_count = 0
-
-    for stock_code in stock_list:
-        update_for_stock(stock_code)
-        finished_count += 1
-        logging.debug(colorama.Fore.LIGHTGREEN_EX + '股票 %s 更新完毕, 进度: (%s/%s) %.2f %%' %
-                      (StockData().stock_basic.name_of(ts_code = stock_code),
-                       finished_count,
-                       total_count,
-                       finished_count / total_count * 100))
-
-    # for stock_code in StockData().hs300.stock_codes():
-    #     update_for_stock(stock_code)
-    #
-    # for stock_code in StockData().zz500.stock_codes():
-    #     update_for_stock(stock_code)
-
-    logging.info(colorama.Fore.YELLOW + '更新完毕')
-    end_time = datetime.now()
-
-    logging.info(colorama.Fore.YELLOW + '本次更新总共耗时: %s' % (end_time - start_time))
+# 每只股票需要更新的数据集, 各数据集保存在不同的数据文件中, 可以并发更新
+stock_datasets = [
+    StockDaily,
+    Stock5min,
+    AdjFactor,
+    MoneyFlow,
+    Top10Holders,
+    Top10FloatHolders,
+    StkHolderNumber,
+    StkHolderTrade,
+    PledgeStat,
+    PledgeDetail,
+    Suspend
+]
+
+
+def stock_list() -> List[str]:
+    """
+    需要更新个股数据的股票: 沪深300和中证500成分股
+    :return:
+    """
+    return list(StockData().hs300.stock_codes()) + list(StockData().zz500.stock_codes())
+
+
+def stock_jobs(dataset_class, processes: int = 0) -> Callable[[], List[Job]]:
+    """
+    每只股票一个子任务
+    :param dataset_class: 个股数据集类
+    :param processes: baostock K 线数据多进程下载的进程数
+    :return:
+    """
+
+    def expand() -> List[Job]:
+        datasets = [dataset_class(data_dir = StockData().data_dir, stock_code = stock_code)
+                    for stock_code in stock_list()]
+        if hasattr(dataset_class, 'update_by_trade_date'):
+            # 按交易日下载全市场数据, 每天只需要调用一次接口; 本地还没有数据的股票, 再逐只按日期区间下载
+            datasets = dataset_class.update_by_trade_date(data_dir = StockData().data_dir,
+                                                          stock_codes = stock_list(), update_rest = False)
+        elif processes > 0 and hasattr(dataset_class, 'bao_tasks'):
+            # baostock 没有积分限制, K 线数据由多进程下载池并行下载, 之后的逐个更新会直接跳过
+            BaoFetchPool(processes = processes).update(datasets)
+        return [dataset_job(dataset.stock_code, dataset) for dataset in datasets]
+
+    return expand
+
+
+def test(workers: int = 1, processes: int = 0):
+    scheduler = UpdateScheduler(max_workers = workers)
+
+    scheduler.add_dataset(StockData().trade_calendar)
+    scheduler.add_dataset(StockData().stock_basic)
+    scheduler.add_dataset(StockData().stock_company)
+    scheduler.add_dataset(StockData().zz500)
+    scheduler.add_dataset(StockData().hs300)
+
+    scheduler.add_dataset(StockTopList(data_dir = StockData().data_dir))
+    scheduler.add_dataset(StockTopInst(data_dir = StockData().data_dir))
+    scheduler.add_dataset(BlockTrade(data_dir = StockData().data_dir))
+    scheduler.add_dataset(StockConcept(data_dir = StockData().data_dir))
+    scheduler.add_dataset(StockMargin(data_dir = StockData().data_dir))
+    scheduler.add_dataset(StockMarginDetail(data_dir = StockData().data_dir))
+    scheduler.add_dataset(StockIndustry(data_dir = StockData().data_dir))
+    scheduler.add_dataset(StockData().index_basic)
+
+    scheduler.add(
+        name = IndexDaily.__name__,
+        fn = lambda: [dataset_job(index_code, IndexDaily(data_dir = StockData().data_dir, index_code = index_code))
+                      for index_code in StockData().index_basic.default_index_pool()],
+        dependencies = IndexDaily.dependencies
+    )
+
+    for dataset_class in stock_datasets:
+        scheduler.add(name = dataset_class.__name__, fn = stock_jobs(dataset_class, processes),
+                      dependencies = dataset_class.dependencies)
+
+    scheduler.add(
+        name = DailyPanel.__name__,
+        fn = lambda: DailyPanel(data_dir = StockData().data_dir).update(stock_list()),
+        dependencies = DailyPanel.dependencies
+    )
+
+    scheduler.run()
+
+    logging.info(colorama.Fore.YELLOW + '更新完毕\n%s' % scheduler.report())
+    logging.info(colorama.Fore.YELLOW + 'tushare 接口调用次数和限速等待时间:\n%s' % ts_rate_limiters.stats().to_string(index = False))
+    logging.info(colorama.Fore.YELLOW + '分块下载的区间长度:\n%s' % range_fetcher_stats().to_string(index = False))
 
 
 def update_for_stock(stock_code: str):
-    StockDaily(data_dir = StockData().data_dir, stock_code = stock_code).update()
-    Stock5min(data_dir = StockData().data_dir, stock_code = stock_code).update()
-    AdjFactor(data_dir = StockData().data_dir, stock_code = stock_code).update()
-    MoneyFlow(data_dir = StockData().data_dir, stock_code = stock_code).update()
-    Top10Holders(data_dir = StockData().data_dir, stock_code = stock_code).update()
-    Top10FloatHolders(data_dir = StockData().data_dir, stock_code = stock_code).update()
-    StkHolderNumber(data_dir = StockData().data_dir, stock_code = stock_code).update()
-    StkHolderTrade(data_dir = StockData().data_dir, stock_code = stock_code).update()
-    PledgeStat(data_dir = StockData().data_dir, stock_code = stock_code).update()
-    PledgeDetail(data_dir = StockData().data_dir, stock_code = stock_code).update()
-    Suspend(data_dir = StockData().data_dir, stock_code = stock_code).update()
+    for dataset in stock_datasets:
+        dataset(data_dir = StockData().data_dir, stock_code = stock_code).update()
 
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = '下载更新本地数据')
+    parser.add_argument('--data-dir', default = '/Volumes/USBDATA/stock_data', help = '本地数据目录')
+    parser.add_argument('--workers', type = int, default = 4, help = '并发更新的线程数')
+    parser.add_argument('--processes', type = int, default = 4, help = 'baostock K 线数据多进程下载的进程数, 0 表示不使用')
+    parser.add_argument('--resume', action = 'store_true', help = '从上次中断的位置继续更新, 已经下载完成的分块不再重新下载')
+    args = parser.parse_args()
+
     bao_login()
-    StockData().setup(data_dir = '/Volumes/USBDATA/stock_data')
-    test()
+    StockData().setup(data_dir = args.data_dir)
+    set_resume(args.resume)
+    test(workers = args.workers, processes = args.processes)
     bao_logout()
@@ -0,0 +1,34 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import argparse
+import logging
+from datetime import datetime
+
+import colorama
+
+from sz.stock_data.toolbox.storage import migrate_stocks_dir
+
+colorama.init(autoreset = True)
+
+logging.basicConfig(
+    level = logging.DEBUG,
+    format = "[%(asctime)-15s] [%(threadName)s] [%(levelname)s] %(message)s"
+)
+
+
+def main():
+    parser = argparse.ArgumentParser(description = '将本地 stocks/<code>/*.csv 个股数据文件转换为列式存储格式')
+    parser.add_argument('--data-dir', default = '/Volumes/USBDATA/stock_data', help = '本地数据目录')
+    parser.add_argument('--format', default = 'parquet', help = '目标存储格式')
+    parser.add_argument('--remove-csv', action = 'store_true', help = '转换完成后删除原来的 csv 文件')
+    args = parser.parse_args()
+
+    start_time = datetime.now()
+    migrate_stocks_dir(data_dir = args.data_dir, target = args.format, remove_source = args.remove_csv)
+    logging.info(colorama.Fore.YELLOW + '转换完毕, 耗时: %s' % (datetime.now() - start_time))
+    logging.info(colorama.Fore.YELLOW + '请使用 StockData().setup(data_dir, storage = "%s") 读取转换后的数据' % args.format)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,143 @@
+from datetime import date
+from typing import Iterable, List, Tuple, Union
+
+import numpy as np
+import pandas as pd
+
+from sz.stock_data.calendar.trade_calendar import TradeCalendar, _to_day_
+
+
+class SessionCalendar(TradeCalendar):
+    """
+    沪深A股日内交易时段日历. 在交易日历的基础上, 每个交易日划分为固定的 5min 线时间槽:
+    上午 09:30 -- 11:30, 下午 13:00 -- 15:00, 每个时段 24 根, 共 48 根. 5min 线以结束时间标记, 例如 09:35 为第 0 根
+    任意时间都可以映射为 (交易日序号, 时间槽) 整数对, 不同股票的 5min 线可以直接按整数对齐, 不需要按时间戳关联
+    """
+    bar_minutes = 5
+    # 交易时段: (开始时间, 结束时间), 以当天 0 点开始的分钟数表示
+    sessions: List[Tuple[int, int]] = [(9 * 60 + 30, 11 * 60 + 30), (13 * 60, 15 * 60)]
+    # 每个交易日的时间槽数量
+    slots_per_day = 48
+
+    @classmethod
+    def slot_minutes(cls) -> np.ndarray:
+        """
+        每个时间槽的结束时间, 以当天 0 点开始的分钟数表示
+        :return: 长度为 slots_per_day 的 int64 数组
+        """
+        return np.concatenate([np.arange(start + cls.bar_minutes, end + 1, cls.bar_minutes, dtype = np.int64)
+                               for start, end in cls.sessions])
+
+    @classmethod
+    def slot_of(cls, times: Union[Iterable, pd.Series, np.ndarray]) -> np.ndarray:
+        """
+        计算 5min 线的结束时间在当天的时间槽序号 (0 -- 47), 不在交易时段内或者不在 5min 整点上的返回 -1
+        :param times:
+        :return: int64 数组
+        """
+        times = pd.DatetimeIndex(times)
+        minutes = times.hour.values.astype(np.int64) * 60 + times.minute.values
+        on_bar = (times.second.values == 0) & (minutes % cls.bar_minutes == 0) & ~np.isnat(times.values)
+        slots = np.full(len(minutes), -1, dtype = np.int64)
+        offset = 0
+        for start, end in cls.sessions:
+            in_session = on_bar & (minutes > start) & (minutes <= end)
+            slots[in_session] = (minutes[in_session] - start) // cls.bar_minutes - 1 + offset
+            offset += (end - start) // cls.bar_minutes
+        return slots
+
+    def locate(self, times: Union[Iterable, pd.Series, np.ndarray]) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        将时间映射为 (交易日序号, 时间槽) 整数对. 交易日序号参考 trade_day_ordinal;
+        不是交易日或者不在交易时段内的时间, 两个序号都为 -1
+        :param times:
+        :return: (交易日序号数组, 时间槽数组)
+        """
+        values = pd.DatetimeIndex(times).values
+        days = values.astype('datetime64[D]')
+        slots = self.slot_of(values)
+        valid = (slots >= 0) & self.is_trade_days(days)
+        ordinals = np.full(len(values), -1, dtype = np.int64)
+        ordinals[valid] = self.trade_day_ordinals(days[valid])
+        slots[~valid] = -1
+        return ordinals, slots
+
+    def bar_times(self, from_date: Union[str, date], to_date: Union[str, date]) -> np.ndarray:
+        """
+        指定起始日期之间(包含起始日期)全部交易日的标准 5min 线时间
+        :param from_date:
+        :param to_date:
+        :return: datetime64[m] 数组, 长度为 交易日数量 × slots_per_day
+        """
+        days = self.trade_days(from_date, to_date).astype('datetime64[m]')
+        offsets = self.slot_minutes().astype('timedelta64[m]')
+        return (days[:, np.newaxis] + offsets[np.newaxis, :]).ravel()
+
+    def bar_report(self, df: pd.DataFrame, start_date: Union[None, str, date] = None,
+                   end_date: Union[None, str, date] = None,
+                   code_column: str = 'code', time_column: str = 'time') -> pd.DataFrame:
+        """
+        一次扫描统计每只股票缺失和多余的 5min 线.
+        应有的 5min 线为起止日期之间每个交易日的 48 根, 起止日期默认为该股票数据的第一天和最后一天;
+        多余的 5min 线包括不在交易日或者交易时段内的记录, 以及重复的记录. 停牌的交易日计为缺失
+        :param df: 一只或多只股票的 5min 线数据
+        :param start_date:
+        :param end_date:
+        :param code_column: 股票代码字段
+        :param time_column: 5min 线时间字段
+        :return: DataFrame: code, first_date, last_date, expected, present, missing, extra, duplicated
+        """
+        columns = ['code', 'first_date', 'last_date', 'expected', 'present', 'missing', 'extra', 'duplicated']
+        # 没有股票代码的记录无法归属, 不参与统计 (factorize 会将其编码为 -1)
+        df = df[df[code_column].notna()]
+        if df.empty:
+            return pd.DataFrame(columns = columns)
+
+        code_ids, codes = pd.factorize(df[code_column], sort = True)
+        ordinals, slots = self.locate(df[time_column])
+        valid = ordinals >= 0
+
+        days = pd.DatetimeIndex(df[time_column]).values.astype('datetime64[D]')
+        first_days = pd.Series(days).groupby(code_ids).min().values.astype('datetime64[D]')
+        last_days = pd.Series(days).groupby(code_ids).max().values.astype('datetime64[D]')
+        if start_date is not None:
+            first_days[:] = _to_day_(start_date)
+        if end_date is not None:
+            last_days[:] = _to_day_(end_date)
+        # 起始日期不是交易日时, 从之后的第一个交易日开始
+        first_ordinals = self.trade_day_ordinals(first_days) + (~self.is_trade_days(first_days)).astype(np.int64)
+        last_ordinals = self.trade_day_ordinals(last_days)
+        expected_days = np.maximum(last_ordinals - first_ordinals + 1, 0)
+
+        # 只统计起止日期之内的记录, 之外的计为多余
+        in_range = valid & (ordinals >= first_ordinals[code_ids]) & (ordinals <= last_ordinals[code_ids])
+        # (股票, 交易日, 时间槽) 编码为一个整数, 去重后按股票计数
+        bars_per_code = len(self._open_days_()) * self.slots_per_day
+        keys = code_ids[in_range] * bars_per_code + ordinals[in_range] * self.slots_per_day + slots[in_range]
+        present = np.bincount(np.unique(keys) // bars_per_code, minlength = len(codes))
+        in_range_count = np.bincount(code_ids[in_range], minlength = len(codes))
+        total = np.bincount(code_ids, minlength = len(codes))
+
+        return pd.DataFrame({
+            'code': codes,
+            'first_date': pd.DatetimeIndex(first_days),
+            'last_date': pd.DatetimeIndex(last_days),
+            'expected': expected_days * self.slots_per_day,
+            'present': present,
+            'missing': expected_days * self.slots_per_day - present,
+            'extra': total - present,
+            'duplicated': in_range_count - present,
+        }, columns = columns)
+
+    def missing_bars(self, times: Union[Iterable, pd.Series, np.ndarray], start_date: Union[str, date],
+                     end_date: Union[str, date]) -> np.ndarray:
+        """
+        单只股票在起止日期之间缺失的 5min 线时间
+        :param times: 该股票的 5min 线时间
+        :param start_date:
+        :param end_date:
+        :return: datetime64[m] 数组
+        """
+        expected = self.bar_times(start_date, end_date)
+        values = pd.DatetimeIndex(times).values.astype('datetime64[m]')
+        return expected[~np.isin(expected, values)]
@@ -1,7 +1,7 @@
 import logging
 import os
 from datetime import date
-from typing import List, Union, Iterable
+from typing import Iterable, List, Tuple, Union
 
 import colorama
 import numpy as np
@@ -9,10 +9,28 @@ import pandas as pd
 from pandas import Timestamp
 
 from sz.stock_data.toolbox.data_provider import ts_pro_api
-from sz.stock_data.toolbox.limiter import ts_rate_limiter
+from sz.stock_data.toolbox.datetime import to_datetime_column
+from sz.stock_data.toolbox.limiter import ts_rate_limit
+from sz.stock_data.toolbox.storage import is_slice, read_csv_file, with_columns
+
+
+def _to_day_(value: Union[str, date, pd.Timestamp, np.datetime64]) -> np.datetime64:
+    return pd.Timestamp(value).to_datetime64().astype('datetime64[D]')
+
+
+def _to_days_(values: Union[Iterable, np.ndarray, pd.Series]) -> np.ndarray:
+    if isinstance(values, np.ndarray) and np.issubdtype(values.dtype, np.datetime64):
+        return values.astype('datetime64[D]')
+    return pd.DatetimeIndex(pd.to_datetime(values)).values.astype('datetime64[D]')
+
+
+def _to_date_(value: np.datetime64) -> date:
+    return value.astype('datetime64[D]').astype(object)
 
 
 class TradeCalendar(object):
+    # 更新之前需要先更新的数据集
+    dependencies = []
 
     def __init__(self, data_dir: str):
         """
@@ -21,6 +39,9 @@ class TradeCalendar(object):
         """
         self.data_dir = data_dir
         self.dataframe: Union[pd.DataFrame, None] = None
+        # 排序后的全部交易日
+        self.open_days: Union[np.ndarray, None] = None
+        self._latest_trade_day_: Union[None, Tuple[date, date]] = None
 
     def _setup_dir_(self):
         """
@@ -46,6 +67,7 @@ class TradeCalendar(object):
 
         if len(df_list) > 1:
             self.dataframe: pd.DataFrame = pd.concat(df_list).drop_duplicates(subset = 'cal_date').sort_index()
+            self._build_open_days_()
             self.dataframe.to_csv(
                 path_or_buf = self.file_path(),
                 index = False
@@ -58,41 +80,165 @@ class TradeCalendar(object):
         """
         return os.path.join(self.data_dir, 'trade_calendar', 'trade_calendar.csv')
 
-    def load(self) -> pd.DataFrame:
+    def load(self, columns: Union[None, List[str]] = None, start: Union[None, str, date] = None,
+             end: Union[None, str, date] = None) -> pd.DataFrame:
         """
         从数据文件加载交易日历
-        :return:
+        :param columns: 只读取指定的字段 (索引字段总是读取), 默认读取全部字段
+        :param start: 只读取 cal_date 不早于这一天的记录
+        :param end: 只读取 cal_date 不晚于这一天的记录
+        :return: 指定了读取范围时只返回数据切片, 不替换 self.dataframe
         """
         if os.path.exists(self.file_path()):
-            self.dataframe = pd.read_csv(
-                filepath_or_buffer = self.file_path(),
-                dtype = {'is_open': np.bool},
-                parse_dates = ['cal_date', 'pretrade_date']
+            df = read_csv_file(
+                fpath = self.file_path(),
+                dtype = {'is_open': bool},
+                parse_dates = ['cal_date', 'pretrade_date'],
+                columns = with_columns(columns, 'cal_date'),
+                date_column = 'cal_date',
+                start = start,
+                end = end
             )
-            self.dataframe.set_index(keys = 'cal_date', drop = False, inplace = True)
-            self.dataframe.sort_index(inplace = True)
+            df.set_index(keys = 'cal_date', drop = False, inplace = True)
+            df.sort_index(inplace = True)
         else:
-            self.dataframe = pd.DataFrame(columns = ['cal_date', 'is_open', 'pretrade_date'])
+            df = pd.DataFrame(columns = ['cal_date', 'is_open', 'pretrade_date'])
 
-        return self.dataframe
+        if not is_slice(columns, start, end):
+            self.dataframe = df
+            self._build_open_days_()
+        return df
 
     def prepare(self):
         if self.dataframe is None:
             self.load()
         return self
 
+    def _build_open_days_(self):
+        """
+        由交易日历生成排序后的交易日数组, 所有交易日运算都在这个数组上二分查找
+        :return:
+        """
+        df: pd.DataFrame = self.dataframe
+        if df.empty:
+            self.open_days = np.array([], dtype = 'datetime64[D]')
+        else:
+            self.open_days = np.unique(
+                pd.DatetimeIndex(df.loc[df['is_open'].astype(bool), 'cal_date']).values.astype('datetime64[D]'))
+        self._latest_trade_day_ = None
+
+    def _open_days_(self) -> np.ndarray:
+        self.prepare()
+        if self.open_days is None:
+            self._build_open_days_()
+        return self.open_days
+
     def latest_trade_day(self) -> date:
         """
         返回距离当天之前最近的一个交易日的日期. 如果当天是交易日,则返回当天
         :return:
         """
-        self.prepare()
         today = date.today()
-        row = self.dataframe.loc[today]
-        if row.loc['is_open']:
-            return today
-        else:
-            return row.loc['pretrade_date'].date()
+        if self._latest_trade_day_ is None or self._latest_trade_day_[0] != today:
+            self._latest_trade_day_ = (today, self.previous_trade_day(today))
+        return self._latest_trade_day_[1]
+
+    def is_trade_day(self, day: Union[str, date]) -> bool:
+        """
+        是否交易日
+        :param day:
+        :return:
+        """
+        open_days = self._open_days_()
+        value = _to_day_(day)
+        index = np.searchsorted(open_days, value)
+        return bool(index < len(open_days) and open_days[index] == value)
+
+    def is_trade_days(self, days: Union[Iterable, np.ndarray, pd.Series]) -> np.ndarray:
+        """
+        is_trade_day 的数组版本
+        :param days:
+        :return: bool 数组
+        """
+        open_days = self._open_days_()
+        values = _to_days_(days)
+        index = np.searchsorted(open_days, values)
+        result = np.zeros(values.shape, dtype = bool)
+        found = index < len(open_days)
+        result[found] = open_days[index[found]] == values[found]
+        return result
+
+    def previous_trade_day(self, day: Union[str, date]) -> date:
+        """
+        返回 day 当天或者之前最近的一个交易日
+        :param day:
+        :return:
+        """
+        open_days = self._open_days_()
+        index = np.searchsorted(open_days, _to_day_(day), side = 'right') - 1
+        if index < 0:
+            raise Exception('交易日历中没有 %s 之前的交易日, 请先更新交易日历' % day)
+        return _to_date_(open_days[index])
+
+    def trade_day_ordinal(self, day: Union[str, date]) -> int:
+        """
+        交易日序号: day 当天或者之前最近的交易日在全部交易日中的位置, 从 0 开始, day 在第一个交易日之前时返回 -1.
+        两个交易日的序号之差就是相隔的交易日数量
+        :param day:
+        :return:
+        """
+        return int(np.searchsorted(self._open_days_(), _to_day_(day), side = 'right') - 1)
+
+    def trade_day_ordinals(self, days: Union[Iterable, np.ndarray, pd.Series]) -> np.ndarray:
+        """
+        trade_day_ordinal 的数组版本
+        :param days:
+        :return: int64 数组, 日期为空时为 -1
+        """
+        values = _to_days_(days)
+        ordinals = np.searchsorted(self._open_days_(), values, side = 'right').astype(np.int64) - 1
+        ordinals[np.isnat(values)] = -1
+        return ordinals
+
+    def trade_day_of_ordinal(self, ordinals: Union[int, Iterable, np.ndarray]) -> Union[date, np.ndarray]:
+        """
+        由交易日序号返回交易日
+        :param ordinals: 单个序号或者序号数组
+        :return: 单个序号时返回 date, 否则返回 datetime64[D] 数组
+        """
+        open_days = self._open_days_()
+        if np.ndim(ordinals) == 0:
+            return _to_date_(open_days[int(ordinals)])
+        return open_days[np.asarray(ordinals, dtype = np.int64)]
+
+    def shift_trade_day(self, day: Union[str, date], n: int) -> date:
+        """
+        交易日偏移. n >= 0 时, 从 day 当天或者之后的第一个交易日开始向后数 n 个交易日;
+        n < 0 时, 从 day 当天或者之前的最近一个交易日开始向前数 -n 个交易日
+        :param day:
+        :param n:
+        :return:
+        """
+        return _to_date_(self.shift_trade_days(np.array([_to_day_(day)]), n)[0])
+
+    def shift_trade_days(self, days: Union[Iterable, np.ndarray, pd.Series],
+                         n: Union[int, np.ndarray]) -> np.ndarray:
+        """
+        shift_trade_day 的数组版本, 例如将一列公告日期整体偏移到之后的第 n 个交易日
+        :param days:
+        :param n: 偏移的交易日数量, 可以是与 days 等长的数组
+        :return: datetime64[D] 数组, 超出交易日历范围时为 NaT
+        """
+        open_days = self._open_days_()
+        values = _to_days_(days)
+        n = np.broadcast_to(np.asarray(n, dtype = np.int64), values.shape)
+        forward = np.searchsorted(open_days, values, side = 'left')
+        backward = np.searchsorted(open_days, values, side = 'right') - 1
+        index = np.where(n >= 0, forward, backward) + n
+        valid = (index >= 0) & (index < len(open_days)) & ~np.isnat(values)
+        result = np.full(values.shape, np.datetime64('NaT'), dtype = 'datetime64[D]')
+        result[valid] = open_days[index[valid]]
+        return result
 
     def next_n_trade_day(self, base_date: date, n: int, last_date: Union[None, date] = None) -> date:
         """
@@ -102,20 +248,25 @@ class TradeCalendar(object):
         :param n:
         :return:
         """
-        self.prepare()
-        df: pd.DataFrame = self.dataframe
-        df = df[(df['cal_date'] >= str(base_date)) & (df['is_open'] == True)]
-        rows_count = df.shape[0]
-        row_index = min(rows_count - 1, n)
-        day = df.iloc[row_index].loc['cal_date'].date()
+        open_days = self._open_days_()
+        index = min(len(open_days) - 1, np.searchsorted(open_days, _to_day_(base_date)) + n)
+        day = _to_date_(open_days[index])
         if last_date is None:
             return day
         else:
-            latest_day = self.latest_trade_day()
-            if day <= latest_day:
-                return day
-            else:
-                return latest_day
+            return min(day, self.latest_trade_day())
+
+    def trade_days(self, from_date: Union[str, date], to_date: Union[str, date]) -> np.ndarray:
+        """
+        返回指定起始日期之间(包含起始日期)所有交易日
+        :param from_date:
+        :param to_date:
+        :return: datetime64[D] 数组
+        """
+        open_days = self._open_days_()
+        start = np.searchsorted(open_days, _to_day_(from_date), side = 'left')
+        end = np.searchsorted(open_days, _to_day_(to_date), side = 'right')
+        return open_days[start:max(start, end)]
 
     def trade_day_between(self, from_date: date, to_date: date) -> Iterable[date]:
         """
@@ -124,11 +275,30 @@ class TradeCalendar(object):
         :param to_date:
         :return:
         """
-        self.prepare()
-        df: pd.DataFrame = self.dataframe
-        df = df[(df['cal_date'] >= str(from_date)) & (df['cal_date'] <= str(to_date)) & (df['is_open'] == True)]
-        for index, value in df['cal_date'].iteritems():
-            yield value.date()
+        for value in self.trade_days(from_date, to_date).tolist():
+            yield value
+
+    def count_trade_days(self, from_date: Union[str, date], to_date: Union[str, date]) -> int:
+        """
+        指定起始日期之间(包含起始日期)的交易日数量
+        :param from_date:
+        :param to_date:
+        :return:
+        """
+        return int(self.count_trade_days_between(np.array([_to_day_(from_date)]), np.array([_to_day_(to_date)]))[0])
+
+    def count_trade_days_between(self, from_dates: Union[Iterable, np.ndarray, pd.Series],
+                                 to_dates: Union[Iterable, np.ndarray, pd.Series]) -> np.ndarray:
+        """
+        count_trade_days 的数组版本
+        :param from_dates:
+        :param to_dates:
+        :return: int64 数组
+        """
+        open_days = self._open_days_()
+        start = np.searchsorted(open_days, _to_days_(from_dates), side = 'left')
+        end = np.searchsorted(open_days, _to_days_(to_dates), side = 'right')
+        return np.maximum(end - start, 0).astype(np.int64)
 
     @staticmethod
     def end_date() -> str:
@@ -136,7 +306,7 @@ class TradeCalendar(object):
         return '%s1231' % today.year
 
     @staticmethod
-    @ts_rate_limiter
+    @ts_rate_limit('trade_cal')
     def ts_trade_cal(start_date: str, end_date: str) -> pd.DataFrame:
         df: pd.DataFrame = ts_pro_api().trade_cal(
             exchange = 'SSE',
@@ -144,8 +314,8 @@ class TradeCalendar(object):
             end_date = end_date,
             fields = ','.join(['cal_date', 'is_open', 'pretrade_date'])
         )
-        df['cal_date'] = pd.to_datetime(df['cal_date'], format = '%Y%m%d')
-        df['pretrade_date'] = pd.to_datetime(df['pretrade_date'], format = '%Y%m%d')
+        df['cal_date'] = to_datetime_column(df['cal_date'])
+        df['pretrade_date'] = to_datetime_column(df['pretrade_date'])
         df['is_open'] = df['is_open'].apply(lambda x: str(x) == '1')
         df.set_index(keys = 'cal_date', drop = False, inplace = True)
         df.sort_index(inplace = True)
@@ -1,17 +1,24 @@
 import logging
 import os
-from typing import Union, List
+from datetime import date
+from typing import Iterable, List, Union
 
 import colorama
 import pandas as pd
 
 from sz.stock_data.toolbox.data_provider import ts_pro_api
-from sz.stock_data.toolbox.datetime import to_datetime64
+from sz.stock_data.toolbox.datetime import to_datetime_column
 from sz.stock_data.toolbox.helper import need_update
-from sz.stock_data.toolbox.limiter import ts_rate_limiter
+from sz.stock_data.toolbox.limiter import ts_rate_limit
+from sz.stock_data.toolbox.lookup import CodeLookup
+from sz.stock_data.toolbox.storage import is_slice, read_csv_file, with_columns
 
 
 class IndexBasic(object):
+    # 更新之前需要先更新的数据集
+    dependencies = []
+    # 可以按代码快速查询的字段
+    lookup_fields = ['fullname', 'name', 'market', 'list_date', 'exp_date']
     index_markets = {
         'MSCI': 'MSCI指数',
         'CSI': '中证指数',
@@ -25,6 +32,7 @@ class IndexBasic(object):
     def __init__(self, data_dir: str):
         self.data_dir: str = data_dir
         self.dataframe: Union[pd.DataFrame, None] = None
+        self.lookup: Union[CodeLookup, None] = None
 
     def file_path(self) -> str:
         """
@@ -47,33 +55,47 @@ class IndexBasic(object):
         """
         return need_update(self.file_path(), 7)
 
-    def load(self) -> pd.DataFrame:
+    def load(self, columns: Union[None, List[str]] = None, start: Union[None, str, date] = None,
+             end: Union[None, str, date] = None) -> pd.DataFrame:
+        """
+        :param columns: 只读取指定的字段 (索引字段总是读取), 默认读取全部字段
+        :param start: 只读取 list_date 不早于这一天的记录
+        :param end: 只读取 list_date 不晚于这一天的记录
+        :return: 指定了读取范围时只返回数据切片, 不替换 self.dataframe
+        """
         if os.path.exists(self.file_path()):
-            self.dataframe = pd.read_csv(
-                filepath_or_buffer = self.file_path(),
-                parse_dates = ['list_date', 'exp_date']
+            df = read_csv_file(
+                fpath = self.file_path(),
+                parse_dates = ['list_date', 'exp_date'],
+                columns = with_columns(columns, 'ts_code'),
+                date_column = 'list_date',
+                start = start,
+                end = end
             )
-            self.dataframe.set_index(keys = 'ts_code', drop = False, inplace = True)
-            self.dataframe.sort_index(inplace = True)
+            df.set_index(keys = 'ts_code', drop = False, inplace = True)
+            df.sort_index(inplace = True)
         else:
             logging.warning(colorama.Fore.RED + '[指数基本信息] 本地数据文件不存在,请及时下载更新')
-            self.dataframe = pd.DataFrame()
+            df = pd.DataFrame()
 
-        return self.dataframe
+        if not is_slice(columns, start, end):
+            self.dataframe = df
+            self.lookup = CodeLookup(self.dataframe, 'ts_code', self.lookup_fields)
+        return df
 
     def prepare(self):
         if self.dataframe is None:
             self.load()
         return self
 
-    @ts_rate_limiter
+    @ts_rate_limit('index_basic')
     def ts_index_basic(self, market_code: str) -> pd.DataFrame:
         df: pd.DataFrame = ts_pro_api().index_basic(
             market = market_code,
             fields = 'ts_code,name,fullname,market,publisher,index_type,category,base_date,base_point,list_date,weight_rule,desc,exp_date'
         )
-        df['list_date'] = df['list_date'].apply(lambda x: to_datetime64(x))
-        df['exp_date'] = df['exp_date'].apply(lambda x: to_datetime64(x))
+        df['list_date'] = to_datetime_column(df['list_date'])
+        df['exp_date'] = to_datetime_column(df['exp_date'])
         logging.info(
             colorama.Fore.YELLOW + '下载 %s [指数基本信息] 数据, 共 %s 条' % (self.index_markets[market_code], df.shape[0]))
         return df
@@ -88,6 +110,7 @@ class IndexBasic(object):
                 df_list.append(df)
 
             self.dataframe = pd.concat(df_list).drop_duplicates()
+            self.lookup = CodeLookup(self.dataframe, 'ts_code', self.lookup_fields)
 
             self.dataframe.to_csv(
                 path_or_buf = self.file_path(),
@@ -104,12 +127,18 @@ class IndexBasic(object):
         :return:
         """
         self.prepare()
-        df = self.dataframe
-        df = df[df['ts_code'] == index_code]
-        if df.empty:
+        if index_code not in self.lookup:
             raise Exception("找不到该指数代码: %s" % index_code)
-        else:
-            return df.iloc[0].loc['fullname']
+        return self.lookup.get(index_code, 'fullname')
+
+    def names_of_index(self, index_codes: Union[Iterable[str], pd.Series]) -> pd.Series:
+        """
+        批量查询指数的名称, 找不到的代码返回 None
+        :param index_codes:
+        :return: 与 index_codes 对齐的 Series
+        """
+        self.prepare()
+        return self.lookup.bulk(index_codes, 'fullname')
 
     @staticmethod
     def default_index_pool() -> List[str]:
@@ -8,15 +8,23 @@ import colorama
 import pandas as pd
 
 from sz.stock_data.stock_data import StockData
-from sz.stock_data.toolbox.data_provider import ts_code
-from sz.stock_data.toolbox.helper import need_update_by_trade_date
+from sz.stock_data.toolbox.data_provider import bao_code, bao_query, ts_code, ts_codes
+from sz.stock_data.toolbox.datetime import to_datetime_column
+from sz.stock_data.toolbox.helper import need_update_by_manifest, need_update_by_trade_date, upsert_tail
+from sz.stock_data.toolbox.manifest import last_date_of, write_manifest_entry
+from sz.stock_data.toolbox.range_fetcher import bao_range_fetcher
+from sz.stock_data.toolbox.storage import is_slice, read_csv_file, with_columns
 
 
 class IndexDaily(object):
     """
     baostock 能获取2006-01-01至当前时间的数据
     """
+    # 更新之前需要先更新的数据集. 指数列表和指数名称来自 IndexBasic
+    dependencies = ['TradeCalendar', 'IndexBasic']
     base_date = date(year = 2006, month = 1, day = 1)
+    # 按数据密度调整每次查询的日期区间
+    fetcher = bao_range_fetcher('bao_index_daily', rows_per_call = 700, initial_days = 1000)
 
     def __init__(self, data_dir: str, index_code: str):
         self.data_dir = data_dir
@@ -47,23 +55,40 @@ class IndexDaily(object):
         if not os.path.exists(self.file_path()):
             return True
 
+        need_update = need_update_by_manifest(self.file_path())
+        if need_update is not None:
+            return need_update
+
         self.prepare()
 
         return need_update_by_trade_date(self.dataframe, 'date')
 
-    def load(self) -> pd.DataFrame:
+    def load(self, columns: Union[None, List[str]] = None, start: Union[None, str, date] = None,
+             end: Union[None, str, date] = None) -> pd.DataFrame:
+        """
+        :param columns: 只读取指定的字段 (索引字段总是读取), 默认读取全部字段
+        :param start: 只读取 date 不早于这一天的记录
+        :param end: 只读取 date 不晚于这一天的记录
+        :return: 指定了读取范围时只返回数据切片, 不替换 self.dataframe
+        """
         if os.path.exists(self.file_path()):
-            self.dataframe = pd.read_csv(
-                filepath_or_buffer = self.file_path(),
-                parse_dates = ['date']
+            df = read_csv_file(
+                fpath = self.file_path(),
+                parse_dates = ['date'],
+                columns = with_columns(columns, 'date'),
+                date_column = 'date',
+                start = start,
+                end = end
             )
-            self.dataframe.set_index(keys = 'date', drop = False, inplace = True)
-            self.dataframe.sort_index(inplace = True)
+            df.set_index(keys = 'date', drop = False, inplace = True)
+            df.sort_index(inplace = True)
         else:
             logging.warning(colorama.Fore.RED + '本地 [%s 日线] 数据文件不存在,请及时下载更新' % self.index_name)
-            self.dataframe = pd.DataFrame()
+            df = pd.DataFrame()
 
-        return self.dataframe
+        if not is_slice(columns, start, end):
+            self.dataframe = df
+        return df
 
     def prepare(self):
         if self.dataframe is None:
@@ -75,6 +100,10 @@ class IndexDaily(object):
         计算本次更新的起始日期
         :return:
         """
+        last_date = last_date_of(self.file_path())
+        if last_date is not None:
+            return last_date + timedelta(days = 1)
+
         if self.dataframe is None:
             self.load()
 
@@ -83,49 +112,48 @@ class IndexDaily(object):
         else:
             return self.dataframe.iloc[-1].loc['date'].date() + timedelta(days = 1)
 
+    def bao_index_daily(self, start_date: date, end_date: date) -> pd.DataFrame:
+        df = bao_query(
+            bao.query_history_k_data_plus,
+            code = bao_code(self.index_code),
+            start_date = str(start_date),
+            end_date = str(end_date),
+            frequency = 'd',
+            fields = 'date,code,open,high,low,close,preclose,volume,amount,adjustflag,turn,tradestatus,pctChg,peTTM,psTTM,pcfNcfTTM,pbMRQ,isST',
+            adjustflag = '3'
+        )
+        if not df.empty:
+            df['date'] = to_datetime_column(df['date'])
+            df['is_open'] = df['isST'].apply(lambda x: str(x) == '1')
+            df['code'] = ts_codes(df['code'])
+            df.set_index(keys = 'date', drop = False, inplace = True)
+            logging.debug(
+                colorama.Fore.YELLOW + '下载 [%s 日线] 数据, 从 %s 到 %s' % (
+                    self.index_name, str(start_date), str(end_date)))
+        return df
+
     def update(self):
         self._setup_dir_()
-        self.prepare()
 
         if self.should_update():
+            self.prepare()
             start_date: date = self.start_date()
             end_date: date = start_date
             last_trade_day = StockData().trade_calendar.latest_trade_day()
-            df_list: List[pd.DataFrame] = [self.dataframe]
-            step_days = timedelta(days = 1000)
-
-            while start_date <= last_trade_day:
-                end_date = start_date + step_days
-                end_date = min(end_date, last_trade_day)
-                rs = bao.query_history_k_data_plus(
-                    code = self.index_code,
-                    start_date = str(start_date),
-                    end_date = str(end_date),
-                    frequency = 'd',
-                    fields = 'date,code,open,high,low,close,preclose,volume,amount,adjustflag,turn,tradestatus,pctChg,peTTM,psTTM,pcfNcfTTM,pbMRQ,isST',
-                    adjustflag = '3'
-                )
-                df = rs.get_data()
-                if not df.empty:
-                    df['date'] = pd.to_datetime(df['date'], format = '%Y-%m-%d')
-                    df['is_open'] = df['isST'].apply(lambda x: str(x) == '1')
-                    df['code'] = df['code'].apply(lambda x: ts_code(x))
-                    df.set_index(keys = 'date', drop = False, inplace = True)
-                    logging.debug(
-                        colorama.Fore.YELLOW + '下载 [%s 日线] 数据, 从 %s 到 %s' % (
-                            self.index_name, str(start_date), str(end_date)))
+            df_list: List[pd.DataFrame] = []
 
+            for _, end_date, df in self.fetcher.fetch(self.bao_index_daily, start_date, last_trade_day):
+                if not df.empty:
                     df_list.append(df)
 
-                start_date = end_date + timedelta(days = 1)
-
-            self.dataframe = pd.concat(df_list).drop_duplicates()
-            self.dataframe.sort_index(inplace = True)
+            self.dataframe = upsert_tail(self.dataframe, df_list, keys = ['date'], sort_column = 'date')
 
             self.dataframe.to_csv(
                 path_or_buf = self.file_path(),
                 index = False
             )
+
+            write_manifest_entry(self.file_path(), self.dataframe, 'date')
             logging.info(
                 colorama.Fore.YELLOW + '[%s 日线] 数据更新到: %s path: %s' % (
                     self.index_name, str(end_date), self.file_path()))
@@ -8,9 +8,29 @@ import pandas as pd
 
 from sz.stock_data.stock_data import StockData
 from sz.stock_data.toolbox.data_provider import ts_pro_api
-from sz.stock_data.toolbox.datetime import ts_date
-from sz.stock_data.toolbox.helper import mtime_of_file, need_update_by_trade_date
-from sz.stock_data.toolbox.limiter import ts_rate_limiter
+from sz.stock_data.toolbox.date_index import DateOffsetIndex
+from sz.stock_data.toolbox.datetime import to_datetime_column, ts_date
+from sz.stock_data.toolbox.helper import need_update_by_manifest, need_update_by_trade_date, upsert_tail
+from sz.stock_data.toolbox.journal import UpdateJournal
+from sz.stock_data.toolbox.limiter import ts_rate_limit
+from sz.stock_data.toolbox.manifest import last_date_of, write_manifest_entry
+from sz.stock_data.toolbox.range_fetcher import ts_range_fetcher
+from sz.stock_data.toolbox.storage import is_slice, read_csv_file, with_columns
+
+# 成交价 (元) 和成交量 (万股) 也是主键的一部分, 统一保留的小数位数, 避免从 csv 读回的值与新下载的值在末位不同
+key_decimals = {'price': 6, 'vol': 6}
+
+
+def normalize_keys(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    将主键中的浮点字段统一舍入到 key_decimals 位小数
+    :param df:
+    :return:
+    """
+    for column, decimals in key_decimals.items():
+        if column in df.columns:
+            df[column] = df[column].round(decimals)
+    return df
 
 
 class BlockTrade(object):
@@ -18,11 +38,18 @@ class BlockTrade(object):
     大宗交易
     ref: https://tushare.pro/document/2?doc_id=161
     """
+    # 更新之前需要先更新的数据集
+    dependencies = ['TradeCalendar']
     base_date = date(year = 2008, month = 1, day = 2)
+    # 单次调用最多返回 1000 条记录, 按数据密度调整日期区间, 达到上限时拆分区间
+    fetcher = ts_range_fetcher('block_trade', initial_days = 10)
 
     def __init__(self, data_dir: str):
         self.data_dir = data_dir
         self.dataframe: Union[pd.DataFrame, None] = None
+        self.journal = UpdateJournal(self.file_path())
+        # 按交易日读取时使用的日期索引
+        self.date_index = DateOffsetIndex(self.file_path(), 'trade_date')
 
     def _setup_dir_(self):
         """
@@ -47,36 +74,72 @@ class BlockTrade(object):
         if not os.path.exists(self.file_path()):
             return True
 
+        need_update = need_update_by_manifest(self.file_path())
+        if need_update is not None:
+            return need_update
+
         self.prepare()
 
         return need_update_by_trade_date(self.dataframe, 'trade_date')
 
-    def load(self) -> pd.DataFrame:
+    def load(self, columns: Union[None, List[str]] = None, start: Union[None, str, date] = None,
+             end: Union[None, str, date] = None) -> pd.DataFrame:
         """
         从数据文件加载
-        :return:
+        :param columns: 只读取指定的字段 (索引字段总是读取), 默认读取全部字段
+        :param start: 只读取 trade_date 不早于这一天的记录
+        :param end: 只读取 trade_date 不晚于这一天的记录
+        :return: 指定了读取范围时只返回数据切片, 不替换 self.dataframe
         """
         if os.path.exists(self.file_path()):
-            self.dataframe = pd.read_csv(
-                filepath_or_buffer = self.file_path(),
-                parse_dates = ['trade_date']
+            df = read_csv_file(
+                fpath = self.file_path(),
+                parse_dates = ['trade_date'],
+                columns = with_columns(columns, 'trade_date'),
+                date_column = 'trade_date',
+                start = start,
+                end = end
             )
-            self.dataframe.sort_values(by = 'trade_date', inplace = True)
+            df.sort_values(by = 'trade_date', inplace = True)
+            normalize_keys(df)
         else:
-            self.dataframe = pd.DataFrame()
+            df = pd.DataFrame()
 
-        return self.dataframe
+        if not is_slice(columns, start, end):
+            self.dataframe = df
+        return df
 
     def prepare(self):
         if self.dataframe is None:
             self.load()
         return self
 
+    def on(self, trade_date: Union[str, date]) -> pd.DataFrame:
+        """
+        读取一个交易日的全部记录, 只读取数据文件中当天的部分
+        :param trade_date:
+        :return:
+        """
+        return self.between(trade_date, trade_date)
+
+    def between(self, start: Union[str, date], end: Union[str, date]) -> pd.DataFrame:
+        """
+        读取 [start, end] 之间的记录, 参考 DateOffsetIndex
+        :param start:
+        :param end:
+        :return:
+        """
+        return self.date_index.read(start, end, parse_dates = ['trade_date'])
+
     def start_date(self) -> date:
         """
         计算本次更新的起始日期
         :return:
         """
+        last_date = last_date_of(self.file_path())
+        if last_date is not None:
+            return last_date + timedelta(days = 1)
+
         self.prepare()
 
         if self.dataframe.empty:
@@ -84,18 +147,15 @@ class BlockTrade(object):
         else:
             return self.dataframe.iloc[-1].loc['trade_date'].date() + timedelta(days = 1)
 
-    @ts_rate_limiter
+    @ts_rate_limit('block_trade')
     def ts_block_trade(self, start_date: date, end_date: date) -> pd.DataFrame:
         df: pd.DataFrame = ts_pro_api().block_trade(
             start_date = ts_date(start_date),
             end_date = ts_date(end_date)
         )
         if not df.empty:
-            df['trade_date'] = pd.to_datetime(df['trade_date'], format = '%Y%m%d')
+            df['trade_date'] = to_datetime_column(df['trade_date'])
             df.sort_values(by = 'trade_date', inplace = True)
-            row_count = df.shape[0]
-            if row_count == 1000:
-                raise Exception('超出记录条数上限[1000], %s -- %s' % (start_date, end_date))
             logging.info(colorama.Fore.YELLOW + '下载 [大宗交易] 数据: %s -- %s %s条' % (start_date, end_date, df.shape[0]))
         else:
             logging.info(colorama.Fore.YELLOW + '[大宗交易] : %s -- %s 无数据' % (start_date, end_date))
@@ -103,34 +163,41 @@ class BlockTrade(object):
 
     def update(self):
         self._setup_dir_()
-        self.prepare()
 
         if self.should_update():
-            start_date: date = self.start_date()
+            self.prepare()
+            # 断点日志中已经下载完成的日期区间直接读取
+            df_list, start_date = self.journal.resume(self.start_date())
             end_date: date = start_date
             last_trade_day = StockData().trade_calendar.latest_trade_day()
-            df_list: List[pd.DataFrame] = [self.dataframe]
-            step_days = timedelta(days = 10)
 
+            completed = False
             try:
-                while start_date <= last_trade_day:
-                    end_date = start_date + step_days
-                    end_date = min(end_date, last_trade_day)
-                    df = self.ts_block_trade(start_date = start_date, end_date = end_date)
+                for chunk_start, end_date, df in self.fetcher.fetch(self.ts_block_trade, start_date, last_trade_day):
+                    self.journal.checkpoint(chunk_start, end_date, df)
                     df_list.append(df)
-                    start_date = end_date + timedelta(days = 1)
+                completed = True
             except Exception as ex:
                 logging.warning('更新 [大宗交易] 发生异常中断: %s' % ex)
                 raise ex
             finally:
-                self.dataframe = pd.concat(df_list).drop_duplicates()
-                self.dataframe.sort_values(by = 'trade_date', inplace = True)
+                # 断点日志中读回的分块和新下载的分块都要统一舍入, 才能与历史记录的主键比较
+                self.dataframe = upsert_tail(self.dataframe, [normalize_keys(df) for df in df_list],
+                                             keys = ['trade_date', 'ts_code', 'price', 'vol', 'buyer', 'seller'],
+                                             sort_column = 'trade_date')
 
                 self.dataframe.to_csv(
                     path_or_buf = self.file_path(),
                     index = False
                 )
 
+                write_manifest_entry(self.file_path(), self.dataframe, 'trade_date')
+                self.date_index.build(self.dataframe['trade_date'])
+
+                # 下载中断时保留断点日志, 以 resume 方式重新运行时从断点继续
+                if completed:
+                    self.journal.clear()
+
                 logging.info(
                     colorama.Fore.YELLOW + '[大宗交易] 数据更新到: %s path: %s' % (end_date, self.file_path()))
         else:
@@ -1,16 +1,22 @@
 import logging
 import os
+from datetime import date
 from typing import Union, List
 
 import colorama
 import pandas as pd
 
 from sz.stock_data.toolbox.data_provider import ts_pro_api
-from sz.stock_data.toolbox.helper import need_update
-from sz.stock_data.toolbox.limiter import ts_rate_limiter
+from sz.stock_data.toolbox.datetime import normalize_dates
+from sz.stock_data.toolbox.helper import need_update, upsert_tail
+from sz.stock_data.toolbox.limiter import ts_rate_limit
+from sz.stock_data.toolbox.membership import MembershipIndex
+from sz.stock_data.toolbox.storage import is_slice, read_csv_file, with_columns
 
 
 class StockConcept(object):
+    # 更新之前需要先更新的数据集
+    dependencies = []
 
     def __init__(self, data_dir: str):
         self.data_dir = data_dir
@@ -37,38 +43,61 @@ class StockConcept(object):
         """
         return need_update(self.file_path(), 7)
 
-    def load(self) -> pd.DataFrame:
+    def load(self, columns: Union[None, List[str]] = None, start: Union[None, str, date] = None,
+             end: Union[None, str, date] = None) -> pd.DataFrame:
+        """
+        :param columns: 只读取指定的字段 (索引字段总是读取), 默认读取全部字段
+        :param start: 只读取 in_date 不早于这一天的记录
+        :param end: 只读取 in_date 不晚于这一天的记录
+        :return: 指定了读取范围时只返回数据切片, 不替换 self.dataframe
+        """
         if os.path.exists(self.file_path()):
-            self.dataframe = pd.read_csv(
-                filepath_or_buffer = self.file_path(),
-                parse_dates = ['in_date', 'out_date']
+            df = read_csv_file(
+                fpath = self.file_path(),
+                parse_dates = ['in_date', 'out_date'],
+                columns = with_columns(columns, 'id'),
+                date_column = 'in_date',
+                start = start,
+                end = end
             )
-            self.dataframe.set_index(keys = 'id', drop = False, inplace = True)
-            self.dataframe.sort_index(inplace = True)
+            df.set_index(keys = 'id', drop = False, inplace = True)
+            df.sort_index(inplace = True)
         else:
             logging.warning(colorama.Fore.RED + '[概念股列表] 本地数据文件不存在,请及时下载更新')
-            self.dataframe = pd.DataFrame()
+            df = pd.DataFrame()
 
-        return self.dataframe
+        if not is_slice(columns, start, end):
+            self.dataframe = df
+        return df
 
     def prepare(self):
         if self.dataframe is None:
             self.load()
         return self
 
-    @ts_rate_limiter
+    def membership(self) -> MembershipIndex:
+        """
+        概念与股票的双向成员索引, 按纳入日期和剔除日期判断成员关系是否有效
+        :return:
+        """
+        self.prepare()
+        return MembershipIndex(self.dataframe, group_column = 'id', code_column = 'ts_code',
+                               name_column = 'concept_name', in_column = 'in_date', out_column = 'out_date')
+
+    @ts_rate_limit('concept')
     def ts_concept(self) -> pd.DataFrame:
         df: pd.DataFrame = ts_pro_api().concept(
             src = 'ts'
         )
         return df
 
-    @ts_rate_limiter
+    @ts_rate_limit('concept_detail')
     def ts_concept_detail(self, concept_id: str, concept_name: str) -> pd.DataFrame:
         df: pd.DataFrame = ts_pro_api().concept_detail(
             id = concept_id,
             fields = 'id,concept_name,ts_code,name,in_date,out_date'
         )
+        normalize_dates(df, ['in_date', 'out_date'])
         logging.info(colorama.Fore.YELLOW + '下载 [概念股列表] - %s 共 %s 条' % (concept_name, df.shape[0]))
         return df
 
@@ -77,7 +106,7 @@ class StockConcept(object):
         self.prepare()
 
         if self.should_update():
-            df_list: List[pd.DataFrame] = [self.dataframe]
+            df_list: List[pd.DataFrame] = []
             try:
                 df_concept = self.ts_concept()
                 for index in range(0, df_concept.shape[0]):
@@ -91,8 +120,8 @@ class StockConcept(object):
                 raise ex
 
             finally:
-                if len(df_list) > 1:
-                    self.dataframe = pd.concat(df_list).drop_duplicates()
+                if len(df_list) > 0:
+                    self.dataframe = upsert_tail(self.dataframe, df_list, keys = ['id', 'ts_code'])
                     self.dataframe.set_index(keys = 'id', drop = False, inplace = True)
                     self.dataframe.sort_index(inplace = True)
 
@@ -8,9 +8,12 @@ import pandas as pd
 
 from sz.stock_data.stock_data import StockData
 from sz.stock_data.toolbox.data_provider import ts_pro_api
-from sz.stock_data.toolbox.datetime import to_datetime64, ts_date
-from sz.stock_data.toolbox.helper import need_update_by_trade_date
-from sz.stock_data.toolbox.limiter import ts_rate_limiter
+from sz.stock_data.toolbox.datetime import to_datetime_column, ts_date
+from sz.stock_data.toolbox.helper import need_update_by_manifest, need_update_by_trade_date, upsert_tail
+from sz.stock_data.toolbox.limiter import ts_rate_limit
+from sz.stock_data.toolbox.manifest import last_date_of, write_manifest_entry
+from sz.stock_data.toolbox.range_fetcher import ts_range_fetcher
+from sz.stock_data.toolbox.storage import is_slice, read_csv_file, with_columns
 
 
 class StockMargin(object):
@@ -18,8 +21,12 @@ class StockMargin(object):
     融资融券交易汇总
     ref: https://tushare.pro/document/2?doc_id=58
     """
+    # 更新之前需要先更新的数据集
+    dependencies = ['TradeCalendar']
 
     base_date = date(year = 2014, month = 9, day = 22)
+    # 按数据密度调整每次下载的日期区间
+    fetcher = ts_range_fetcher('margin', initial_days = 365)
 
     def __init__(self, data_dir: str):
         self.data_dir = data_dir
@@ -48,25 +55,39 @@ class StockMargin(object):
         if not os.path.exists(self.file_path()):
             return True
 
+        need_update = need_update_by_manifest(self.file_path())
+        if need_update is not None:
+            return need_update
+
         self.prepare()
 
         return need_update_by_trade_date(self.dataframe, 'trade_date')
 
-    def load(self) -> pd.DataFrame:
+    def load(self, columns: Union[None, List[str]] = None, start: Union[None, str, date] = None,
+             end: Union[None, str, date] = None) -> pd.DataFrame:
         """
         从数据文件加载
-        :return:
+        :param columns: 只读取指定的字段 (索引字段总是读取), 默认读取全部字段
+        :param start: 只读取 trade_date 不早于这一天的记录
+        :param end: 只读取 trade_date 不晚于这一天的记录
+        :return: 指定了读取范围时只返回数据切片, 不替换 self.dataframe
         """
         if os.path.exists(self.file_path()):
-            self.dataframe = pd.read_csv(
-                filepath_or_buffer = self.file_path(),
-                parse_dates = ['trade_date']
+            df = read_csv_file(
+                fpath = self.file_path(),
+                parse_dates = ['trade_date'],
+                columns = with_columns(columns, 'trade_date'),
+                date_column = 'trade_date',
+                start = start,
+                end = end
             )
-            self.dataframe.sort_values(by = 'trade_date', inplace = True)
+            df.sort_values(by = 'trade_date', inplace = True)
         else:
-            self.dataframe = pd.DataFrame()
+            df = pd.DataFrame()
 
-        return self.dataframe
+        if not is_slice(columns, start, end):
+            self.dataframe = df
+        return df
 
     def prepare(self):
         if self.dataframe is None:
@@ -74,13 +95,13 @@ class StockMargin(object):
         return self
 
     @staticmethod
-    @ts_rate_limiter
+    @ts_rate_limit('margin')
     def ts_margin(start_date: date, end_date: date) -> pd.DataFrame:
         df: pd.DataFrame = ts_pro_api().margin(
             start_date = ts_date(start_date),
             end_date = ts_date(end_date)
         )
-        df['trade_date'] = df['trade_date'].apply(lambda x: to_datetime64(x))
+        df['trade_date'] = to_datetime_column(df['trade_date'])
         df.sort_values(by = 'trade_date', inplace = True)
         logging.info(colorama.Fore.YELLOW + '下载 [融资融券每日交易汇总] 数据: %s - %s, 共 %s 条' % (start_date, end_date, df.shape[0]))
         return df
@@ -90,6 +111,10 @@ class StockMargin(object):
         计算本次更新的起始日期
         :return:
         """
+        last_date = last_date_of(self.file_path())
+        if last_date is not None:
+            return last_date + timedelta(days = 1)
+
         self.prepare()
 
         if self.dataframe.empty:
@@ -99,39 +124,36 @@ class StockMargin(object):
 
     def update(self):
         self._setup_dir_()
-        self.prepare()
 
         if self.should_update():
+            self.prepare()
             start_date: date = self.start_date()
             end_date: date = start_date
             last_trade_day = StockData().trade_calendar.latest_trade_day()
-            df_list: List[pd.DataFrame] = [self.dataframe]
-            step_days = timedelta(days = 365)
+            df_list: List[pd.DataFrame] = []
 
             try:
-                while start_date <= last_trade_day:
-                    end_date = start_date + step_days
-                    end_date = min(end_date, last_trade_day)
-                    df = self.ts_margin(start_date, end_date)
+                for _, end_date, df in self.fetcher.fetch(self.ts_margin, start_date, last_trade_day):
                     if not df.empty:
                         df_list.append(df)
 
-                    start_date = end_date + timedelta(days = 1)
-
             except Exception as ex:
                 logging.warning('更新 [融资融券每日交易汇总] 发生异常中断: %s' % ex)
                 raise ex
 
             finally:
-                if len(df_list) > 1:
-                    self.dataframe = pd.concat(df_list).drop_duplicates()
-                    self.dataframe.sort_values(by = 'trade_date', inplace = True)
+                if len(df_list) > 0:
+                    self.dataframe = upsert_tail(self.dataframe, df_list,
+                                                 keys = ['trade_date', 'exchange_id'],
+                                                 sort_column = 'trade_date')
 
                     self.dataframe.to_csv(
                         path_or_buf = self.file_path(),
                         index = False
                     )
 
+                    write_manifest_entry(self.file_path(), self.dataframe, 'trade_date')
+
                     logging.info(
                         colorama.Fore.YELLOW + '[融资融券每日交易汇总] 数据更新到: %s path: %s' % (end_date, self.file_path()))
                 else:
@@ -8,9 +8,13 @@ import pandas as pd
 
 from sz.stock_data.stock_data import StockData
 from sz.stock_data.toolbox.data_provider import ts_pro_api
-from sz.stock_data.toolbox.datetime import to_datetime64, ts_date
-from sz.stock_data.toolbox.helper import mtime_of_file, need_update_by_trade_date
-from sz.stock_data.toolbox.limiter import ts_rate_limiter
+from sz.stock_data.toolbox.date_index import DateOffsetIndex
+from sz.stock_data.toolbox.datetime import to_datetime_column, ts_date
+from sz.stock_data.toolbox.helper import need_update_by_manifest, need_update_by_trade_date, upsert_tail
+from sz.stock_data.toolbox.journal import UpdateJournal
+from sz.stock_data.toolbox.limiter import ts_rate_limit
+from sz.stock_data.toolbox.manifest import last_date_of, write_manifest_entry
+from sz.stock_data.toolbox.storage import is_slice, read_csv_file, with_columns
 
 
 class StockMarginDetail(object):
@@ -18,12 +22,17 @@ class StockMarginDetail(object):
     融资融券交易明细
     ref: https://tushare.pro/document/2?doc_id=59
     """
+    # 更新之前需要先更新的数据集
+    dependencies = ['TradeCalendar']
 
     base_date = date(year = 2014, month = 9, day = 22)
 
     def __init__(self, data_dir: str):
         self.data_dir = data_dir
         self.dataframe: Union[pd.DataFrame, None] = None
+        self.journal = UpdateJournal(self.file_path())
+        # 按交易日读取时使用的日期索引
+        self.date_index = DateOffsetIndex(self.file_path(), 'trade_date')
 
     def _setup_dir_(self):
         """
@@ -48,40 +57,71 @@ class StockMarginDetail(object):
         if not os.path.exists(self.file_path()):
             return True
 
+        need_update = need_update_by_manifest(self.file_path())
+        if need_update is not None:
+            return need_update
+
         self.prepare()
 
         return need_update_by_trade_date(self.dataframe, 'trade_date')
 
-    def load(self) -> pd.DataFrame:
+    def load(self, columns: Union[None, List[str]] = None, start: Union[None, str, date] = None,
+             end: Union[None, str, date] = None) -> pd.DataFrame:
         """
         从数据文件加载
-        :return:
+        :param columns: 只读取指定的字段 (索引字段总是读取), 默认读取全部字段
+        :param start: 只读取 trade_date 不早于这一天的记录
+        :param end: 只读取 trade_date 不晚于这一天的记录
+        :return: 指定了读取范围时只返回数据切片, 不替换 self.dataframe
         """
         if os.path.exists(self.file_path()):
-            self.dataframe = pd.read_csv(
-                filepath_or_buffer = self.file_path(),
-                parse_dates = ['trade_date']
+            df = read_csv_file(
+                fpath = self.file_path(),
+                parse_dates = ['trade_date'],
+                columns = with_columns(columns, 'trade_date'),
+                date_column = 'trade_date',
+                start = start,
+                end = end
             )
-            self.dataframe.sort_values(by = 'trade_date', inplace = True)
+            df.sort_values(by = 'trade_date', inplace = True)
         else:
-            self.dataframe = pd.DataFrame()
+            df = pd.DataFrame()
 
-        return self.dataframe
+        if not is_slice(columns, start, end):
+            self.dataframe = df
+        return df
 
     def prepare(self):
         if self.dataframe is None:
             self.load()
         return self
 
+    def on(self, trade_date: Union[str, date]) -> pd.DataFrame:
+        """
+        读取一个交易日的全部记录, 只读取数据文件中当天的部分
+        :param trade_date:
+        :return:
+        """
+        return self.between(trade_date, trade_date)
+
+    def between(self, start: Union[str, date], end: Union[str, date]) -> pd.DataFrame:
+        """
+        读取 [start, end] 之间的记录, 参考 DateOffsetIndex
+        :param start:
+        :param end:
+        :return:
+        """
+        return self.date_index.read(start, end, parse_dates = ['trade_date'])
+
     @staticmethod
-    @ts_rate_limiter
+    @ts_rate_limit('margin_detail')
     def ts_margin_detail(trade_date: date) -> pd.DataFrame:
         # 只取1个交易日的数据, 以保证数据记录数不会超过上限(经过测试观察为 2000 条)
         df: pd.DataFrame = ts_pro_api().margin_detail(
             start_date = ts_date(trade_date),
             end_date = ts_date(trade_date)
         )
-        df['trade_date'] = df['trade_date'].apply(lambda x: to_datetime64(x))
+        df['trade_date'] = to_datetime_column(df['trade_date'])
         df.sort_values(by = 'trade_date', inplace = True)
         logging.info(colorama.Fore.YELLOW + '下载 [融资融券交易明细] %s 数据: 共 %s 条' % (trade_date, df.shape[0]))
         return df
@@ -91,6 +131,10 @@ class StockMarginDetail(object):
         计算本次更新的起始日期
         :return:
         """
+        last_date = last_date_of(self.file_path())
+        if last_date is not None:
+            return last_date + timedelta(days = 1)
+
         self.prepare()
 
         if self.dataframe.empty:
@@ -100,40 +144,50 @@ class StockMarginDetail(object):
 
     def update(self):
         self._setup_dir_()
-        self.prepare()
 
         if self.should_update():
+            self.prepare()
             last_trade_day = StockData().trade_calendar.latest_trade_day()
-            df_list: List[pd.DataFrame] = [self.dataframe]
-
+            # 断点日志中已经下载完成的交易日直接读取
+            df_list, start_date = self.journal.resume(self.start_date())
             trad_date_list = StockData().trade_calendar.trade_day_between(
-                from_date = self.start_date(),
+                from_date = start_date,
                 to_date = last_trade_day
             )
 
+            completed = False
             try:
                 for trade_date in trad_date_list:
                     df = self.ts_margin_detail(trade_date)
-                    if not df.shape:
+                    self.journal.checkpoint(trade_date, trade_date, df)
+                    if not df.empty:
                         df_list.append(df)
+                completed = True
 
             except Exception as ex:
                 logging.warning('更新 [融资融券交易明细] 发生异常中断: %s' % ex)
                 raise ex
 
             finally:
-                if len(df_list) > 1:
-                    self.dataframe = pd.concat(df_list).drop_duplicates()
-                    self.dataframe.sort_values(by = 'trade_date', inplace = True)
+                if len(df_list) > 0:
+                    self.dataframe = upsert_tail(self.dataframe, df_list,
+                                                 keys = ['trade_date', 'ts_code'],
+                                                 sort_column = 'trade_date')
 
                     self.dataframe.to_csv(
                         path_or_buf = self.file_path(),
                         index = False
                     )
 
+                    write_manifest_entry(self.file_path(), self.dataframe, 'trade_date')
+                    self.date_index.build(self.dataframe['trade_date'])
+
                     logging.info(
                         colorama.Fore.YELLOW + '[融资融券交易明细] 数据更新到: %s path: %s' % (last_trade_day, self.file_path()))
                 else:
                     logging.info(colorama.Fore.BLUE + '[融资融券交易明细] 数据无须更新')
+                # 下载中断时保留断点日志, 以 resume 方式重新运行时从断点继续
+                if completed:
+                    self.journal.clear()
         else:
             logging.info(colorama.Fore.BLUE + '[融资融券交易明细] 数据无须更新')
@@ -1,13 +1,17 @@
 import logging
 import os
-from typing import Union
+from datetime import date
+from typing import Union, List
 
 import baostock as bao
 import colorama
 import pandas as pd
 
-from sz.stock_data.toolbox.data_provider import ts_code
+from sz.stock_data.toolbox.data_provider import bao_query, ts_codes
+from sz.stock_data.toolbox.datetime import to_datetime_column
 from sz.stock_data.toolbox.helper import need_update
+from sz.stock_data.toolbox.membership import MembershipIndex
+from sz.stock_data.toolbox.storage import is_slice, read_csv_file, with_columns
 
 
 class StockIndustry(object):
@@ -15,6 +19,9 @@ class StockIndustry(object):
     业分类信息，更新频率：每周一更新
     ref: http://baostock.com/baostock/index.php/%E8%A1%8C%E4%B8%9A%E5%88%86%E7%B1%BB
     """
+    # 更新之前需要先更新的数据集
+    dependencies = []
+
     def __init__(self, data_dir: str):
         self.data_dir: str = data_dir
         self.dataframe: Union[pd.DataFrame, None] = None
@@ -40,33 +47,55 @@ class StockIndustry(object):
         """
         return need_update(self.file_path(), 7)
 
-    def load(self) -> pd.DataFrame:
+    def load(self, columns: Union[None, List[str]] = None, start: Union[None, str, date] = None,
+             end: Union[None, str, date] = None) -> pd.DataFrame:
+        """
+        :param columns: 只读取指定的字段 (索引字段总是读取), 默认读取全部字段
+        :param start: 只读取 updateDate 不早于这一天的记录
+        :param end: 只读取 updateDate 不晚于这一天的记录
+        :return: 指定了读取范围时只返回数据切片, 不替换 self.dataframe
+        """
         if os.path.exists(self.file_path()):
-            self.dataframe = pd.read_csv(
-                filepath_or_buffer = self.file_path(),
-                parse_dates = ['updateDate']
+            df = read_csv_file(
+                fpath = self.file_path(),
+                parse_dates = ['updateDate'],
+                columns = with_columns(columns, 'code'),
+                date_column = 'updateDate',
+                start = start,
+                end = end
             )
-            self.dataframe.set_index(keys = 'code', drop = False, inplace = True)
-            self.dataframe.sort_index(inplace = True)
+            df.set_index(keys = 'code', drop = False, inplace = True)
+            df.sort_index(inplace = True)
         else:
             logging.warning(colorama.Fore.RED + '[行业分类信息] 本地数据文件不存在,请及时下载更新')
-            self.dataframe = pd.DataFrame()
+            df = pd.DataFrame()
 
-        return self.dataframe
+        if not is_slice(columns, start, end):
+            self.dataframe = df
+        return df
 
     def prepare(self):
         if self.dataframe is None:
             self.load()
         return self
 
+    def membership(self) -> MembershipIndex:
+        """
+        行业与股票的双向成员索引. 行业分类只有最新的快照, 成员关系没有有效区间
+        :return:
+        """
+        self.prepare()
+        return MembershipIndex(self.dataframe, group_column = 'industry', code_column = 'code')
+
     @staticmethod
     def bao_query_stock_industry() -> pd.DataFrame:
         """
         获取行业分类信息
         :return:
         """
-        df = bao.query_stock_industry().get_data()
-        df['code'] = df['code'].apply(lambda x: ts_code(x))
+        df = bao_query(bao.query_stock_industry)
+        df['code'] = ts_codes(df['code'])
+        df['updateDate'] = to_datetime_column(df['updateDate'])
         df.set_index(keys = 'code', drop = False, inplace = True)
         return df
 
@@ -0,0 +1,236 @@
+import logging
+import os
+from datetime import date, timedelta
+from typing import Union, List, Dict
+
+import colorama
+import numpy as np
+import pandas as pd
+
+from sz.stock_data.stock_data import StockData
+from sz.stock_data.stocks.stock_daily import StockDaily
+from sz.stock_data.toolbox.data_provider import ts_code
+from sz.stock_data.toolbox.manifest import read_manifest_entry
+from sz.stock_data.toolbox.segment import SegmentStore
+from sz.stock_data.toolbox.storage import data_file, read_dataframe, write_dataframe
+
+
+class DailyPanel(object):
+    """
+    全市场日线面板数据, 以 (date, code_id) 为主键, 按年份分段保存在 panel/daily/segments/ 目录下
+    code_id 为股票代码在代码字典 (symbols) 中的序号, 代码字典同时记录每只股票在面板中的最后日期
+    每日更新只追加各股票新增或者被修正的日线记录, 不重写历史分段; 同一主键追加多次时, 读取和合并分段时以最后追加的为准
+    """
+    # 更新之前需要先更新的数据集
+    dependencies = ['StockDaily']
+    fields = StockDaily.numeric_fields
+    # 个股日线有变化时, 重新比较面板最后日期之前这些天的记录, 发现修正的记录
+    overlap_days = 30
+    symbol_columns = ['code_id', 'ts_code', 'last_date', 'checksum', 'row_count']
+
+    def __init__(self, data_dir: str):
+        self.data_dir = data_dir
+        self.symbols: Union[pd.DataFrame, None] = None
+        self.segments = SegmentStore(dir_path = os.path.join(self.dir_path(), 'segments'), time_column = 'date',
+                                     key_columns = ['date', 'code_id'])
+
+    def dir_path(self) -> str:
+        """
+        返回保存面板数据的目录
+        :return:
+        """
+        return os.path.join(self.data_dir, 'panel', 'daily')
+
+    def symbols_path(self) -> str:
+        """
+        返回代码字典的文件路径
+        :return:
+        """
+        return data_file(os.path.join(self.dir_path(), 'symbols'))
+
+    def _setup_dir_(self):
+        """
+        初始化数据目录
+        :return:
+        """
+        os.makedirs(self.dir_path(), exist_ok = True)
+
+    def load_symbols(self) -> pd.DataFrame:
+        if os.path.exists(self.symbols_path()):
+            self.symbols = read_dataframe(fpath = self.symbols_path(), parse_dates = ['last_date'],
+                                          dtype = {'checksum': str})
+            # 早期的代码字典没有记录个股日线的清单信息, 缺少的字段为空, 下次更新时补齐
+            self.symbols = self.symbols.reindex(columns = self.symbol_columns)
+            self.symbols['checksum'] = self.symbols['checksum'].astype(object)
+            self.symbols.set_index(keys = 'ts_code', drop = False, inplace = True)
+        else:
+            self.symbols = pd.DataFrame(columns = self.symbol_columns)
+        return self.symbols
+
+    def prepare(self):
+        if self.symbols is None:
+            self.load_symbols()
+        return self
+
+    def code_id_of(self, stock_code: str) -> int:
+        """
+        返回股票代码在代码字典中的序号, 不存在时新增
+        :param stock_code:
+        :return:
+        """
+        self.prepare()
+        if stock_code not in self.symbols.index:
+            self.symbols.loc[stock_code] = [len(self.symbols), stock_code, pd.NaT, None, np.nan]
+        return int(self.symbols.loc[stock_code, 'code_id'])
+
+    def update(self, stock_codes: Union[None, List[str]] = None):
+        """
+        将各股票本地日线数据中, 面板里还没有的记录和被修正的记录追加到面板.
+        个股日线的清单校验值没有变化时跳过; 有变化时读取面板最后日期之前 overlap_days 天开始的记录,
+        与面板比较找出修正的记录. 个股日线的记录数与新增记录对不上时 (之前的日期插入或者删除了记录), 重新生成该股票的全部记录
+        :param stock_codes: 默认为沪深300和中证500成分股
+        :return:
+        """
+        self._setup_dir_()
+        self.prepare()
+        if stock_codes is None:
+            stock_codes = list(StockData().hs300.stock_codes()) + list(StockData().zz500.stock_codes())
+
+        df_list: List[pd.DataFrame] = []
+        overlap_list: List[pd.DataFrame] = []
+        rebuilt: List[int] = []
+        for stock_code in stock_codes:
+            stock_code = ts_code(stock_code)
+            code_id = self.code_id_of(stock_code)
+            daily = StockDaily(data_dir = self.data_dir, stock_code = stock_code)
+            entry = read_manifest_entry(daily.file_path())
+            if entry is not None and entry['checksum'] == self.symbols.loc[stock_code, 'checksum']:
+                continue
+
+            last_date = self.symbols.loc[stock_code, 'last_date']
+            start = None if pd.isnull(last_date) else last_date - timedelta(days = self.overlap_days)
+            df = daily.load(columns = self.fields, start = start)
+            if not pd.isnull(last_date):
+                is_new = df['date'] > last_date if not df.empty else pd.Series([], dtype = bool)
+                row_count = self.symbols.loc[stock_code, 'row_count']
+                if entry is not None and not pd.isnull(row_count) and entry['row_count'] != row_count + is_new.sum():
+                    logging.info(colorama.Fore.YELLOW + '[日线面板] %s 日线记录数有变化, 重新生成该股票的记录' % stock_code)
+                    df = daily.load(columns = self.fields)
+                    rebuilt.append(code_id)
+                elif not df.empty:
+                    overlap_list.append(self._panel_rows_(df[~is_new.values], code_id))
+                    df = df[is_new.values]
+
+            if entry is not None:
+                self.symbols.loc[stock_code, 'checksum'] = entry['checksum']
+                self.symbols.loc[stock_code, 'row_count'] = entry['row_count']
+            if df.empty:
+                continue
+            df_list.append(self._panel_rows_(df, code_id))
+            self.symbols.loc[stock_code, 'last_date'] = max(df['date'].max(), last_date) \
+                if not pd.isnull(last_date) else df['date'].max()
+
+        corrected = self._changed_rows_(overlap_list)
+        if not corrected.empty:
+            df_list.append(corrected)
+
+        if len(df_list) > 0:
+            df_new = pd.concat(df_list, ignore_index = True).sort_values(by = ['date', 'code_id'])
+            if len(rebuilt) > 0:
+                self._rewrite_(df_new, rebuilt)
+            else:
+                self.segments.append(df_new)
+                self.segments.compact_if_needed()
+            logging.info(colorama.Fore.YELLOW + '[日线面板] 写入 %s 条记录 (修正 %s 条, 重新生成 %s 只股票), 数据更新到: %s path: %s' % (
+                df_new.shape[0], corrected.shape[0], len(rebuilt), df_new['date'].max().date(), self.dir_path()))
+        else:
+            logging.info(colorama.Fore.BLUE + '[日线面板] 数据无须更新')
+        write_dataframe(self.symbols, self.symbols_path())
+
+    def _rewrite_(self, df_new: pd.DataFrame, rebuilt: List[int]):
+        """
+        个股日线在之前的日期插入或者删除了记录时, 删除面板中这些股票的全部记录, 与新记录一起重写全部年度分段.
+        只在这种少见的情况下重写历史分段; 年度分段逐个替换之后才删除追加分段和不再需要的年度分段
+        :param df_new: 本次写入的记录
+        :param rebuilt: 需要重新生成的股票 code_id
+        :return:
+        """
+        df = self.segments.load(parse_dates = ['date'])
+        if not df.empty:
+            df = df[~df['code_id'].isin(rebuilt)]
+        df = pd.concat([df, df_new], ignore_index = True)
+        df = df.drop_duplicates(subset = ['date', 'code_id'], keep = 'last').sort_values(by = ['date', 'code_id'])
+        stale = self.segments.year_segments() + self.segments.tail_segments()
+        self.segments.write_all(df)
+        written = set(self.segments.year_segment_path(year) for year in pd.DatetimeIndex(df['date']).year.unique())
+        for fpath in stale:
+            if fpath not in written:
+                os.remove(fpath)
+
+    def _panel_rows_(self, df: pd.DataFrame, code_id: int) -> pd.DataFrame:
+        """
+        个股日线转换为面板记录: date, code_id, 各字段
+        """
+        df = df[['date'] + self.fields].reset_index(drop = True)
+        df.insert(1, 'code_id', np.int32(code_id))
+        return df
+
+    def _changed_rows_(self, overlap_list: List[pd.DataFrame]) -> pd.DataFrame:
+        """
+        与面板中已有的记录比较, 返回值有变化或者面板中没有的记录. 从 csv 读回的浮点数末位可能不同, 按相对误差比较
+        :param overlap_list: 各股票面板最后日期之前的记录
+        :return:
+        """
+        overlap_list = [df for df in overlap_list if not df.empty]
+        if len(overlap_list) == 0:
+            return pd.DataFrame()
+        df_overlap = pd.concat(overlap_list, ignore_index = True)
+        df_panel = self.segments.load(parse_dates = ['date'], columns = ['date', 'code_id'] + self.fields,
+                                      start = df_overlap['date'].min(), end = df_overlap['date'].max())
+        if df_panel.empty:
+            return df_overlap
+        df_panel['code_id'] = df_panel['code_id'].astype(np.int32)
+        merged = df_overlap.merge(df_panel, on = ['date', 'code_id'], how = 'left', suffixes = ('', '_panel'),
+                                  indicator = True)
+        changed = (merged['_merge'] != 'both').values
+        for field in self.fields:
+            changed |= ~np.isclose(merged[field].values.astype(np.float64),
+                                   merged[field + '_panel'].values.astype(np.float64),
+                                   rtol = 1e-9, atol = 0.0, equal_nan = True)
+        return df_overlap[changed]
+
+    def read(self, fields: List[str], start_date: date, end_date: date,
+             stock_codes: Union[None, List[str]] = None) -> Dict[str, pd.DataFrame]:
+        """
+        读取指定日期区间内的面板数据
+        :param fields: 字段列表, 例如 ['close', 'volume']
+        :param start_date:
+        :param end_date:
+        :param stock_codes: 默认为面板中的全部股票
+        :return: 字段名 -> DataFrame(index = 交易日, columns = 股票代码), 各字段的行列对齐
+        """
+        self.prepare()
+        if stock_codes is None:
+            stock_codes = list(self.symbols['ts_code'])
+        else:
+            stock_codes = [ts_code(code) for code in stock_codes]
+
+        trade_days = pd.DatetimeIndex(StockData().trade_calendar.trade_days(start_date, end_date))
+        df = self.segments.load(parse_dates = ['date'], columns = ['date', 'code_id'] + list(fields),
+                                start = start_date, end = end_date)
+        if not df.empty:
+            code_ids = self.symbols.reindex(stock_codes)['code_id'].dropna().astype(np.int64)
+            df = df[df['code_id'].isin(code_ids.values)]
+            id_to_code = pd.Series(self.symbols['ts_code'].values, index = self.symbols['code_id'].astype(np.int64))
+            df = df.assign(ts_code = id_to_code.reindex(df['code_id'].values).values)
+
+        panel: Dict[str, pd.DataFrame] = dict()
+        for field in fields:
+            if df.empty:
+                matrix = pd.DataFrame(np.nan, index = trade_days, columns = stock_codes)
+            else:
+                matrix = df.pivot(index = 'date', columns = 'ts_code', values = field)
+                matrix = matrix.reindex(index = trade_days, columns = stock_codes)
+            matrix.index.name = 'date'
+            panel[field] = matrix
+        return panel
@@ -0,0 +1,182 @@
+import logging
+import os
+from datetime import date
+from typing import Union, List, Dict
+
+import colorama
+import numpy as np
+import pandas as pd
+
+from sz.stock_data.calendar.session_calendar import SessionCalendar
+from sz.stock_data.stock_data import StockData
+from sz.stock_data.stocks.stock_5min import Stock5min
+from sz.stock_data.toolbox.data_provider import ts_code
+
+
+class Stock5minCube(object):
+    """
+    全市场 5min 线数据立方体: stock × trade_day × bar_slot × field
+    保存为 numpy 的 .npy 文件, 读取时使用内存映射, 截取的窗口都是零拷贝的视图, 不会生成 DataFrame
+    每个交易日 48 根 5min 线: 上午 09:35 -- 11:30 共 24 根, 下午 13:05 -- 15:00 共 24 根
+    """
+    fields = ['open', 'high', 'low', 'close', 'volume', 'amount']
+    slots_per_day = SessionCalendar.slots_per_day
+
+    def __init__(self, data_dir: str):
+        self.data_dir = data_dir
+        self.cube: Union[np.memmap, None] = None
+        self.stock_codes: Union[np.ndarray, None] = None
+        self.trade_days: Union[np.ndarray, None] = None
+        self._code_index: Dict[str, int] = dict()
+
+    def dir_path(self) -> str:
+        """
+        返回保存数据立方体的目录
+        :return:
+        """
+        return os.path.join(self.data_dir, 'panel', '5min_cube')
+
+    def cube_path(self) -> str:
+        return os.path.join(self.dir_path(), 'cube.npy')
+
+    def codes_path(self) -> str:
+        return os.path.join(self.dir_path(), 'codes.npy')
+
+    def days_path(self) -> str:
+        return os.path.join(self.dir_path(), 'days.npy')
+
+    def _setup_dir_(self):
+        """
+        初始化数据目录
+        :return:
+        """
+        os.makedirs(self.dir_path(), exist_ok = True)
+
+    def exists(self) -> bool:
+        return os.path.exists(self.cube_path())
+
+    @staticmethod
+    def slot_of(times: pd.Series) -> np.ndarray:
+        """
+        计算 5min 线的结束时间在当天的序号 (0 -- 47), 不在交易时段内的返回 -1
+        :param times:
+        :return:
+        """
+        return SessionCalendar.slot_of(times)
+
+    def build(self, stock_codes: Union[None, List[str]] = None,
+              start_date: date = Stock5min.base_date,
+              end_date: Union[None, date] = None,
+              dtype = np.float64):
+        """
+        将 stocks/<code>/5min 的数据转换为内存映射的数据立方体. 每次只加载一只股票的数据
+        :param stock_codes: 股票代码列表, 默认为沪深300和中证500成分股
+        :param start_date:
+        :param end_date: 默认为最近的一个交易日
+        :param dtype: 数据立方体的数值类型
+        :return:
+        """
+        self._setup_dir_()
+        if stock_codes is None:
+            stock_codes = list(StockData().hs300.stock_codes()) + list(StockData().zz500.stock_codes())
+        codes = np.array(sorted(set(ts_code(code) for code in stock_codes)))
+        if end_date is None:
+            end_date = StockData().trade_calendar.latest_trade_day()
+        session_calendar = StockData().session_calendar
+        days = session_calendar.trade_days(start_date, end_date)
+        first_ordinal = session_calendar.trade_day_ordinal(days[0]) if len(days) > 0 else 0
+
+        shape = (len(codes), len(days), self.slots_per_day, len(self.fields))
+        tmp_path = self.cube_path() + '.tmp'
+        cube = np.lib.format.open_memmap(tmp_path, mode = 'w+', dtype = dtype, shape = shape)
+        cube[:] = np.nan
+
+        for stock_index, stock_code in enumerate(codes):
+            df = Stock5min(data_dir = self.data_dir, stock_code = stock_code).load(
+                columns = self.fields, start = start_date, end = end_date)
+            if df.empty:
+                continue
+            ordinals, slot_index = session_calendar.locate(df['time'])
+            day_index = ordinals - first_ordinal
+            valid = (ordinals >= 0) & (day_index >= 0) & (day_index < len(days))
+            cube[stock_index, day_index[valid], slot_index[valid], :] = df[self.fields].values[valid]
+            logging.debug(colorama.Fore.YELLOW + '5min 数据立方体: %s 写入 %s 条 (%s/%s)' %
+                          (stock_code, valid.sum(), stock_index + 1, len(codes)))
+
+        cube.flush()
+        del cube
+        np.save(self.codes_path(), codes)
+        np.save(self.days_path(), days)
+        os.replace(tmp_path, self.cube_path())
+        self.cube = None
+        logging.info(colorama.Fore.YELLOW + '5min 数据立方体生成完毕: %s 只股票, %s 个交易日 path: %s' %
+                     (len(codes), len(days), self.cube_path()))
+
+    def load(self):
+        """
+        以只读内存映射的方式打开数据立方体
+        :return:
+        """
+        if not self.exists():
+            raise Exception('5min 数据立方体不存在, 请先调用 build() 生成: %s' % self.cube_path())
+        self.cube = np.load(self.cube_path(), mmap_mode = 'r')
+        self.stock_codes = np.load(self.codes_path())
+        self.trade_days = np.load(self.days_path())
+        self._code_index = {code: index for index, code in enumerate(self.stock_codes)}
+        return self
+
+    def prepare(self):
+        if self.cube is None:
+            self.load()
+        return self
+
+    def field_index(self, field: str) -> int:
+        return self.fields.index(field)
+
+    def stock_index(self, stock_code: str) -> int:
+        self.prepare()
+        code = ts_code(stock_code)
+        if code not in self._code_index:
+            raise Exception('5min 数据立方体中没有该股票: %s' % stock_code)
+        return self._code_index[code]
+
+    def day_range(self, start_date: date, end_date: date) -> slice:
+        """
+        返回起止日期 (包含) 对应的交易日序号区间
+        :param start_date:
+        :param end_date:
+        :return:
+        """
+        self.prepare()
+        first = np.searchsorted(self.trade_days, np.datetime64(start_date, 'D'), side = 'left')
+        last = np.searchsorted(self.trade_days, np.datetime64(end_date, 'D'), side = 'right')
+        return slice(first, last)
+
+    def window(self, stock_code: str, start_date: date, end_date: date,
+               field: Union[None, str] = None) -> np.ndarray:
+        """
+        返回单只股票在指定日期区间内的数据视图
+        :param stock_code:
+        :param start_date:
+        :param end_date:
+        :param field: 指定字段时返回 day × slot, 否则返回 day × slot × field
+        :return:
+        """
+        self.prepare()
+        view = self.cube[self.stock_index(stock_code), self.day_range(start_date, end_date)]
+        if field is None:
+            return view
+        return view[:, :, self.field_index(field)]
+
+    def cross_section(self, start_date: date, end_date: date, field: Union[None, str] = None) -> np.ndarray:
+        """
+        返回全部股票在指定日期区间内的数据视图, 用于横截面扫描
+        :param start_date:
+        :param end_date:
+        :param field: 指定字段时返回 stock × day × slot, 否则返回 stock × day × slot × field
+        :return:
+        """
+        view = self.prepare().cube[:, self.day_range(start_date, end_date)]
+        if field is None:
+            return view
+        return view[:, :, :, self.field_index(field)]
@@ -1,21 +1,29 @@
 import logging
 import os
 from datetime import date
-from typing import Union
+from typing import Iterable, Union, List
 
 import colorama
 import pandas as pd
 
 from sz.stock_data.toolbox.data_provider import ts_pro_api
+from sz.stock_data.toolbox.datetime import to_datetime_column
 from sz.stock_data.toolbox.helper import need_update
-from sz.stock_data.toolbox.limiter import ts_rate_limiter
+from sz.stock_data.toolbox.limiter import ts_rate_limit
+from sz.stock_data.toolbox.lookup import CodeLookup
+from sz.stock_data.toolbox.storage import is_slice, read_csv_file, with_columns
 
 
 class StockBasic(object):
+    # 更新之前需要先更新的数据集
+    dependencies = []
+    # 可以按代码快速查询的字段
+    lookup_fields = ['name', 'list_date', 'delist_date', 'market', 'industry']
 
     def __init__(self, data_dir: str):
         self.data_dir: str = data_dir
         self.dataframe: Union[pd.DataFrame, None] = None
+        self.lookup: Union[CodeLookup, None] = None
 
     def file_path(self) -> str:
         """
@@ -40,6 +48,7 @@ class StockBasic(object):
                 path_or_buf = self.file_path(),
                 index = False
             )
+            self.load()
 
     def should_update(self) -> bool:
         """
@@ -48,34 +57,63 @@ class StockBasic(object):
         """
         return need_update(self.file_path(), 7)
 
-    def load(self) -> pd.DataFrame:
+    def load(self, columns: Union[None, List[str]] = None, start: Union[None, str, date] = None,
+             end: Union[None, str, date] = None) -> pd.DataFrame:
+        """
+        :param columns: 只读取指定的字段 (索引字段总是读取), 默认读取全部字段
+        :param start: 只读取 list_date 不早于这一天的记录
+        :param end: 只读取 list_date 不晚于这一天的记录
+        :return: 指定了读取范围时只返回数据切片, 不替换 self.dataframe
+        """
         if os.path.exists(self.file_path()):
-            self.dataframe = pd.read_csv(
-                filepath_or_buffer = self.file_path(),
+            df = read_csv_file(
+                fpath = self.file_path(),
                 dtype = {'symbol': str},
-                parse_dates = ['list_date', 'delist_date']
+                parse_dates = ['list_date', 'delist_date'],
+                columns = with_columns(columns, 'ts_code'),
+                date_column = 'list_date',
+                start = start,
+                end = end
             )
-            self.dataframe.set_index(keys = 'ts_code', drop = False, inplace = True)
-            self.dataframe.sort_index(inplace = True)
+            df.set_index(keys = 'ts_code', drop = False, inplace = True)
+            df.sort_index(inplace = True)
         else:
             logging.warning(colorama.Fore.RED + '[股票列表基础信息] 本地数据文件不存在,请及时下载更新')
-            self.dataframe = pd.DataFrame()
+            df = pd.DataFrame()
 
-        return self.dataframe
+        if not is_slice(columns, start, end):
+            self.dataframe = df
+            self.lookup = CodeLookup(self.dataframe, 'ts_code', self.lookup_fields)
+        return df
 
     def prepare(self):
         if self.dataframe is None:
             self.load()
         return self
 
+    def _get_(self, ts_code: str, field: str):
+        self.prepare()
+        return self.lookup.get(ts_code, field)
+
+    def _bulk_(self, ts_codes: Union[Iterable[str], pd.Series], field: str) -> pd.Series:
+        self.prepare()
+        return self.lookup.bulk(ts_codes, field)
+
     def list_date_of(self, ts_code: str) -> date:
         """
         返回指定证券的上市日期
         :param ts_code:
         :return:
         """
-        self.prepare()
-        return self.dataframe.loc[ts_code].loc['list_date'].date()
+        return self._get_(ts_code, 'list_date')
+
+    def delist_date_of(self, ts_code: str) -> Union[None, date]:
+        """
+        返回指定证券的退市日期, 未退市时返回 None
+        :param ts_code:
+        :return:
+        """
+        return self._get_(ts_code, 'delist_date')
 
     def name_of(self, ts_code: str) -> str:
         """
@@ -83,18 +121,73 @@ class StockBasic(object):
         :param ts_code:
         :return:
         """
-        self.prepare()
-        return self.dataframe.loc[ts_code].loc['name']
+        return self._get_(ts_code, 'name')
+
+    def market_of(self, ts_code: str) -> str:
+        """
+        返回指定证券的市场类型 (主板/创业板/科创板等)
+        :param ts_code:
+        :return:
+        """
+        return self._get_(ts_code, 'market')
+
+    def industry_of(self, ts_code: str) -> str:
+        """
+        返回指定证券的所属行业
+        :param ts_code:
+        :return:
+        """
+        return self._get_(ts_code, 'industry')
+
+    def list_dates_of(self, ts_codes: Union[Iterable[str], pd.Series]) -> pd.Series:
+        """
+        批量返回上市日期, 找不到的代码为 NaT
+        :param ts_codes:
+        :return: 与 ts_codes 对齐的 Series
+        """
+        return self._bulk_(ts_codes, 'list_date')
+
+    def delist_dates_of(self, ts_codes: Union[Iterable[str], pd.Series]) -> pd.Series:
+        """
+        批量返回退市日期, 未退市或者找不到的代码为 NaT
+        :param ts_codes:
+        :return: 与 ts_codes 对齐的 Series
+        """
+        return self._bulk_(ts_codes, 'delist_date')
+
+    def names_of(self, ts_codes: Union[Iterable[str], pd.Series]) -> pd.Series:
+        """
+        批量返回证券名称
+        :param ts_codes:
+        :return: 与 ts_codes 对齐的 Series
+        """
+        return self._bulk_(ts_codes, 'name')
+
+    def markets_of(self, ts_codes: Union[Iterable[str], pd.Series]) -> pd.Series:
+        """
+        批量返回市场类型
+        :param ts_codes:
+        :return: 与 ts_codes 对齐的 Series
+        """
+        return self._bulk_(ts_codes, 'market')
+
+    def industries_of(self, ts_codes: Union[Iterable[str], pd.Series]) -> pd.Series:
+        """
+        批量返回所属行业
+        :param ts_codes:
+        :return: 与 ts_codes 对齐的 Series
+        """
+        return self._bulk_(ts_codes, 'industry')
 
     @staticmethod
-    @ts_rate_limiter
+    @ts_rate_limit('stock_basic')
     def ts_stock_basic() -> pd.DataFrame:
         df: pd.DataFrame = ts_pro_api().stock_basic(
             exchange = '',
             list_status = 'L',
             fields = 'ts_code,symbol,name,area,industry,fullname,market,exchange,list_status,list_date,delist_date,is_hs'
         )
-        df['list_date'] = pd.to_datetime(df['list_date'], format = '%Y%m%d')
-        df['delist_date'] = pd.to_datetime(df['delist_date'], format = '%Y%m%d')
+        df['list_date'] = to_datetime_column(df['list_date'])
+        df['delist_date'] = to_datetime_column(df['delist_date'])
         logging.info(colorama.Fore.YELLOW + '下载 [股票列表基础信息] 数据')
         return df
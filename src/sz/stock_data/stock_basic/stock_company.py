@@ -1,16 +1,21 @@
 import logging
 import os
-from typing import Union
+from datetime import date
+from typing import Union, List
 
 import colorama
 import pandas as pd
 
 from sz.stock_data.toolbox.data_provider import ts_pro_api
+from sz.stock_data.toolbox.datetime import to_datetime_column
 from sz.stock_data.toolbox.helper import need_update
-from sz.stock_data.toolbox.limiter import ts_rate_limiter
+from sz.stock_data.toolbox.limiter import ts_rate_limit
+from sz.stock_data.toolbox.storage import is_slice, read_csv_file, with_columns
 
 
 class StockCompany(object):
+    # 更新之前需要先更新的数据集
+    dependencies = []
 
     def __init__(self, data_dir: str):
         self.data_dir: str = data_dir
@@ -46,19 +51,32 @@ class StockCompany(object):
         """
         return need_update(self.file_path(), 7)
 
-    def load(self) -> pd.DataFrame:
+    def load(self, columns: Union[None, List[str]] = None, start: Union[None, str, date] = None,
+             end: Union[None, str, date] = None) -> pd.DataFrame:
+        """
+        :param columns: 只读取指定的字段 (索引字段总是读取), 默认读取全部字段
+        :param start: 只读取 setup_date 不早于这一天的记录
+        :param end: 只读取 setup_date 不晚于这一天的记录
+        :return: 指定了读取范围时只返回数据切片, 不替换 self.dataframe
+        """
         if os.path.exists(self.file_path()):
-            self.dataframe = pd.read_csv(
-                filepath_or_buffer = self.file_path(),
-                parse_dates = ['setup_date']
+            df = read_csv_file(
+                fpath = self.file_path(),
+                parse_dates = ['setup_date'],
+                columns = with_columns(columns, 'ts_code'),
+                date_column = 'setup_date',
+                start = start,
+                end = end
             )
-            self.dataframe.set_index(keys = 'ts_code', drop = False, inplace = True)
-            self.dataframe.sort_index(inplace = True)
+            df.set_index(keys = 'ts_code', drop = False, inplace = True)
+            df.sort_index(inplace = True)
         else:
             logging.warning(colorama.Fore.RED + 'StockCompany 本地数据文件不存在,请及时下载更新')
-            self.dataframe = pd.DataFrame()
+            df = pd.DataFrame()
 
-        return self.dataframe
+        if not is_slice(columns, start, end):
+            self.dataframe = df
+        return df
 
     def prepare(self):
         if self.dataframe is None:
@@ -66,7 +84,7 @@ class StockCompany(object):
         return self
 
     @staticmethod
-    @ts_rate_limiter
+    @ts_rate_limit('stock_company')
     def ts_stock_basic() -> pd.DataFrame:
         df: pd.DataFrame = ts_pro_api().stock_company(
             exchange = '',
@@ -74,6 +92,6 @@ class StockCompany(object):
                                'province', 'city', 'introduction', 'website', 'email', 'office', 'employees',
                                'main_business', 'business_scope'])
         )
-        df['setup_date'] = pd.to_datetime(df['setup_date'], format = '%Y%m%d')
+        df['setup_date'] = to_datetime_column(df['setup_date'])
         logging.info(colorama.Fore.YELLOW + '下载股票上市公司基本信息数据')
         return df
@@ -1,12 +1,21 @@
-from typing import Union
+from datetime import date
+from typing import Union, List, Dict
 
+import pandas as pd
+
+from sz.stock_data.calendar.session_calendar import SessionCalendar
 from sz.stock_data.calendar.trade_calendar import TradeCalendar
 from sz.stock_data.index.index_basic import IndexBasic
+from sz.stock_data.market.concept import StockConcept
+from sz.stock_data.market.stock_industry import StockIndustry
 from sz.stock_data.stock_basic.stock_basic import StockBasic
 from sz.stock_data.stock_basic.stock_company import StockCompany
 from sz.stock_data.stock_pool.hs300 import HS300
 from sz.stock_data.stock_pool.zz500 import ZZ500
+from sz.stock_data.toolbox.membership import MembershipIndex
+from sz.stock_data.toolbox.registry import DatasetRegistry
 from sz.stock_data.toolbox.singleton import SingletonMeta
+from sz.stock_data.toolbox.storage import use_storage
 
 
 class StockData(object, metaclass = SingletonMeta):
@@ -14,14 +23,29 @@ class StockData(object, metaclass = SingletonMeta):
     def __init__(self):
         self._data_dir = ''
         self._trade_calendar: Union[None, TradeCalendar] = None
+        self._session_calendar: Union[None, SessionCalendar] = None
         self._stock_basic: Union[None, StockBasic] = None
         self._stock_company: Union[None, StockCompany] = None
         self._hs300: Union[None, HS300] = None
         self._zz500: Union[None, ZZ500] = None
         self._index_basic: Union[None, IndexBasic] = None
+        self._concept_membership: Union[None, MembershipIndex] = None
+        self._industry_membership: Union[None, MembershipIndex] = None
+        self._daily_panel = None
+        self._registry: Union[None, DatasetRegistry] = None
+        self._cache_bytes = 1 << 30
 
-    def setup(self, data_dir: str):
+    def setup(self, data_dir: str, storage: str = 'csv', cache_bytes: int = 1 << 30):
+        """
+        :param data_dir: 本地数据目录
+        :param storage: 个股数据文件的存储格式: csv 或者 parquet
+        :param cache_bytes: 已加载数据集缓存的内存预算, 参考 dataset(...)
+        :return:
+        """
         self._data_dir = data_dir
+        self._cache_bytes = cache_bytes
+        self._registry = None
+        use_storage(storage)
         return self
 
     @property
@@ -47,6 +71,18 @@ class StockData(object, metaclass = SingletonMeta):
 
         return self._trade_calendar
 
+    @property
+    def session_calendar(self) -> SessionCalendar:
+        """
+        日内交易时段日历, 用于 5min 线的时间槽对齐和缺失检查
+        :return:
+        """
+        if self._session_calendar is None:
+            self._session_calendar = SessionCalendar(self._data_dir)
+            self._session_calendar.load()
+
+        return self._session_calendar
+
     @property
     def stock_basic(self) -> StockBasic:
         """
@@ -105,4 +141,67 @@ class StockData(object, metaclass = SingletonMeta):
             self._index_basic = IndexBasic(self.data_dir)
             self._index_basic.load()
 
-        return self._index_basic
\ No newline at end of file
+        return self._index_basic
+
+    @property
+    def concept_membership(self) -> MembershipIndex:
+        """
+        概念板块的双向成员索引, 例如:
+            StockData().concept_membership.groups_of('300059.SZ', on = '2020-01-02')
+            StockData().concept_membership.members_of('TS2', on = '2020-01-02')
+        :return:
+        """
+        if self._concept_membership is None:
+            self._concept_membership = StockConcept(self._data_dir).membership()
+
+        return self._concept_membership
+
+    @property
+    def industry_membership(self) -> MembershipIndex:
+        """
+        行业分类的双向成员索引
+        :return:
+        """
+        if self._industry_membership is None:
+            self._industry_membership = StockIndustry(self._data_dir).membership()
+
+        return self._industry_membership
+
+    @property
+    def registry(self) -> DatasetRegistry:
+        """
+        已加载数据集的缓存
+        :return:
+        """
+        if self._registry is None:
+            self._registry = DatasetRegistry(self.data_dir, max_bytes = self._cache_bytes)
+
+        return self._registry
+
+    def dataset(self, dataset_class, stock_code: Union[None, str] = None, **kwargs):
+        """
+        获取共享的已加载数据集, 同一只股票的同一个数据集只读取一次, 数据文件更新之后自动重新加载, 例如:
+            StockData().dataset(StockDaily, '600000.SH').dataframe
+        :param dataset_class: 数据集类
+        :param stock_code: 个股数据集的股票代码
+        :param kwargs: 数据集构造函数的其他参数
+        :return: 已经 load() 的数据集实例, 不应修改其中的数据
+        """
+        return self.registry.get(dataset_class, stock_code, **kwargs)
+
+    def daily_panel(self, fields: List[str], start_date: date, end_date: date,
+                    stock_codes: Union[None, List[str]] = None) -> Dict[str, pd.DataFrame]:
+        """
+        从全市场日线面板中读取指定字段, 返回行列对齐的矩阵
+        :param fields: 字段列表, 例如 ['close', 'volume']
+        :param start_date:
+        :param end_date:
+        :param stock_codes: 默认为面板中的全部股票
+        :return: 字段名 -> DataFrame(index = 交易日, columns = 股票代码)
+        """
+        if self._daily_panel is None:
+            from sz.stock_data.panel.daily_panel import DailyPanel
+            self._daily_panel = DailyPanel(self.data_dir)
+
+        return self._daily_panel.read(fields = fields, start_date = start_date, end_date = end_date,
+                                      stock_codes = stock_codes)
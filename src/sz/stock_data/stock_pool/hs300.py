@@ -1,20 +1,32 @@
 import logging
 import os
-from typing import Union, Iterable
+from datetime import date
+from typing import Union, Iterable, List
 
 import baostock as bao
 import colorama
+import numpy as np
 import pandas as pd
 
-from sz.stock_data.toolbox.data_provider import ts_code
+from sz.stock_data.stock_pool.pool_history import PoolHistory
+from sz.stock_data.toolbox.data_provider import bao_query, ts_codes
+from sz.stock_data.toolbox.datetime import to_datetime_column
 from sz.stock_data.toolbox.helper import need_update
+from sz.stock_data.toolbox.storage import is_slice, read_csv_file, with_columns
 
 
 class HS300(object):
+    # 更新之前需要先更新的数据集
+    dependencies = []
+    # 历史成分股的回补起始日期
+    base_date = date(year = 2006, month = 1, day = 1)
 
     def __init__(self, data_dir: str):
         self.data_dir: str = data_dir
         self.dataframe: Union[pd.DataFrame, None] = None
+        # 区间编码的历史成分股
+        self.history = PoolHistory(fpath = self.history_file_path(), bao_query_stocks = bao.query_hs300_stocks,
+                                   pool_name = '沪深300', base_date = self.base_date)
 
     def file_path(self) -> str:
         """
@@ -23,6 +35,13 @@ class HS300(object):
         """
         return os.path.join(self.data_dir, 'stock_pool', 'hs300.csv')
 
+    def history_file_path(self) -> str:
+        """
+        返回保存历史成分股区间的csv文件路径
+        :return:
+        """
+        return os.path.join(self.data_dir, 'stock_pool', 'hs300_history.csv')
+
     def _setup_dir_(self):
         """
         初始化数据目录
@@ -30,19 +49,32 @@ class HS300(object):
         """
         os.makedirs(os.path.dirname(self.file_path()), exist_ok = True)
 
-    def load(self) -> pd.DataFrame:
+    def load(self, columns: Union[None, List[str]] = None, start: Union[None, str, date] = None,
+             end: Union[None, str, date] = None) -> pd.DataFrame:
+        """
+        :param columns: 只读取指定的字段 (索引字段总是读取), 默认读取全部字段
+        :param start: 只读取 updateDate 不早于这一天的记录
+        :param end: 只读取 updateDate 不晚于这一天的记录
+        :return: 指定了读取范围时只返回数据切片, 不替换 self.dataframe
+        """
         if os.path.exists(self.file_path()):
-            self.dataframe = pd.read_csv(
-                filepath_or_buffer = self.file_path(),
-                parse_dates = ['updateDate']
+            df = read_csv_file(
+                fpath = self.file_path(),
+                parse_dates = ['updateDate'],
+                columns = with_columns(columns, 'code'),
+                date_column = 'updateDate',
+                start = start,
+                end = end
             )
-            self.dataframe.set_index(keys = 'code', drop = False, inplace = True)
-            self.dataframe.sort_index(inplace = True)
+            df.set_index(keys = 'code', drop = False, inplace = True)
+            df.sort_index(inplace = True)
         else:
             logging.warning(colorama.Fore.RED + '沪深300成分股 本地数据文件不存在,请及时下载更新')
-            self.dataframe = pd.DataFrame()
+            df = pd.DataFrame()
 
-        return self.dataframe
+        if not is_slice(columns, start, end):
+            self.dataframe = df
+        return df
 
     def prepare(self):
         if self.dataframe is None:
@@ -62,8 +94,9 @@ class HS300(object):
         获取沪深300成分股信息
         :return:
         """
-        df = bao.query_hs300_stocks().get_data()
-        df['code'] = df['code'].apply(lambda x: ts_code(x))
+        df = bao_query(bao.query_hs300_stocks)
+        df['code'] = ts_codes(df['code'])
+        df['updateDate'] = to_datetime_column(df['updateDate'])
         df.set_index(keys = 'code', drop = False, inplace = True)
         logging.info(colorama.Fore.YELLOW + '获取沪深300成分股信息')
         return df
@@ -77,9 +110,30 @@ class HS300(object):
                 path_or_buf = self.file_path(),
                 index = False
             )
-            self.prepare()
+            self.load()
+        # 历史成分股按自己的清单判断是否需要更新, 与最新成分股快照的更新周期无关
+        if self.history.should_update():
+            self.history.update()
 
     def stock_codes(self) -> Iterable[str]:
         self.prepare()
         for index, value in self.dataframe['code'].items():
             yield value
+
+    def members_on(self, day: Union[str, date]) -> np.ndarray:
+        """
+        指定日期的沪深300成分股 (时点数据, 不包含之后才纳入的股票)
+        :param day:
+        :return: 股票代码数组
+        """
+        return self.history.members_on(day)
+
+    def membership_mask(self, days: Union[Iterable, pd.Series, np.ndarray],
+                        codes: Union[Iterable[str], pd.Series]) -> np.ndarray:
+        """
+        日期 × 股票的沪深300成分股矩阵
+        :param days:
+        :param codes:
+        :return: bool 矩阵, 形状为 (len(days), len(codes))
+        """
+        return self.history.membership_mask(days, codes)
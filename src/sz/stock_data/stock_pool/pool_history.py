@@ -0,0 +1,220 @@
+import logging
+import os
+from datetime import date, timedelta
+from typing import Callable, Iterable, List, Set, Tuple, Union
+
+import colorama
+import numpy as np
+import pandas as pd
+
+from sz.stock_data.toolbox.data_provider import bao_query, ts_codes
+from sz.stock_data.toolbox.datetime import to_datetime_column
+from sz.stock_data.toolbox.helper import need_update_by_manifest
+from sz.stock_data.toolbox.manifest import last_date_of, write_manifest_entry
+
+# 仍然是成分股时, 剔除日期记为这个日期
+__open_day__ = np.datetime64('2200-01-01', 'D')
+
+
+def _day_(value: Union[str, date, pd.Timestamp]) -> np.datetime64:
+    return pd.Timestamp(value).to_datetime64().astype('datetime64[D]')
+
+
+class PoolHistory(object):
+    """
+    指数成分股的历史, 每条记录是一段成分股区间: code, in_date, out_date, 区间为 [in_date, out_date),
+    仍然是成分股时 out_date 为空. 由 baostock 按日期查询的历史成分股和每周的最新成分股逐步合并生成.
+    加载时按所有纳入/剔除日期把时间轴切分为若干段, 每一段的成分股相同, 查询某一天的成分股只需要一次二分查找
+    """
+
+    def __init__(self, fpath: str, bao_query_stocks: Callable, pool_name: str, base_date: date):
+        """
+        :param fpath: 历史数据文件路径
+        :param bao_query_stocks: baostock 的成分股查询函数, 例如 bao.query_hs300_stocks
+        :param pool_name: 股票池名称, 用于日志
+        :param base_date: 回补历史的起始日期
+        """
+        self.fpath = fpath
+        self.bao_query_stocks = bao_query_stocks
+        self.pool_name = pool_name
+        self.base_date = base_date
+        self.dataframe: Union[pd.DataFrame, None] = None
+        # 时间轴分段: breaks[i] 是第 i 段的起始日期, 第 i 段的成分股为 codes[segment_codes[segment_ptr[i]:segment_ptr[i + 1]]]
+        self.codes: np.ndarray = np.array([], dtype = object)
+        self.breaks: np.ndarray = np.array([], dtype = 'datetime64[D]')
+        self.segment_ptr: np.ndarray = np.zeros(1, dtype = np.int64)
+        self.segment_codes: np.ndarray = np.array([], dtype = np.int32)
+
+    def exists(self) -> bool:
+        return os.path.exists(self.fpath)
+
+    def load(self) -> pd.DataFrame:
+        if self.exists():
+            self.dataframe = pd.read_csv(
+                filepath_or_buffer = self.fpath,
+                parse_dates = ['in_date', 'out_date']
+            )
+        else:
+            self.dataframe = pd.DataFrame(columns = ['code', 'in_date', 'out_date'])
+        self._build_segments_()
+        return self.dataframe
+
+    def prepare(self):
+        if self.dataframe is None:
+            self.load()
+        return self
+
+    def _build_segments_(self):
+        df = self.dataframe
+        code_ids, codes = pd.factorize(df['code'], sort = True)
+        in_days = pd.DatetimeIndex(df['in_date']).values.astype('datetime64[D]')
+        out_days = pd.DatetimeIndex(df['out_date']).values.astype('datetime64[D]')
+        out_days[np.isnat(out_days)] = __open_day__
+
+        breaks = np.unique(np.concatenate([in_days, out_days[out_days < __open_day__]]))
+        # segments × intervals, 区间数量只有几千条, 分段数量只有几百段
+        active = (in_days[np.newaxis, :] <= breaks[:, np.newaxis]) & (breaks[:, np.newaxis] < out_days[np.newaxis, :])
+        segment_index, interval_index = np.nonzero(active)
+        self.codes = np.asarray(codes, dtype = object)
+        self.breaks = breaks
+        self.segment_ptr = np.concatenate([[0], np.cumsum(np.bincount(segment_index, minlength = len(breaks)))])
+        self.segment_codes = code_ids[interval_index].astype(np.int32)
+
+    def should_update(self) -> bool:
+        """
+        历史数据不存在, 或者清单中记录的最后日期早于最近的一个交易日时, 需要更新
+        :return:
+        """
+        if not self.exists():
+            return True
+        return need_update_by_manifest(self.fpath) is not False
+
+    def last_date(self) -> Union[None, date]:
+        """
+        历史数据已经检查到的日期
+        :return:
+        """
+        return last_date_of(self.fpath)
+
+    def members_on(self, day: Union[str, date]) -> np.ndarray:
+        """
+        指定日期的成分股
+        :param day:
+        :return: 股票代码数组, 早于历史数据起始日期时为空
+        """
+        self.prepare()
+        segment = np.searchsorted(self.breaks, _day_(day), side = 'right') - 1
+        if segment < 0:
+            return np.array([], dtype = object)
+        return self.codes[self.segment_codes[self.segment_ptr[segment]:self.segment_ptr[segment + 1]]]
+
+    def membership_mask(self, days: Union[Iterable, pd.Series, np.ndarray],
+                        codes: Union[Iterable[str], pd.Series]) -> np.ndarray:
+        """
+        日期 × 股票的成分股矩阵, 用于在面板数据上过滤当天的成分股, 避免幸存者偏差
+        :param days: 日期数组
+        :param codes: 股票代码数组
+        :return: bool 矩阵, 形状为 (len(days), len(codes))
+        """
+        self.prepare()
+        day_values = pd.DatetimeIndex(pd.to_datetime(days)).values.astype('datetime64[D]')
+        # 分段 × 历史成分股, 多一行全为 False, 对应早于历史数据起始日期的日期
+        segment_matrix = np.zeros((len(self.breaks) + 1, len(self.codes)), dtype = bool)
+        segment_rows = np.repeat(np.arange(len(self.breaks)), np.diff(self.segment_ptr))
+        segment_matrix[segment_rows, self.segment_codes] = True
+
+        segments = np.searchsorted(self.breaks, day_values, side = 'right') - 1
+        segments[segments < 0] = len(self.breaks)
+        columns = pd.Index(self.codes).get_indexer(np.asarray(list(codes), dtype = object))
+        mask = segment_matrix[segments][:, np.maximum(columns, 0)]
+        mask[:, columns < 0] = False
+        return mask
+
+    def snapshot(self, day: Union[None, date] = None) -> Tuple[date, Set[str]]:
+        """
+        从 baostock 查询成分股
+        :param day: 查询指定日期的成分股, 默认为最新
+        :return: (成分股生效日期, 成分股代码集合)
+        """
+        kwargs = {} if day is None else {'date': str(day)}
+        # 没有生效日期时, 以查询的日期为准
+        query_date = day if day is not None else date.today()
+        df = bao_query(self.bao_query_stocks, **kwargs)
+        if df.empty:
+            return query_date, set()
+        update_date = to_datetime_column(df['updateDate']).max()
+        if pd.isnull(update_date):
+            return query_date, set(ts_codes(df['code']))
+        return update_date.date(), set(ts_codes(df['code']))
+
+    def merge_snapshot(self, effective_date: date, codes: Set[str]) -> bool:
+        """
+        合并一次成分股快照: 不再是成分股的区间在生效日期结束, 新的成分股从生效日期开始
+        :param effective_date: 成分股生效日期
+        :param codes:
+        :return: 成分股是否有变化
+        """
+        self.prepare()
+        df = self.dataframe
+        is_open = df['out_date'].isnull()
+        current = set(df.loc[is_open, 'code'])
+        if len(codes) == 0 or codes == current:
+            return False
+        removed = is_open & ~df['code'].isin(codes)
+        df.loc[removed, 'out_date'] = pd.Timestamp(effective_date)
+        added = sorted(codes - current)
+        self.dataframe = pd.concat([df, pd.DataFrame({
+            'code': added,
+            'in_date': pd.Timestamp(effective_date),
+            'out_date': pd.NaT
+        })], ignore_index = True)
+        return True
+
+    def save(self, covered_date: date):
+        self.dataframe.sort_values(by = ['in_date', 'code'], inplace = True, ignore_index = True)
+        self.dataframe.to_csv(
+            path_or_buf = self.fpath,
+            index = False,
+            date_format = '%Y-%m-%d'
+        )
+        write_manifest_entry(self.fpath, self.dataframe, covered_date = covered_date)
+        self._build_segments_()
+
+    def backfill(self, end_date: date, step_days: int = 30):
+        """
+        从 base_date 开始每隔 step_days 查询一次历史成分股, 按成分股的生效日期合并为区间历史.
+        指数每半年定期调整一次, 相邻两次查询之间有多次调整时, 只能识别最后一次
+        :param end_date:
+        :param step_days:
+        :return:
+        """
+        self.prepare()
+        day = self.last_date() + timedelta(days = 1) if self.last_date() is not None else self.base_date
+        changes = 0
+        days: List[date] = []
+        while day <= end_date:
+            days.append(day)
+            day += timedelta(days = step_days)
+        days.append(end_date)
+        for day in days:
+            effective_date, codes = self.snapshot(day)
+            if self.merge_snapshot(min(effective_date, day), codes):
+                changes += 1
+        self.save(covered_date = end_date)
+        logging.info(colorama.Fore.YELLOW + '[%s 历史成分股] 回补到 %s, 查询 %s 次, 成分股变化 %s 次 path: %s' % (
+            self.pool_name, end_date, len(days), changes, self.fpath))
+
+    def update(self):
+        """
+        没有历史数据时先回补历史, 之后每次更新合并最新的成分股
+        :return:
+        """
+        self.prepare()
+        today = date.today()
+        if self.dataframe.empty:
+            self.backfill(end_date = today)
+            return
+        effective_date, codes = self.snapshot()
+        if self.merge_snapshot(max(effective_date, self.last_date() or effective_date), codes):
+            logging.info(colorama.Fore.YELLOW + '[%s 历史成分股] 成分股调整, 生效日期: %s' % (self.pool_name, effective_date))
+        self.save(covered_date = today)
@@ -0,0 +1,279 @@
+import logging
+import os
+from datetime import date
+from typing import Dict, List, Tuple, Union
+
+import colorama
+import numpy as np
+import pandas as pd
+
+from sz.stock_data.stocks.adj_factor import AdjFactor
+from sz.stock_data.stocks.stock_5min import Stock5min
+from sz.stock_data.stocks.stock_daily import StockDaily
+from sz.stock_data.toolbox.data_provider import ts_code
+from sz.stock_data.toolbox.manifest import last_date_of, read_manifest_entry, write_manifest_entry
+from sz.stock_data.toolbox.segment import SegmentStore
+from sz.stock_data.toolbox.storage import data_file, date_bounds, is_slice, read_dataframe, with_columns, write_dataframe
+
+# baostock 的 adjustflag: 1 后复权, 2 前复权, 3 不复权
+adjust_flags = {'hfq': 1, 'qfq': 2}
+
+
+def factor_key(factor_dates: np.ndarray, factors: np.ndarray,
+               until: Union[None, np.datetime64] = None) -> Tuple[Union[None, str], float]:
+    """
+    复权因子的键: 最近一次因子变化 (除权除息) 的日期和因子值. 只要键不变, 已经复权的历史数据就不需要重新计算
+    :param factor_dates: 按日期排序的因子日期, datetime64[D]
+    :param factors: 因子值
+    :param until: 只考虑不晚于这个日期的因子
+    :return: (日期字符串, 因子值), 没有因子时为 (None, nan)
+    """
+    if until is not None:
+        count = np.searchsorted(factor_dates, until, side = 'right')
+        factor_dates, factors = factor_dates[:count], factors[:count]
+    if len(factors) == 0:
+        return None, np.nan
+    changes = np.flatnonzero(factors[1:] != factors[:-1]) + 1
+    last_change = changes[-1] if len(changes) > 0 else 0
+    return str(factor_dates[last_change]), float(factors[last_change])
+
+
+def adjust_bars(df: pd.DataFrame, date_column: str, factor_dates: np.ndarray, factors: np.ndarray,
+                how: str, price_columns: List[str], volume_columns: List[str]) -> pd.DataFrame:
+    """
+    向量化复权: 每根 K 线按日期取当天 (或之前最近一天) 的复权因子, 一次乘到整列上
+        后复权 hfq: price × factor(t)
+        前复权 qfq: price × factor(t) / factor(最新)
+    成交量按相反的比例调整, 保持 成交额 ≈ 价格 × 成交量, 成交额不变
+    :param df: 不复权的 K 线
+    :param date_column: K 线的交易日字段
+    :param factor_dates: 按日期排序的因子日期, datetime64[D]
+    :param factors: 因子值
+    :param how: qfq 或者 hfq
+    :param price_columns:
+    :param volume_columns:
+    :return: 复权后的副本
+    """
+    if how not in adjust_flags:
+        raise Exception('不支持的复权方式: %s' % how)
+    bar_days = pd.DatetimeIndex(df[date_column]).values.astype('datetime64[D]')
+    # 早于第一条因子的 K 线 (例如因子数据缺失上市首日) 使用第一条因子
+    positions = np.maximum(np.searchsorted(factor_dates, bar_days, side = 'right') - 1, 0)
+    ratio = factors[positions]
+    if how == 'qfq':
+        ratio = ratio / factors[-1]
+
+    df = df.copy()
+    for column in price_columns:
+        if column in df.columns:
+            df[column] = df[column].values.astype(np.float64) * ratio
+    for column in volume_columns:
+        if column in df.columns:
+            df[column] = df[column].values.astype(np.float64) / ratio
+    if 'adjustflag' in df.columns:
+        df['adjustflag'] = adjust_flags[how]
+    return df
+
+
+class AdjustedBars(object):
+    """
+    复权 K 线: 用 tushare 的复权因子, 对 baostock 不复权 (adjustflag = 3) 的日线和 5min 线做前复权/后复权.
+    复权结果缓存在原始数据旁边 (day_qfq, 5min_qfq/ 等), 清单记录中保存计算时的复权因子键 (参考 factor_key):
+        因子键不变时, 只复权新增的 K 线并追加到缓存;
+        有新的除权除息导致因子键变化时, 重新计算全部历史.
+    后复权的历史价格不受之后的除权除息影响, 只检查缓存覆盖范围内的因子
+    """
+    frequencies = {
+        'd': {'name': 'day', 'date_column': 'date', 'time_column': 'date',
+              'price_columns': ['open', 'high', 'low', 'close', 'preclose']},
+        '5': {'name': '5min', 'date_column': 'date', 'time_column': 'time',
+              'price_columns': ['open', 'high', 'low', 'close']}
+    }
+    volume_columns = ['volume']
+
+    def __init__(self, data_dir: str, stock_code: str, frequency: str = 'd', how: str = 'qfq'):
+        """
+        :param data_dir:
+        :param stock_code:
+        :param frequency: d 日线, 5 5min 线
+        :param how: qfq 前复权, hfq 后复权
+        """
+        if frequency not in self.frequencies:
+            raise Exception('不支持的 K 线周期: %s' % frequency)
+        if how not in adjust_flags:
+            raise Exception('不支持的复权方式: %s' % how)
+        self.data_dir = data_dir
+        self.stock_code = ts_code(stock_code)
+        self.frequency = frequency
+        self.how = how
+        self.spec: Dict = self.frequencies[frequency]
+        self.dataframe: Union[pd.DataFrame, None] = None
+        self.segments = SegmentStore(dir_path = self.file_path(), time_column = 'time') if frequency == '5' else None
+
+    def file_path(self) -> str:
+        """
+        复权缓存的路径: 日线为数据文件, 5min 线为分段存储目录
+        :return:
+        """
+        path = os.path.join(self.data_dir, 'stocks', self.stock_code, '%s_%s' % (self.spec['name'], self.how))
+        return path if self.frequency == '5' else data_file(path)
+
+    def exists(self) -> bool:
+        return self.segments.exists() if self.segments is not None else os.path.exists(self.file_path())
+
+    def factors(self) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        :return: (按日期排序的因子日期 datetime64[D], 因子值)
+        """
+        df = AdjFactor(self.data_dir, self.stock_code).load()
+        if df.empty:
+            return np.array([], dtype = 'datetime64[D]'), np.array([], dtype = np.float64)
+        df = df.dropna(subset = ['adj_factor'])
+        return pd.DatetimeIndex(df['trade_date']).values.astype('datetime64[D]'), \
+            df['adj_factor'].values.astype(np.float64)
+
+    def _read_raw_(self, after: Union[None, pd.Timestamp] = None) -> pd.DataFrame:
+        """
+        读取不复权的 K 线, 已经按时间排序
+        :param after: 只返回晚于这个时间的 K 线, 更早的记录在读取时跳过
+        :return:
+        """
+        start = None if after is None else after.date()
+        if self.frequency == '5':
+            df = Stock5min(self.data_dir, self.stock_code).load(start = start)
+        else:
+            df = StockDaily(self.data_dir, self.stock_code).load(start = start)
+        if after is not None and not df.empty:
+            df = df[df[self.spec['time_column']] > after]
+        return df
+
+    def _read_cache_(self, columns: Union[None, List[str]] = None, start: Union[None, str, date] = None,
+                     end: Union[None, str, date] = None) -> pd.DataFrame:
+        parse_dates = ['time', 'date'] if self.frequency == '5' else ['date']
+        columns = with_columns(columns, self.spec['time_column'])
+        if self.segments is not None:
+            if not self.segments.exists():
+                return pd.DataFrame()
+            return self.segments.load(parse_dates = parse_dates, columns = columns, start = start, end = end)
+        if os.path.exists(self.file_path()):
+            return read_dataframe(fpath = self.file_path(), parse_dates = parse_dates, columns = columns,
+                                  date_column = self.spec['date_column'], start = start, end = end)
+        return pd.DataFrame()
+
+    def _is_fresh_(self, factor_dates: np.ndarray, factors: np.ndarray) -> bool:
+        """
+        只根据清单判断缓存是否可以直接读取: 已经覆盖不复权数据的最后日期, 并且复权因子键没有变化
+        :return:
+        """
+        entry = read_manifest_entry(self.file_path())
+        if entry is None or entry.get('last_date', None) is None or not self.exists():
+            return False
+        raw_path = Stock5min(self.data_dir, self.stock_code).file_path() if self.frequency == '5' else \
+            StockDaily(self.data_dir, self.stock_code).file_path()
+        raw_last_date = last_date_of(raw_path)
+        if raw_last_date is None or str(raw_last_date) > entry['last_date']:
+            return False
+        until = np.datetime64(entry['last_date'], 'D') if self.how == 'hfq' else None
+        key_date, key_value = factor_key(factor_dates, factors, until)
+        return self._is_valid_(entry, {'factor_date': key_date, 'factor_value': key_value})
+
+    def _key_of_(self, factor_dates: np.ndarray, factors: np.ndarray, df: pd.DataFrame) -> Dict:
+        until = None
+        if self.how == 'hfq' and not df.empty:
+            until = pd.Timestamp(df[self.spec['date_column']].max()).to_datetime64().astype('datetime64[D]')
+        key_date, key_value = factor_key(factor_dates, factors, until)
+        return {'factor_date': key_date, 'factor_value': key_value}
+
+    def _is_valid_(self, entry: Union[None, Dict], key: Dict) -> bool:
+        if entry is None or entry.get('factor_date', None) is None:
+            return False
+        return entry['factor_date'] == key['factor_date'] and np.isclose(entry['factor_value'], key['factor_value'])
+
+    def _adjust_(self, df: pd.DataFrame, factor_dates: np.ndarray, factors: np.ndarray) -> pd.DataFrame:
+        return adjust_bars(df, date_column = self.spec['date_column'], factor_dates = factor_dates, factors = factors,
+                           how = self.how, price_columns = self.spec['price_columns'],
+                           volume_columns = self.volume_columns)
+
+    def load(self, columns: Union[None, List[str]] = None, start: Union[None, str, date] = None,
+             end: Union[None, str, date] = None) -> pd.DataFrame:
+        """
+        读取复权 K 线, 缓存过期时先更新缓存
+        :param columns: 只读取指定的字段 (索引字段总是读取), 默认读取全部字段
+        :param start: 只读取不早于这一天的记录
+        :param end: 只读取不晚于这一天的记录
+        :return: 指定了读取范围时只返回数据切片, 不替换 self.dataframe
+        """
+        factor_dates, factors = self.factors()
+        if len(factors) == 0:
+            logging.warning(colorama.Fore.RED + '%s 本地复权因子数据不存在, 无法复权, 请及时下载更新' % self.stock_code)
+            self.dataframe = pd.DataFrame()
+            return self.dataframe
+
+        time_column = self.spec['time_column']
+        if is_slice(columns, start, end):
+            if self._is_fresh_(factor_dates, factors):
+                df = self._read_cache_(columns = columns, start = start, end = end)
+                df.set_index(keys = time_column, drop = False, inplace = True)
+                return df.sort_index()
+            # 缓存需要更新时, 先更新完整的缓存再切片
+            df = self.load()
+            start_time, end_time = date_bounds(start, end)
+            mask = np.ones(df.shape[0], dtype = bool)
+            if start_time is not None:
+                mask &= (df[self.spec['date_column']] >= start_time).values
+            if end_time is not None:
+                mask &= (df[self.spec['date_column']] < end_time).values
+            return df.loc[mask, with_columns(columns, time_column) or df.columns]
+
+        df_cache = self._read_cache_() if self.exists() else pd.DataFrame()
+        if not df_cache.empty and \
+                self._is_valid_(read_manifest_entry(self.file_path()), self._key_of_(factor_dates, factors, df_cache)):
+            df_new = self._read_raw_(after = pd.Timestamp(df_cache[time_column].max()))
+            if not df_new.empty:
+                df_new = self._adjust_(df_new.reset_index(drop = True), factor_dates, factors)
+                self.dataframe = pd.concat([df_cache, df_new], ignore_index = True)
+                self._save_(df_new, factor_dates, factors, append = True)
+                logging.info(colorama.Fore.YELLOW + '%s %s %s 复权缓存追加 %s 条' % (
+                    self.stock_code, self.spec['name'], self.how, df_new.shape[0]))
+            else:
+                self.dataframe = df_cache
+        else:
+            df_raw = self._read_raw_()
+            if df_raw.empty:
+                self.dataframe = pd.DataFrame()
+                return self.dataframe
+            self.dataframe = self._adjust_(df_raw.reset_index(drop = True), factor_dates, factors)
+            self._save_(self.dataframe, factor_dates, factors, append = False)
+            logging.info(colorama.Fore.YELLOW + '%s %s %s 复权缓存重新计算 %s 条, 最近除权除息: %s' % (
+                self.stock_code, self.spec['name'], self.how, self.dataframe.shape[0],
+                factor_key(factor_dates, factors)[0]))
+
+        self.dataframe.set_index(keys = time_column, drop = False, inplace = True)
+        self.dataframe.sort_index(inplace = True)
+        return self.dataframe
+
+    def prepare(self):
+        if self.dataframe is None:
+            self.load()
+        return self
+
+    def _save_(self, df: pd.DataFrame, factor_dates: np.ndarray, factors: np.ndarray, append: bool):
+        """
+        :param df: 追加时为新增的记录, 否则为全部记录
+        :param factor_dates:
+        :param factors:
+        :param append:
+        :return:
+        """
+        os.makedirs(os.path.dirname(self.file_path()), exist_ok = True)
+        if self.segments is not None:
+            if append:
+                self.segments.append(df)
+                self.segments.compact_if_needed()
+            else:
+                self.segments.clear()
+                self.segments.write_all(df)
+        else:
+            write_dataframe(self.dataframe, self.file_path())
+        write_manifest_entry(self.file_path(), self.dataframe, self.spec['date_column'],
+                             extra = self._key_of_(factor_dates, factors, self.dataframe))
@@ -8,13 +8,21 @@ import numpy as np
 import pandas as pd
 
 from sz.stock_data.stock_data import StockData
+from sz.stock_data.toolbox.cross_section import update_by_trade_date
 from sz.stock_data.toolbox.data_provider import ts_code, ts_pro_api
-from sz.stock_data.toolbox.datetime import ts_date
-from sz.stock_data.toolbox.helper import need_update_by_trade_date
-from sz.stock_data.toolbox.limiter import ts_rate_limiter
+from sz.stock_data.toolbox.datetime import to_datetime_column, ts_date
+from sz.stock_data.toolbox.helper import need_update_by_manifest, need_update_by_trade_date, upsert_tail
+from sz.stock_data.toolbox.limiter import ts_rate_limit
+from sz.stock_data.toolbox.manifest import last_date_of, write_manifest_entry
+from sz.stock_data.toolbox.range_fetcher import ts_range_fetcher
+from sz.stock_data.toolbox.storage import data_file, is_slice, read_dataframe, with_columns, write_dataframe
 
 
 class MoneyFlow(object):
+    # 更新之前需要先更新的数据集
+    dependencies = ['TradeCalendar', 'StockBasic', 'HS300', 'ZZ500']
+    # 按数据密度调整每次下载的日期区间, 所有股票共用
+    fetcher = ts_range_fetcher('moneyflow', initial_days = 3000)
 
     def __init__(self, data_dir: str, stock_code: str):
         self.data_dir = data_dir
@@ -23,10 +31,10 @@ class MoneyFlow(object):
 
     def file_path(self) -> str:
         """
-        返回保存数据的csv文件路径
+        返回保存数据的文件路径
         :return:
         """
-        return os.path.join(self.data_dir, 'stocks', self.stock_code, 'money_flow.csv')
+        return data_file(os.path.join(self.data_dir, 'stocks', self.stock_code, 'money_flow'))
 
     def _setup_dir_(self):
         """
@@ -44,26 +52,43 @@ class MoneyFlow(object):
         if not os.path.exists(self.file_path()):
             return True
 
+        need_update = need_update_by_manifest(self.file_path())
+        if need_update is not None:
+            return need_update
+
         self.prepare()
 
         return need_update_by_trade_date(self.dataframe, 'trade_date')
 
-    def load(self) -> pd.DataFrame:
+    def load(self, columns: Union[None, List[str]] = None, start: Union[None, str, date] = None,
+             end: Union[None, str, date] = None) -> pd.DataFrame:
+        """
+        :param columns: 只读取指定的字段 (索引字段总是读取), 默认读取全部字段
+        :param start: 只读取 trade_date 不早于这一天的记录
+        :param end: 只读取 trade_date 不晚于这一天的记录
+        :return: 指定了读取范围时只返回数据切片, 不替换 self.dataframe
+        """
         if os.path.exists(self.file_path()):
-            self.dataframe = pd.read_csv(
-                filepath_or_buffer = self.file_path(),
+            df = read_dataframe(
+                fpath = self.file_path(),
                 parse_dates = ['trade_date'],
                 dtype = {
                     'adj_factor': np.float64
-                }
+                },
+                columns = with_columns(columns, 'trade_date'),
+                date_column = 'trade_date',
+                start = start,
+                end = end
             )
-            self.dataframe.set_index(keys = 'trade_date', drop = False, inplace = True)
-            self.dataframe.sort_index(inplace = True)
+            df.set_index(keys = 'trade_date', drop = False, inplace = True)
+            df.sort_index(inplace = True)
         else:
             logging.warning(colorama.Fore.RED + '%s 本地个股资金流向数据文件不存在,请及时下载更新' % self.stock_code)
-            self.dataframe = pd.DataFrame()
+            df = pd.DataFrame()
 
-        return self.dataframe
+        if not is_slice(columns, start, end):
+            self.dataframe = df
+        return df
 
     def prepare(self):
         if self.dataframe is None:
@@ -75,6 +100,10 @@ class MoneyFlow(object):
         计算本次更新的起始日期
         :return:
         """
+        last_date = last_date_of(self.file_path())
+        if last_date is not None:
+            return last_date + timedelta(days = 1)
+
         self.prepare()
 
         if self.dataframe.empty:
@@ -82,14 +111,14 @@ class MoneyFlow(object):
         else:
             return self.dataframe.iloc[-1].loc['trade_date'].date() + timedelta(days = 1)
 
-    @ts_rate_limiter
+    @ts_rate_limit('moneyflow')
     def ts_money_flow(self, start_date: date, end_date: date) -> pd.DataFrame:
         df: pd.DataFrame = ts_pro_api().moneyflow(
             ts_code = self.stock_code,
             start_date = ts_date(start_date),
             end_date = ts_date(end_date)
         )
-        df['trade_date'] = pd.to_datetime(df['trade_date'], format = '%Y%m%d')
+        df['trade_date'] = to_datetime_column(df['trade_date'])
         df.set_index(keys = 'trade_date', drop = False, inplace = True)
         df.sort_index(inplace = True)
         logging.info(colorama.Fore.YELLOW + '下载 %s 个股资金流向数据: %s -- %s 共 %s 条' % (self.stock_code, start_date, end_date, df.shape[0]))
@@ -97,32 +126,63 @@ class MoneyFlow(object):
 
     def update(self):
         self._setup_dir_()
-        self.prepare()
 
         if self.should_update():
+            self.prepare()
             start_date: date = max(self.start_date(), StockData().stock_basic.list_date_of(self.stock_code))
             end_date: date = start_date
             last_trade_day = StockData().trade_calendar.latest_trade_day()
-            df_list: List[pd.DataFrame] = [self.dataframe]
-            step_days = timedelta(days = 3000)
+            df_list: List[pd.DataFrame] = []
 
-            while start_date <= last_trade_day:
-                end_date = start_date + step_days
-                end_date = min(end_date, last_trade_day)
-                df = self.ts_money_flow(start_date = start_date, end_date = end_date)
+            for _, end_date, df in self.fetcher.fetch(self.ts_money_flow, start_date, last_trade_day):
                 df_list.append(df)
-                start_date = end_date + timedelta(days = 1)
-
-            self.dataframe = pd.concat(df_list).drop_duplicates()
-            self.dataframe.sort_index(inplace = True)
 
-            self.dataframe.to_csv(
-                path_or_buf = self.file_path(),
-                index = False
-            )
-
-            logging.info(
-                colorama.Fore.YELLOW + '%s 个股资金流向数据更新到: %s path: %s' % (
-                    self.stock_code, str(end_date), self.file_path()))
+            self.save(df_list)
         else:
             logging.info(colorama.Fore.BLUE + '%s 个股资金流向数据无须更新' % self.stock_code)
+
+    def save(self, df_list: List[pd.DataFrame], covered_date: Union[None, date] = None):
+        """
+        合并新下载的数据并保存
+        :param df_list:
+        :param covered_date: 数据已经检查到的日期, 参考 write_manifest_entry
+        :return:
+        """
+        self.prepare()
+        self.dataframe = upsert_tail(self.dataframe, df_list,
+                                     keys = ['trade_date'],
+                                     sort_column = 'trade_date')
+
+        write_dataframe(self.dataframe, self.file_path())
+        write_manifest_entry(self.file_path(), self.dataframe, 'trade_date', covered_date)
+
+        logging.info(
+            colorama.Fore.YELLOW + '%s 个股资金流向数据更新到: %s path: %s' % (
+                self.stock_code, last_date_of(self.file_path()), self.file_path()))
+
+    @classmethod
+    def update_by_trade_date(cls, data_dir: str, stock_codes: List[str], update_rest: bool = True) -> List:
+        """
+        按交易日下载全市场的个股资金流向数据, 分发到各股票的数据文件中. 每个交易日只需要调用一次接口
+        :param data_dir:
+        :param stock_codes:
+        :param update_rest: 是否立即逐只更新本地还没有数据的股票
+        :return: 需要按日期区间逐只下载的数据集
+        """
+        return update_by_trade_date(
+            datasets = [cls(data_dir = data_dir, stock_code = stock_code) for stock_code in stock_codes],
+            fetch_of_date = cls.ts_money_flow_of_date,
+            name = '个股资金流向',
+            update_rest = update_rest
+        )
+
+    @staticmethod
+    @ts_rate_limit('moneyflow')
+    def ts_money_flow_of_date(trade_date: date) -> pd.DataFrame:
+        df: pd.DataFrame = ts_pro_api().moneyflow(
+            trade_date = ts_date(trade_date)
+        )
+        df['trade_date'] = to_datetime_column(df['trade_date'])
+        df.set_index(keys = 'trade_date', drop = False, inplace = True)
+        logging.info(colorama.Fore.YELLOW + '下载全市场个股资金流向数据: %s 共 %s 条' % (trade_date, df.shape[0]))
+        return df
@@ -1,16 +1,18 @@
 import logging
 import os
 from datetime import date
-from typing import Union
+from typing import Union, List
 
 import colorama
 import pandas as pd
 
 from sz.stock_data.stock_data import StockData
 from sz.stock_data.toolbox.data_provider import ts_code, ts_pro_api
-from sz.stock_data.toolbox.datetime import to_datetime64
-from sz.stock_data.toolbox.helper import mtime_of_file
-from sz.stock_data.toolbox.limiter import ts_rate_limiter
+from sz.stock_data.toolbox.datetime import to_datetime_column
+from sz.stock_data.toolbox.helper import mtime_of_file, upsert_tail
+from sz.stock_data.toolbox.limiter import ts_rate_limit
+from sz.stock_data.toolbox.manifest import write_manifest_entry
+from sz.stock_data.toolbox.storage import data_file, is_slice, read_dataframe, write_dataframe
 
 
 class PledgeStat(object):
@@ -18,6 +20,8 @@ class PledgeStat(object):
     股权质押统计数据
     https://tushare.pro/document/2?doc_id=110
     """
+    # 更新之前需要先更新的数据集
+    dependencies = ['TradeCalendar', 'StockBasic', 'HS300', 'ZZ500']
 
     def __init__(self, data_dir: str, stock_code: str):
         self.data_dir = data_dir
@@ -26,10 +30,10 @@ class PledgeStat(object):
 
     def file_path(self) -> str:
         """
-        返回保存数据的csv文件路径
+        返回保存数据的文件路径
         :return:
         """
-        return os.path.join(self.data_dir, 'stocks', self.stock_code, 'pledge_stat.csv')
+        return data_file(os.path.join(self.data_dir, 'stocks', self.stock_code, 'pledge_stat'))
 
     def _setup_dir_(self):
         """
@@ -53,31 +57,44 @@ class PledgeStat(object):
         else:
             return False
 
-    def load(self) -> pd.DataFrame:
+    def load(self, columns: Union[None, List[str]] = None, start: Union[None, str, date] = None,
+             end: Union[None, str, date] = None) -> pd.DataFrame:
+        """
+        :param columns: 只读取指定的字段 (索引字段总是读取), 默认读取全部字段
+        :param start: 只读取 end_date 不早于这一天的记录
+        :param end: 只读取 end_date 不晚于这一天的记录
+        :return: 指定了读取范围时只返回数据切片, 不替换 self.dataframe
+        """
         if os.path.exists(self.file_path()):
-            self.dataframe = pd.read_csv(
-                filepath_or_buffer = self.file_path(),
-                parse_dates = ['end_date']
+            df = read_dataframe(
+                fpath = self.file_path(),
+                parse_dates = ['end_date'],
+                columns = columns,
+                date_column = 'end_date',
+                start = start,
+                end = end
             )
         else:
             logging.warning(colorama.Fore.RED + '%s 本地 [股权质押统计] 数据文件不存在,请及时下载更新' % self.stock_code)
-            self.dataframe = pd.DataFrame()
+            df = pd.DataFrame()
 
-        return self.dataframe
+        if not is_slice(columns, start, end):
+            self.dataframe = df
+        return df
 
     def prepare(self):
         if self.dataframe is None:
             self.load()
         return self
 
-    @ts_rate_limiter
+    @ts_rate_limit('pledge_stat')
     def ts_pledge_stat(self) -> pd.DataFrame:
         df: pd.DataFrame = ts_pro_api().pledge_stat(
             ts_code = self.stock_code,
             fields = 'ts_code,end_date,pledge_count,unrest_pledge,rest_pledge,total_share,pledge_ratio'
         )
         if not df.empty:
-            df['end_date'] = df['end_date'].apply(lambda x: to_datetime64(x))
+            df['end_date'] = to_datetime_column(df['end_date'])
             df.sort_values(by = 'end_date', inplace = True)
             logging.info(colorama.Fore.YELLOW + '下载 %s [股权质押统计] 数据 共 %s 条' % (self.stock_code, df.shape[0]))
         else:
@@ -86,17 +103,15 @@ class PledgeStat(object):
 
     def update(self):
         self._setup_dir_()
-        self.prepare()
 
         if self.should_update():
+            self.prepare()
             # 获取最新
             latest_df = self.ts_pledge_stat()
-            # 合并最新, 并且去掉重复记录
-            self.dataframe = pd.concat([self.dataframe, latest_df]).drop_duplicates()
-            self.dataframe.to_csv(
-                path_or_buf = self.file_path(),
-                index = False
-            )
+            # 合并最新, 主键相同的记录以最新的为准
+            self.dataframe = upsert_tail(self.dataframe, latest_df, keys = ['end_date'])
+            write_dataframe(self.dataframe, self.file_path())
+            write_manifest_entry(self.file_path(), self.dataframe, 'end_date')
 
             logging.info(
                 colorama.Fore.YELLOW + '%s [股权质押统计] 数据更新到: %s' % (
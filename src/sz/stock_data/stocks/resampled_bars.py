@@ -0,0 +1,195 @@
+import logging
+import os
+from datetime import date, timedelta
+from typing import Dict, List, Tuple, Union
+
+import colorama
+import numpy as np
+import pandas as pd
+
+from sz.stock_data.calendar.session_calendar import SessionCalendar
+from sz.stock_data.stocks.stock_5min import Stock5min
+from sz.stock_data.toolbox.data_provider import ts_code
+from sz.stock_data.toolbox.manifest import last_date_of, read_manifest_entry, write_manifest_entry
+from sz.stock_data.toolbox.segment import SegmentStore
+from sz.stock_data.toolbox.storage import is_slice, with_columns
+
+# 合成周期 -> 每根 K 线包含的分钟数, d 为日线
+resample_minutes: Dict[str, Union[None, int]] = {'15': 15, '30': 30, '60': 60, 'd': None}
+
+
+def session_buckets(frequency: str) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    5min 线时间槽到合成 K 线的映射. 每个交易时段单独切分, 合成的 K 线不会跨越午休
+    :param frequency: 15, 30, 60 或者 d
+    :return: (每个时间槽所属的 K 线序号, 每根 K 线的结束时间 (当天 0 点开始的分钟数))
+    """
+    if frequency not in resample_minutes:
+        raise Exception('不支持的合成周期: %s' % frequency)
+    minutes = resample_minutes[frequency]
+    if minutes is None:
+        return np.zeros(SessionCalendar.slots_per_day, dtype = np.int64), \
+            np.array([SessionCalendar.sessions[-1][1]], dtype = np.int64)
+
+    bucket_list, end_list = [], []
+    for start, end in SessionCalendar.sessions:
+        if (end - start) % minutes != 0 or minutes % SessionCalendar.bar_minutes != 0:
+            raise Exception('合成周期 %s 不能整除交易时段' % frequency)
+        offset = len(end_list)
+        slots = np.arange((end - start) // SessionCalendar.bar_minutes)
+        bucket_list.append(offset + slots // (minutes // SessionCalendar.bar_minutes))
+        end_list.extend(range(start + minutes, end + 1, minutes))
+    return np.concatenate(bucket_list).astype(np.int64), np.array(end_list, dtype = np.int64)
+
+
+def resample_5min(df: pd.DataFrame, frequency: str) -> pd.DataFrame:
+    """
+    向量化合成: 按 (交易日, K 线序号) 找出连续记录的边界, 用 ufunc.reduceat 一次计算全部 K 线
+        open 第一根, close 最后一根, high/low 最大/最小, volume/amount 求和
+    合成的 K 线以结束时间标记, 与 5min 线一致; 日线的时间为收盘时间
+    :param df: 一只股票的 5min 线, 不在交易时段内的记录被忽略
+    :param frequency: 15, 30, 60 或者 d
+    :return:
+    """
+    columns = ['date', 'time', 'code', 'open', 'high', 'low', 'close', 'volume', 'amount', 'adjustflag']
+    if df.empty:
+        return pd.DataFrame(columns = columns)
+    bucket_of_slot, bucket_end = session_buckets(frequency)
+
+    times = pd.DatetimeIndex(df['time']).values
+    order = np.argsort(times, kind = 'stable')
+    times = times[order]
+    slots = SessionCalendar.slot_of(times)
+    valid = slots >= 0
+    if not valid.all():
+        logging.debug(colorama.Fore.YELLOW + '合成 %s K 线, 忽略不在交易时段内的 5min 线 %s 条' % (frequency, (~valid).sum()))
+    order, times, slots = order[valid], times[valid], slots[valid]
+    if len(order) == 0:
+        return pd.DataFrame(columns = columns)
+
+    days = times.astype('datetime64[D]')
+    buckets = bucket_of_slot[slots]
+    keys = days.astype(np.int64) * (len(bucket_end) + 1) + buckets
+    starts = np.flatnonzero(np.concatenate([[True], keys[1:] != keys[:-1]]))
+    ends = np.concatenate([starts[1:], [len(keys)]]) - 1
+
+    def values_of(column: str) -> np.ndarray:
+        return df[column].values[order]
+
+    result = pd.DataFrame({
+        'date': days[starts].astype('datetime64[ns]'),
+        'time': (days[starts].astype('datetime64[m]') + bucket_end[buckets[starts]].astype('timedelta64[m]'))
+        .astype('datetime64[ns]'),
+        'code': values_of('code')[starts],
+        'open': values_of('open').astype(np.float64)[starts],
+        'high': np.maximum.reduceat(values_of('high').astype(np.float64), starts),
+        'low': np.minimum.reduceat(values_of('low').astype(np.float64), starts),
+        'close': values_of('close').astype(np.float64)[ends],
+        'volume': np.add.reduceat(values_of('volume').astype(np.float64), starts),
+        'amount': np.add.reduceat(values_of('amount').astype(np.float64), starts)
+    })
+    result['adjustflag'] = values_of('adjustflag')[starts] if 'adjustflag' in df.columns else 3
+    return result
+
+
+class ResampledBars(object):
+    """
+    由 5min 线合成的 15min, 30min, 60min 线和日线, 不需要从 baostock 分别下载.
+    合成结果与 5min 线一样按分段追加存储在 stocks/<code>/<周期>/ 目录下, 5min 线更新时只合成新增的交易日并追加
+    """
+
+    def __init__(self, data_dir: str, stock_code: str, frequency: str):
+        """
+        :param data_dir:
+        :param stock_code:
+        :param frequency: 15, 30, 60 或者 d
+        """
+        if frequency not in resample_minutes:
+            raise Exception('不支持的合成周期: %s' % frequency)
+        self.data_dir = data_dir
+        self.stock_code = ts_code(stock_code)
+        self.frequency = frequency
+        self.dataframe: Union[pd.DataFrame, None] = None
+        self.segments = SegmentStore(dir_path = self.file_path(), time_column = 'time')
+
+    def file_path(self) -> str:
+        """
+        返回保存分段数据文件的目录, 日线保存在 day_5min 目录, 与 baostock 的日线数据文件区分
+        :return:
+        """
+        name = 'day_5min' if self.frequency == 'd' else '%smin' % self.frequency
+        return os.path.join(self.data_dir, 'stocks', self.stock_code, name)
+
+    def exists(self) -> bool:
+        return self.segments.exists()
+
+    def load(self, columns: Union[None, List[str]] = None, start: Union[None, str, date] = None,
+             end: Union[None, str, date] = None) -> pd.DataFrame:
+        """
+        :param columns: 只读取指定的字段 (索引字段总是读取), 默认读取全部字段
+        :param start: 只读取不早于这一天的记录
+        :param end: 只读取不晚于这一天的记录
+        :return: 指定了读取范围时只返回数据切片, 不替换 self.dataframe
+        """
+        if self.exists():
+            df = self.segments.load(
+                parse_dates = ['time', 'date'],
+                dtype = {
+                    'open': np.float64,
+                    'high': np.float64,
+                    'low': np.float64,
+                    'close': np.float64,
+                    'volume': np.float64,
+                    'amount': np.float64
+                },
+                columns = with_columns(columns, 'time'),
+                start = start,
+                end = end
+            )
+            df.set_index(keys = 'time', drop = False, inplace = True)
+            df.sort_index(inplace = True)
+        else:
+            logging.warning(colorama.Fore.RED + '%s 本地 %s 合成 K 线数据不存在,请先更新 5min 线' % (
+                self.stock_code, self.frequency))
+            df = pd.DataFrame()
+
+        if not is_slice(columns, start, end):
+            self.dataframe = df
+        return df
+
+    def prepare(self):
+        if self.dataframe is None:
+            self.load()
+        return self
+
+    def update(self, df_5min: Union[None, pd.DataFrame] = None):
+        """
+        合成最后日期之后的交易日并追加. 5min 线按整个交易日下载, 已经合成的交易日不会再变化
+        :param df_5min: 已经读取的 5min 线, 默认从本地数据读取
+        :return:
+        """
+        last_date: Union[None, date] = last_date_of(self.file_path()) if self.exists() else None
+        if df_5min is None:
+            start = None if last_date is None else last_date + timedelta(days = 1)
+            df_5min = Stock5min(self.data_dir, self.stock_code).load(start = start)
+        if df_5min.empty:
+            return
+        if last_date is not None:
+            df_5min = df_5min[df_5min['date'] > pd.Timestamp(last_date)]
+
+        df_new = resample_5min(df_5min, self.frequency)
+        if df_new.empty:
+            logging.debug(colorama.Fore.BLUE + '%s %s 合成 K 线无须更新' % (self.stock_code, self.frequency))
+            return
+
+        os.makedirs(self.file_path(), exist_ok = True)
+        self.segments.append(df_new)
+        self.segments.compact_if_needed()
+        entry = read_manifest_entry(self.file_path())
+        row_count = (entry['row_count'] if entry is not None and last_date is not None else 0) + df_new.shape[0]
+        write_manifest_entry(self.file_path(), df_new, 'date', extra = {'row_count': row_count})
+        if self.dataframe is not None:
+            self.dataframe = pd.concat([self.dataframe, df_new.set_index(keys = 'time', drop = False)])
+
+        logging.info(colorama.Fore.YELLOW + '%s %s 合成 K 线追加 %s 条, 更新到: %s' % (
+            self.stock_code, self.frequency, df_new.shape[0], last_date_of(self.file_path())))
@@ -3,30 +3,56 @@ import os
 from datetime import date, timedelta
 from typing import Union, List
 
-import baostock as bao
 import colorama
 import numpy as np
 import pandas as pd
 
 from sz.stock_data.stock_data import StockData
-from sz.stock_data.toolbox.data_provider import ts_code
-from sz.stock_data.toolbox.helper import need_update_by_trade_date
+from sz.stock_data.toolbox.data_provider import BaoTask, bao_code, bao_fetch, ts_code, ts_codes
+from sz.stock_data.toolbox.datetime import to_datetime_column
+from sz.stock_data.toolbox.helper import need_update_by_manifest, need_update_by_trade_date
+from sz.stock_data.toolbox.journal import UpdateJournal
+from sz.stock_data.toolbox.manifest import last_date_of, read_manifest_entry, write_manifest_entry
+from sz.stock_data.toolbox.range_fetcher import bao_range_fetcher
+from sz.stock_data.toolbox.segment import SegmentStore
+from sz.stock_data.toolbox.storage import data_file, is_slice, read_dataframe, with_columns
 
 
 class Stock5min(object):
+    # 更新之前需要先更新的数据集
+    dependencies = ['TradeCalendar', 'StockBasic', 'HS300', 'ZZ500']
     base_date = date(year = 2011, month = 1, day = 1)
+    bao_fields = 'date,time,code,open,high,low,close,volume,amount,adjustflag'
+    # 按数据密度调整每个下载任务的日期区间, 所有股票共用
+    fetcher = bao_range_fetcher('bao_5min', rows_per_call = 2000, initial_days = 50)
+    # 每次更新后, 由 5min 线增量合成的周期, 参考 ResampledBars
+    resample_frequencies = ['15', '30', '60', 'd']
 
     def __init__(self, data_dir: str, stock_code: str):
         self.data_dir = data_dir
         self.stock_code = ts_code(stock_code)
         self.dataframe: Union[pd.DataFrame, None] = None
+        self.segments = SegmentStore(dir_path = self.file_path(), time_column = 'time')
+        self.journal = UpdateJournal(self.file_path())
+        # 从断点日志恢复的数据
+        self.resumed: List[pd.DataFrame] = []
 
     def file_path(self) -> str:
         """
-        返回保存数据的csv文件路径
+        返回保存分段数据文件的目录
         :return:
         """
-        return os.path.join(self.data_dir, 'stocks', self.stock_code, '5min.csv')
+        return os.path.join(self.data_dir, 'stocks', self.stock_code, '5min')
+
+    def legacy_file_path(self) -> str:
+        """
+        分段存储之前, 保存全部数据的单一数据文件路径
+        :return:
+        """
+        return data_file(os.path.join(self.data_dir, 'stocks', self.stock_code, '5min'))
+
+    def exists(self) -> bool:
+        return self.segments.exists() or os.path.exists(self.legacy_file_path())
 
     def _setup_dir_(self):
         """
@@ -41,45 +67,77 @@ class Stock5min(object):
         如果文件不存在, 直接返回 True
         :return:
         """
-        if not os.path.exists(self.file_path()):
+        if not self.exists():
             return True
 
+        need_update = need_update_by_manifest(self.file_path())
+        if need_update is not None:
+            return need_update
+
         self.prepare()
 
         return need_update_by_trade_date(self.dataframe, 'date')
 
-    def load(self) -> pd.DataFrame:
-        if os.path.exists(self.file_path()):
-            self.dataframe = pd.read_csv(
-                filepath_or_buffer = self.file_path(),
-                parse_dates = ['time', 'date'],
-                dtype = {
-                    'open': np.float64,
-                    'high': np.float64,
-                    'low': np.float64,
-                    'close': np.float64,
-                    'volume': np.float64,
-                    'amount': np.float64
-                }
-            )
-            self.dataframe.set_index(keys = 'time', drop = False, inplace = True)
-            self.dataframe.sort_index(inplace = True)
+    def load(self, columns: Union[None, List[str]] = None, start: Union[None, str, date] = None,
+             end: Union[None, str, date] = None) -> pd.DataFrame:
+        """
+        :param columns: 只读取指定的字段 (索引字段总是读取), 默认读取全部字段
+        :param start: 只读取不早于这一天的记录, 之前年份的年度分段直接跳过
+        :param end: 只读取不晚于这一天的记录, 之后年份的年度分段直接跳过
+        :return: 指定了读取范围时只返回数据切片, 不替换 self.dataframe
+        """
+        parse_dates = ['time', 'date']
+        dtype = {
+            'open': np.float64,
+            'high': np.float64,
+            'low': np.float64,
+            'close': np.float64,
+            'volume': np.float64,
+            'amount': np.float64
+        }
+        if self.segments.exists():
+            df = self.segments.load(parse_dates = parse_dates, dtype = dtype, columns = with_columns(columns, 'time'),
+                                    start = start, end = end)
+        elif os.path.exists(self.legacy_file_path()):
+            df = read_dataframe(fpath = self.legacy_file_path(), parse_dates = parse_dates, dtype = dtype,
+                                columns = with_columns(columns, 'time'), date_column = 'time', start = start, end = end)
+        else:
+            df = None
+
+        if df is not None:
+            df.set_index(keys = 'time', drop = False, inplace = True)
+            df.sort_index(inplace = True)
         else:
             logging.warning(colorama.Fore.RED + '%s 本地 5min 线数据文件不存在,请及时下载更新' % self.stock_code)
-            self.dataframe = pd.DataFrame()
+            df = pd.DataFrame()
 
-        return self.dataframe
+        if not is_slice(columns, start, end):
+            self.dataframe = df
+        return df
 
     def prepare(self):
         if self.dataframe is None:
             self.load()
         return self
 
+    def adjusted(self, how: str = 'qfq') -> pd.DataFrame:
+        """
+        复权5min 线, 参考 AdjustedBars
+        :param how: qfq 前复权, hfq 后复权
+        :return:
+        """
+        from sz.stock_data.stocks.adjusted_bars import AdjustedBars
+        return AdjustedBars(self.data_dir, self.stock_code, frequency = '5', how = how).load()
+
     def start_date(self) -> date:
         """
         计算本次更新的起始日期
         :return:
         """
+        last_date = last_date_of(self.file_path())
+        if last_date is not None:
+            return last_date + timedelta(days = 1)
+
         self.prepare()
 
         if self.dataframe.empty:
@@ -87,57 +145,129 @@ class Stock5min(object):
         else:
             return self.dataframe.iloc[-1].loc['date'].date() + timedelta(days = 1)
 
-    def update(self):
-        self._setup_dir_()
-        self.prepare()
+    def bao_tasks(self) -> List[BaoTask]:
+        """
+        计算本次更新需要从 baostock 下载的日期区间, 不需要更新时返回空列表.
+        断点日志中已经下载完成的区间直接读取, 保存在 self.resumed 中
+        :return:
+        """
+        if not self.should_update():
+            return []
 
-        if self.should_update():
-            start_date: date = max(self.start_date(), StockData().stock_basic.list_date_of(self.stock_code))
-            end_date: date = start_date
-            last_trade_day = StockData().trade_calendar.latest_trade_day()
-            df_list: List[pd.DataFrame] = [self.dataframe]
-            step_days = timedelta(days = 50)
-
-            while start_date <= last_trade_day:
-                end_date = start_date + step_days
-                end_date = min(end_date, last_trade_day)
-                rs = bao.query_history_k_data_plus(
-                    code = self.stock_code,
-                    start_date = str(start_date),
-                    end_date = str(end_date),
-                    frequency = '5',
-                    fields = 'date,time,code,open,high,low,close,volume,amount,adjustflag',
-                    adjustflag = '3'
-                )
-                df_5min = rs.get_data()
-                if not df_5min.empty:
-                    df_5min['date'] = pd.to_datetime(df_5min['date'], format = '%Y-%m-%d')
-                    df_5min['time'] = df_5min['time'].apply(lambda x: pd.to_datetime(x[:-3], format = '%Y%m%d%H%M%S'))
-                    df_5min['code'] = df_5min['code'].apply(lambda x: ts_code(x))
-                    df_5min['open'] = df_5min['open'].astype(np.float64)
-                    df_5min['high'] = df_5min['high'].astype(np.float64)
-                    df_5min['low'] = df_5min['low'].astype(np.float64)
-                    df_5min['close'] = df_5min['close'].astype(np.float64)
-                    df_5min['volume'] = df_5min['volume'].astype(np.float64)
-                    df_5min['amount'] = df_5min['amount'].astype(np.float64)
-                    df_5min.set_index(keys = 'time', drop = False, inplace = True)
-                    logging.debug(colorama.Fore.YELLOW + '下载 %s 5min 线数据, 从 %s 到 %s 共 %s 条' %
-                                  (self.stock_code, start_date, end_date, df_5min.shape[0]))
+        start_date: date = max(self.start_date(), StockData().stock_basic.list_date_of(self.stock_code))
+        self.resumed, start_date = self.journal.resume(start_date)
+        last_trade_day = StockData().trade_calendar.latest_trade_day()
+        tasks: List[BaoTask] = []
+        for task_start, task_end in self.fetcher.ranges(start_date, last_trade_day):
+            tasks.append(BaoTask(code = bao_code(self.stock_code), frequency = '5', start_date = str(task_start),
+                                 end_date = str(task_end), fields = self.bao_fields))
+        return tasks
 
-                    df_list.append(df_5min)
+    def bao_convert(self, task: BaoTask, df_5min: pd.DataFrame) -> pd.DataFrame:
+        """
+        转换 baostock 返回的原始数据
+        :param task:
+        :param df_5min:
+        :return:
+        """
+        # 只有非空的数据会经过转换, 空数据 (例如停牌) 不参与密度学习, 避免区间过长
+        self.fetcher.observe(date.fromisoformat(task.start_date), date.fromisoformat(task.end_date), df_5min.shape[0])
+        df_5min['date'] = to_datetime_column(df_5min['date'])
+        df_5min['time'] = to_datetime_column(df_5min['time'])
+        df_5min['code'] = ts_codes(df_5min['code'])
+        df_5min['open'] = df_5min['open'].astype(np.float64)
+        df_5min['high'] = df_5min['high'].astype(np.float64)
+        df_5min['low'] = df_5min['low'].astype(np.float64)
+        df_5min['close'] = df_5min['close'].astype(np.float64)
+        df_5min['volume'] = df_5min['volume'].astype(np.float64)
+        df_5min['amount'] = df_5min['amount'].astype(np.float64)
+        df_5min['adjustflag'] = df_5min['adjustflag'].astype(np.int64)
+        df_5min.set_index(keys = 'time', drop = False, inplace = True)
+        logging.debug(colorama.Fore.YELLOW + '下载 %s 5min 线数据, 从 %s 到 %s 共 %s 条' %
+                      (self.stock_code, task.start_date, task.end_date, df_5min.shape[0]))
+        return df_5min
 
-                start_date = end_date + timedelta(days = 1)
+    def save(self, df_list: List[pd.DataFrame]):
+        """
+        将新下载的数据写入一个新的追加分段
+        :param df_list: 经过 bao_convert 转换的数据
+        :return:
+        """
+        df_list = self.resumed + df_list
+        df_new = pd.concat(df_list) if len(df_list) > 0 else pd.DataFrame()
+        if not df_new.empty:
+            df_new.sort_index(inplace = True)
+            self._convert_legacy_file_()
+            # 记录数和最后日期由清单记录和新增数据计算, 不读取历史分段
+            entry = read_manifest_entry(self.file_path())
+            if entry is not None:
+                row_count = entry['row_count']
+            elif self.segments.exists():
+                # 没有清单记录的旧数据目录, 只需要统计一次
+                row_count = self.prepare().dataframe.shape[0]
+            else:
+                row_count = 0
+            # 只写入新增的记录, 历史数据文件保持不变
+            self.segments.append(df_new)
+            self.segments.compact_if_needed()
+            if self.dataframe is not None:
+                self.dataframe = pd.concat([self.dataframe, df_new])
+            write_manifest_entry(self.file_path(), df_new, 'date', covered_date = last_date_of(self.file_path()),
+                                 extra = {'row_count': row_count + df_new.shape[0]})
+            self.resample(df_new)
+        self.journal.clear()
+        self.resumed = []
 
-            self.dataframe = pd.concat(df_list).drop_duplicates()
-            self.dataframe.sort_index(inplace = True)
+        logging.info(
+            colorama.Fore.YELLOW + '%s 5min 线数据更新到: %s path: %s' % (
+                self.stock_code, StockData().trade_calendar.latest_trade_day(), self.file_path()))
 
-            self.dataframe.to_csv(
-                path_or_buf = self.file_path(),
-                index = False
-            )
+    def update(self):
+        self._setup_dir_()
 
-            logging.info(
-                colorama.Fore.YELLOW + '%s 5min 线数据更新到: %s path: %s' % (
-                    self.stock_code, str(end_date), self.file_path()))
+        tasks = self.bao_tasks()
+        if len(tasks) > 0 or len(self.resumed) > 0:
+            df_list: List[pd.DataFrame] = []
+            for task in tasks:
+                df_5min = bao_fetch(task)
+                if not df_5min.empty:
+                    df_5min = self.bao_convert(task, df_5min)
+                    df_list.append(df_5min)
+                self.journal.checkpoint(task.start_date, task.end_date, df_5min)
+            self.save(df_list)
         else:
             logging.info(colorama.Fore.BLUE + '%s 5min 线数据无须更新' % self.stock_code)
+
+    def resample(self, df_new: pd.DataFrame):
+        """
+        将新增的 5min 线合成到 resample_frequencies 中的各个周期. 还没有合成过的周期, 从本地数据合成全部历史
+        :param df_new: 本次新增的 5min 线
+        :return:
+        """
+        from sz.stock_data.stocks.resampled_bars import ResampledBars
+        for frequency in self.resample_frequencies:
+            bars = ResampledBars(self.data_dir, self.stock_code, frequency)
+            bars.update(df_new if bars.exists() else None)
+
+    def compact(self):
+        """
+        合并追加分段到年度分段中
+        :return:
+        """
+        self._convert_legacy_file_()
+        self.segments.compact()
+
+    def _convert_legacy_file_(self):
+        """
+        将分段存储之前的单一数据文件, 按年份转换为分段存储
+        :return:
+        """
+        legacy_path = self.legacy_file_path()
+        if not os.path.exists(legacy_path):
+            return
+        if not self.segments.exists():
+            self.prepare()
+            if not self.dataframe.empty:
+                self.segments.write_all(self.dataframe)
+        os.remove(legacy_path)
+        logging.info(colorama.Fore.YELLOW + '%s 5min 线数据已转换为分段存储: %s' % (self.stock_code, self.file_path()))
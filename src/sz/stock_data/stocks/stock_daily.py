@@ -2,33 +2,47 @@ import logging
 import os
 from typing import Union, List
 
-import baostock as bao
 import colorama
 import pandas as pd
 
 from datetime import date, timedelta
 from sz.stock_data.stock_data import StockData
-from sz.stock_data.toolbox.data_provider import ts_code
-from sz.stock_data.toolbox.helper import mtime_of_file, need_update_by_trade_date
+from sz.stock_data.toolbox.data_provider import BaoTask, bao_code, bao_fetch, ts_code, ts_codes
+from sz.stock_data.toolbox.datetime import to_datetime_column
+from sz.stock_data.toolbox.helper import mtime_of_file, need_update_by_manifest, need_update_by_trade_date, upsert_tail
+from sz.stock_data.toolbox.journal import UpdateJournal
+from sz.stock_data.toolbox.manifest import last_date_of, write_manifest_entry
+from sz.stock_data.toolbox.range_fetcher import bao_range_fetcher
+from sz.stock_data.toolbox.storage import data_file, is_slice, read_dataframe, with_columns, write_dataframe
 
 
 class StockDaily(object):
     """
     baostock 能获取2006-01-01至当前时间的数据
     """
+    # 更新之前需要先更新的数据集
+    dependencies = ['TradeCalendar', 'StockBasic', 'HS300', 'ZZ500']
     base_date = date(year = 2006, month = 1, day = 1)
+    numeric_fields = ['open', 'high', 'low', 'close', 'preclose', 'volume', 'amount', 'adjustflag', 'turn',
+                      'tradestatus', 'pctChg', 'peTTM', 'psTTM', 'pcfNcfTTM', 'pbMRQ', 'isST']
+    bao_fields = 'date,code,open,high,low,close,preclose,volume,amount,adjustflag,turn,tradestatus,pctChg,peTTM,psTTM,pcfNcfTTM,pbMRQ,isST'
+    # 按数据密度调整每个下载任务的日期区间, 所有股票共用
+    fetcher = bao_range_fetcher('bao_daily', rows_per_call = 700, initial_days = 1000)
 
     def __init__(self, data_dir: str, stock_code: str):
         self.data_dir = data_dir
         self.stock_code = ts_code(stock_code)
         self.dataframe: Union[pd.DataFrame, None] = None
+        self.journal = UpdateJournal(self.file_path())
+        # 从断点日志恢复的数据
+        self.resumed: List[pd.DataFrame] = []
 
     def file_path(self) -> str:
         """
-        返回保存数据的csv文件路径
+        返回保存数据的文件路径
         :return:
         """
-        return os.path.join(self.data_dir, 'stocks', self.stock_code, 'day.csv')
+        return data_file(os.path.join(self.data_dir, 'stocks', self.stock_code, 'day'))
 
     def _setup_dir_(self):
         """
@@ -46,34 +60,64 @@ class StockDaily(object):
         if not os.path.exists(self.file_path()):
             return True
 
+        need_update = need_update_by_manifest(self.file_path())
+        if need_update is not None:
+            return need_update
+
         self.prepare()
 
         return need_update_by_trade_date(self.dataframe, 'date')
 
-    def load(self) -> pd.DataFrame:
+    def load(self, columns: Union[None, List[str]] = None, start: Union[None, str, date] = None,
+             end: Union[None, str, date] = None) -> pd.DataFrame:
+        """
+        :param columns: 只读取指定的字段 (索引字段总是读取), 默认读取全部字段
+        :param start: 只读取 date 不早于这一天的记录
+        :param end: 只读取 date 不晚于这一天的记录
+        :return: 指定了读取范围时只返回数据切片, 不替换 self.dataframe
+        """
         if os.path.exists(self.file_path()):
-            self.dataframe = pd.read_csv(
-                filepath_or_buffer = self.file_path(),
-                parse_dates = ['date']
+            df = read_dataframe(
+                fpath = self.file_path(),
+                parse_dates = ['date'],
+                columns = with_columns(columns, 'date'),
+                date_column = 'date',
+                start = start,
+                end = end
             )
-            self.dataframe.set_index(keys = 'date', drop = False, inplace = True)
-            self.dataframe.sort_index(inplace = True)
+            df.set_index(keys = 'date', drop = False, inplace = True)
+            df.sort_index(inplace = True)
         else:
             logging.warning(colorama.Fore.RED + '本地 [%s 日线] 数据文件不存在,请及时下载更新' % self.stock_code)
-            self.dataframe = pd.DataFrame()
+            df = pd.DataFrame()
 
-        return self.dataframe
+        if not is_slice(columns, start, end):
+            self.dataframe = df
+        return df
 
     def prepare(self):
         if self.dataframe is None:
             self.load()
         return self
 
+    def adjusted(self, how: str = 'qfq') -> pd.DataFrame:
+        """
+        复权日线, 参考 AdjustedBars
+        :param how: qfq 前复权, hfq 后复权
+        :return:
+        """
+        from sz.stock_data.stocks.adjusted_bars import AdjustedBars
+        return AdjustedBars(self.data_dir, self.stock_code, frequency = 'd', how = how).load()
+
     def start_date(self) -> date:
         """
         计算本次更新的起始日期
         :return:
         """
+        last_date = last_date_of(self.file_path())
+        if last_date is not None:
+            return last_date + timedelta(days = 1)
+
         if self.dataframe is None:
             self.load()
 
@@ -82,50 +126,73 @@ class StockDaily(object):
         else:
             return self.dataframe.iloc[-1].loc['date'].date() + timedelta(days = 1)
 
+    def bao_tasks(self) -> List[BaoTask]:
+        """
+        计算本次更新需要从 baostock 下载的日期区间, 不需要更新时返回空列表.
+        断点日志中已经下载完成的区间直接读取, 保存在 self.resumed 中
+        :return:
+        """
+        if not self.should_update():
+            return []
+
+        start_date: date = max(self.start_date(), StockData().stock_basic.list_date_of(self.stock_code))
+        self.resumed, start_date = self.journal.resume(start_date)
+        last_trade_day = StockData().trade_calendar.latest_trade_day()
+        tasks: List[BaoTask] = []
+        for task_start, task_end in self.fetcher.ranges(start_date, last_trade_day):
+            tasks.append(BaoTask(code = bao_code(self.stock_code), frequency = 'd', start_date = str(task_start),
+                                 end_date = str(task_end), fields = self.bao_fields))
+        return tasks
+
+    def bao_convert(self, task: BaoTask, df: pd.DataFrame) -> pd.DataFrame:
+        """
+        转换 baostock 返回的原始数据
+        :param task:
+        :param df:
+        :return:
+        """
+        # 只有非空的数据会经过转换, 空数据 (例如停牌) 不参与密度学习, 避免区间过长
+        self.fetcher.observe(date.fromisoformat(task.start_date), date.fromisoformat(task.end_date), df.shape[0])
+        df['date'] = to_datetime_column(df['date'])
+        df['is_open'] = df['isST'].apply(lambda x: str(x) == '1')
+        df['code'] = ts_codes(df['code'])
+        # baostock 返回的字段都是字符串, 转换为数值类型, 保证与本地数据文件的字段类型一致
+        df[self.numeric_fields] = df[self.numeric_fields].apply(pd.to_numeric, errors = 'coerce')
+        df.set_index(keys = 'date', drop = False, inplace = True)
+        logging.debug(colorama.Fore.YELLOW + '下载 [%s 日线] 数据, 从 %s 到 %s 共 %s 条' %
+                      (self.stock_code, task.start_date, task.end_date, df.shape[0]))
+        return df
+
+    def save(self, df_list: List[pd.DataFrame]):
+        """
+        合并新下载的数据并保存
+        :param df_list: 经过 bao_convert 转换的数据
+        :return:
+        """
+        df_list = self.resumed + df_list
+        self.prepare()
+        self.dataframe = upsert_tail(self.dataframe, df_list, keys = ['date'], sort_column = 'date')
+
+        write_dataframe(self.dataframe, self.file_path())
+        write_manifest_entry(self.file_path(), self.dataframe, 'date')
+        self.journal.clear()
+        self.resumed = []
+        logging.info(
+            colorama.Fore.YELLOW + '[%s 日线] 数据更新到: %s path: %s' % (
+                self.stock_code, StockData().trade_calendar.latest_trade_day(), self.file_path()))
+
     def update(self):
         self._setup_dir_()
-        if self.dataframe is None:
-            self.load()
 
-        if self.should_update():
-            start_date: date = max(self.start_date(), StockData().stock_basic.list_date_of(self.stock_code))
-            end_date: date = start_date
-            last_trade_day = StockData().trade_calendar.latest_trade_day()
-            df_list: List[pd.DataFrame] = [self.dataframe]
-            step_days = timedelta(days = 1000)
-
-            while start_date <= last_trade_day:
-                end_date = start_date + step_days
-                end_date = min(end_date, last_trade_day)
-                rs = bao.query_history_k_data_plus(
-                    code = self.stock_code,
-                    start_date = str(start_date),
-                    end_date = str(end_date),
-                    frequency = 'd',
-                    fields = 'date,code,open,high,low,close,preclose,volume,amount,adjustflag,turn,tradestatus,pctChg,peTTM,psTTM,pcfNcfTTM,pbMRQ,isST',
-                    adjustflag = '3'
-                )
-                df = rs.get_data()
+        tasks = self.bao_tasks()
+        if len(tasks) > 0 or len(self.resumed) > 0:
+            df_list: List[pd.DataFrame] = []
+            for task in tasks:
+                df = bao_fetch(task)
                 if not df.empty:
-                    df['date'] = pd.to_datetime(df['date'], format = '%Y-%m-%d')
-                    df['is_open'] = df['isST'].apply(lambda x: str(x) == '1')
-                    df['code'] = df['code'].apply(lambda x: ts_code(x))
-                    df.set_index(keys = 'date', drop = False, inplace = True)
-                    logging.debug(colorama.Fore.YELLOW + '下载 [%s 日线] 数据, 从 %s 到 %s 共 %s 条' %
-                                  (self.stock_code, start_date, end_date, df.shape[0]))
-
+                    df = self.bao_convert(task, df)
                     df_list.append(df)
-
-                start_date = end_date + timedelta(days = 1)
-
-            self.dataframe = pd.concat(df_list).drop_duplicates()
-            self.dataframe.sort_index(inplace = True)
-
-            self.dataframe.to_csv(
-                path_or_buf = self.file_path(),
-                index = False
-            )
-            logging.info(
-                colorama.Fore.YELLOW + '[%s 日线] 数据更新到: %s path: %s' % (self.stock_code, str(end_date), self.file_path()))
+                self.journal.checkpoint(task.start_date, task.end_date, df)
+            self.save(df_list)
         else:
             logging.info(colorama.Fore.BLUE + '[%s 日线] 数据无须更新' % self.stock_code)
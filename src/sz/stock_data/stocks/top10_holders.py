@@ -9,12 +9,19 @@ import pandas as pd
 
 from sz.stock_data.stock_data import StockData
 from sz.stock_data.toolbox.data_provider import ts_code, ts_pro_api
-from sz.stock_data.toolbox.datetime import ts_date, to_datetime64
-from sz.stock_data.toolbox.helper import mtime_of_file
-from sz.stock_data.toolbox.limiter import ts_rate_limiter
+from sz.stock_data.toolbox.datetime import to_datetime_column, ts_date
+from sz.stock_data.toolbox.helper import mtime_of_file, upsert_tail
+from sz.stock_data.toolbox.limiter import ts_rate_limit
+from sz.stock_data.toolbox.manifest import last_date_of, write_manifest_entry
+from sz.stock_data.toolbox.range_fetcher import ts_range_fetcher
+from sz.stock_data.toolbox.storage import data_file, is_slice, read_dataframe, write_dataframe
 
 
 class Top10Holders(object):
+    # 更新之前需要先更新的数据集
+    dependencies = ['TradeCalendar', 'StockBasic', 'HS300', 'ZZ500']
+    # 按数据密度调整每次下载的日期区间, 所有股票共用
+    fetcher = ts_range_fetcher('top10_holders', initial_days = 3650)
 
     def __init__(self, data_dir: str, stock_code: str):
         self.data_dir = data_dir
@@ -23,10 +30,10 @@ class Top10Holders(object):
 
     def file_path(self) -> str:
         """
-        返回保存数据的csv文件路径
+        返回保存数据的文件路径
         :return:
         """
-        return os.path.join(self.data_dir, 'stocks', self.stock_code, 'top10_holders.csv')
+        return data_file(os.path.join(self.data_dir, 'stocks', self.stock_code, 'top10_holders'))
 
     def _setup_dir_(self):
         """
@@ -50,21 +57,34 @@ class Top10Holders(object):
         else:
             return False
 
-    def load(self) -> pd.DataFrame:
+    def load(self, columns: Union[None, List[str]] = None, start: Union[None, str, date] = None,
+             end: Union[None, str, date] = None) -> pd.DataFrame:
+        """
+        :param columns: 只读取指定的字段 (索引字段总是读取), 默认读取全部字段
+        :param start: 只读取 end_date 不早于这一天的记录
+        :param end: 只读取 end_date 不晚于这一天的记录
+        :return: 指定了读取范围时只返回数据切片, 不替换 self.dataframe
+        """
         if os.path.exists(self.file_path()):
-            self.dataframe = pd.read_csv(
-                filepath_or_buffer = self.file_path(),
+            df = read_dataframe(
+                fpath = self.file_path(),
                 parse_dates = ['ann_date', 'end_date'],
                 dtype = {
                     'hold_amount': np.float64,
                     'hold_ratio': np.float64
-                }
+                },
+                columns = columns,
+                date_column = 'end_date',
+                start = start,
+                end = end
             )
         else:
             logging.warning(colorama.Fore.RED + '%s 本地前十大股东数据文件不存在,请及时下载更新' % self.stock_code)
-            self.dataframe = pd.DataFrame()
+            df = pd.DataFrame()
 
-        return self.dataframe
+        if not is_slice(columns, start, end):
+            self.dataframe = df
+        return df
 
     def prepare(self):
         if self.dataframe is None:
@@ -76,6 +96,10 @@ class Top10Holders(object):
         计算本次更新的起始日期
         :return:
         """
+        last_date = last_date_of(self.file_path())
+        if last_date is not None:
+            return last_date + timedelta(days = 1)
+
         self.prepare()
 
         if self.dataframe.empty:
@@ -83,7 +107,7 @@ class Top10Holders(object):
         else:
             return self.dataframe.iloc[-1].loc['end_date'].date() + timedelta(days = 1)
 
-    @ts_rate_limiter
+    @ts_rate_limit('top10_holders')
     def ts_top10_holders(self, start_date: date, end_date: date) -> pd.DataFrame:
         df: pd.DataFrame = ts_pro_api().top10_holders(
             ts_code = self.stock_code,
@@ -91,8 +115,8 @@ class Top10Holders(object):
             end_date = ts_date(end_date)
         )
         if not df.empty:
-            df['ann_date'] = df['ann_date'].apply(lambda x: to_datetime64(x))
-            df['end_date'] = df['end_date'].apply(lambda x: to_datetime64(x))
+            df['ann_date'] = to_datetime_column(df['ann_date'])
+            df['end_date'] = to_datetime_column(df['end_date'])
             df.sort_values(by = 'end_date', inplace = True)
             logging.info(colorama.Fore.YELLOW + '下载 %s 前十大股东数据: %s -- %s, 共 %s 条' % (self.stock_code, start_date, end_date, df.shape[0]))
         else:
@@ -101,29 +125,23 @@ class Top10Holders(object):
 
     def update(self):
         self._setup_dir_()
-        self.prepare()
 
         if self.should_update():
+            self.prepare()
             start_date: date = max(self.start_date(), StockData().stock_basic.list_date_of(self.stock_code))
             end_date: date = start_date
             last_trade_day = StockData().trade_calendar.latest_trade_day()
-            df_list: List[pd.DataFrame] = [self.dataframe]
-            step_days = timedelta(days = 3650)
+            df_list: List[pd.DataFrame] = []
 
-            while start_date <= last_trade_day:
-                end_date = start_date + step_days
-                end_date = min(end_date, last_trade_day)
-                df = self.ts_top10_holders(start_date = start_date, end_date = end_date)
+            for _, end_date, df in self.fetcher.fetch(self.ts_top10_holders, start_date, last_trade_day):
                 df_list.append(df)
-                start_date = end_date + timedelta(days = 1)
 
-            self.dataframe = pd.concat(df_list).drop_duplicates()
-            self.dataframe.sort_values(by = 'end_date', inplace = True)
+            self.dataframe = upsert_tail(self.dataframe, df_list,
+                                         keys = ['end_date', 'holder_name'],
+                                         sort_column = 'end_date')
 
-            self.dataframe.to_csv(
-                path_or_buf = self.file_path(),
-                index = False
-            )
+            write_dataframe(self.dataframe, self.file_path())
+            write_manifest_entry(self.file_path(), self.dataframe, 'end_date')
 
             logging.info(
                 colorama.Fore.YELLOW + '%s 前十大股东数据更新到: %s path: %s' % (
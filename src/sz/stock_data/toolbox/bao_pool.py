@@ -0,0 +1,164 @@
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime
+from multiprocessing.util import Finalize
+from typing import Dict, Iterable, Iterator, List, Set, Tuple, Union
+
+import baostock as bao
+import colorama
+import pandas as pd
+
+from sz.stock_data.toolbox.data_provider import BaoTask, bao_login, bao_logout
+
+
+def _worker_init_():
+    """
+    工作进程启动时独立登录 baostock, 进程退出时登出
+    :return:
+    """
+    bao_login()
+    Finalize(None, bao_logout, exitpriority = 10)
+
+
+def _worker_fetch_(task: BaoTask, retry: int) -> Tuple[BaoTask, pd.DataFrame]:
+    """
+    在工作进程中下载一个任务. 返回错误时 (例如会话超时失效) 重新登录后重试
+    :param task:
+    :param retry: 重试次数
+    :return:
+    """
+    error_msg = ''
+    for _ in range(retry + 1):
+        rs = bao.query_history_k_data_plus(
+            code = task.code,
+            start_date = task.start_date,
+            end_date = task.end_date,
+            frequency = task.frequency,
+            fields = task.fields,
+            adjustflag = '3'
+        )
+        if rs.error_code == '0':
+            return task, rs.get_data()
+        error_msg = rs.error_msg
+        logging.warning(colorama.Fore.RED + 'baostock 查询失败, 重新登录: %s %s' % (task, error_msg))
+        bao_login()
+    raise Exception('baostock 查询失败: %s %s' % (task, error_msg))
+
+
+class BaoFetchPool(object):
+    """
+    baostock 多进程下载池. 每个工作进程独立登录一个 baostock 会话, 并行下载 K 线任务,
+    下载结果流式返回给主进程, 由主进程统一转换和写入本地数据文件.
+    工作进程异常退出时, 重新启动进程池并重新提交未完成的任务.
+    进程池可能在调度器的工作线程中创建, 工作进程以 spawn 方式启动, 不继承父进程中其他线程持有的锁和 baostock 会话
+    """
+
+    def __init__(self, processes: int = 4, retry: int = 2, max_restarts: int = 3):
+        """
+        :param processes: 工作进程数
+        :param retry: 单个任务查询失败时的重试次数
+        :param max_restarts: 进程池异常退出后的最大重启次数
+        """
+        self.processes = max(1, processes)
+        self.retry = retry
+        self.max_restarts = max_restarts
+        self.failures: List[Tuple[BaoTask, Exception]] = []
+
+    def fetch(self, tasks: Iterable[BaoTask]) -> Iterator[Tuple[BaoTask, Union[None, pd.DataFrame]]]:
+        """
+        并行下载, 按完成顺序返回结果
+        :param tasks:
+        :return: (任务, 原始数据), 重试后仍然失败的任务返回 (任务, None), 并记录在 failures 中
+        """
+        pending: List[BaoTask] = list(tasks)
+        restarts = 0
+        while len(pending) > 0:
+            finished: Set[BaoTask] = set()
+            try:
+                with ProcessPoolExecutor(max_workers = self.processes, mp_context = multiprocessing.get_context('spawn'),
+                                         initializer = _worker_init_) as pool:
+                    futures = {pool.submit(_worker_fetch_, task, self.retry): task for task in pending}
+                    try:
+                        for future in as_completed(futures):
+                            task = futures[future]
+                            try:
+                                _, df = future.result()
+                            except BrokenProcessPool:
+                                raise
+                            except Exception as ex:
+                                logging.warning(colorama.Fore.RED + '%s' % ex)
+                                self.failures.append((task, ex))
+                                df = None
+                            finished.add(task)
+                            yield task, df
+                    except GeneratorExit:
+                        # 调用方提前关闭时, 取消还没有开始的任务, 进程池退出时只等待正在执行的任务
+                        for future in futures:
+                            future.cancel()
+                        raise
+            except BrokenProcessPool as ex:
+                restarts += 1
+                if restarts > self.max_restarts:
+                    raise ex
+                logging.warning(colorama.Fore.RED + 'baostock 下载进程异常退出, 重启进程池 (%s/%s)' %
+                                (restarts, self.max_restarts))
+            pending = [task for task in pending if task not in finished]
+
+    def update(self, datasets: List):
+        """
+        并行下载并更新多个数据集. 数据集需要提供 bao_tasks(), bao_convert(), save() 和断点日志 journal,
+        例如 StockDaily 和 Stock5min. 一个数据集的全部任务都下载成功之后才会写入, 避免本地数据出现缺口;
+        每个下载完成的任务都记录在断点日志中, 中断之后可以继续
+        :param datasets:
+        :return:
+        """
+        start_time = datetime.now()
+        owners: Dict[BaoTask, object] = dict()
+        remaining: Dict[int, int] = dict()
+        results: Dict[int, List[pd.DataFrame]] = dict()
+        failed: Set[int] = set()
+        for dataset in datasets:
+            dataset._setup_dir_()
+            tasks = dataset.bao_tasks()
+            for task in tasks:
+                owners[task] = dataset
+            if len(tasks) > 0:
+                remaining[id(dataset)] = len(tasks)
+                results[id(dataset)] = []
+            elif len(dataset.resumed) > 0:
+                # 断点日志中已经包含全部数据
+                dataset.save([])
+
+        finished_count = 0
+        failed_count = 0
+        results_iter = self.fetch(owners.keys())
+        try:
+            for task, df in results_iter:
+                dataset = owners[task]
+                key = id(dataset)
+                if df is None:
+                    failed.add(key)
+                    failed_count += 1
+                else:
+                    if not df.empty:
+                        df = dataset.bao_convert(task, df)
+                        results[key].append(df)
+                    dataset.journal.checkpoint(task.start_date, task.end_date, df)
+                remaining[key] -= 1
+                if remaining[key] == 0:
+                    if key not in failed:
+                        dataset.save(results[key])
+                    del results[key]
+                    finished_count += 1
+                    logging.debug(colorama.Fore.LIGHTGREEN_EX + '%s %s 下载完毕, 进度: (%s/%s) %.2f %%' %
+                                  (type(dataset).__name__, dataset.stock_code, finished_count, len(remaining),
+                                   finished_count / len(remaining) * 100))
+        finally:
+            # 保存数据异常中断时, 关闭生成器, 进程池随之退出
+            results_iter.close()
+
+        logging.info(colorama.Fore.YELLOW + 'baostock 多进程下载完毕: %s 个数据集, %s 个任务, %s 个任务失败, '
+                                            '%s 个数据集未更新, %s 个进程, 耗时: %s' %
+                     (len(remaining), len(owners), failed_count, len(failed), self.processes, datetime.now() - start_time))
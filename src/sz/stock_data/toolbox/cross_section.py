@@ -0,0 +1,97 @@
+import logging
+import os
+from bisect import bisect_left
+from datetime import date
+from typing import Callable, Dict, List, Tuple, Union
+
+import colorama
+import pandas as pd
+
+from sz.stock_data.toolbox.manifest import advance_covered_date
+
+
+def cross_section_cutoff(start_dates: List[date], trade_days: List[date]) -> Union[None, date]:
+    """
+    选择按交易日下载的起始日期, 使接口调用次数最少: 起始日期之后每个交易日调用一次,
+    需要更新的日期早于起始日期的股票各自按日期区间调用一次
+    :param start_dates: 各股票需要更新的起始日期
+    :param trade_days: 最早的起始日期到最近交易日之间的交易日, 升序排列
+    :return: 全部股票都逐只下载更少时返回 None
+    """
+    # 调用次数相同时优先按交易日下载
+    best_cutoff, best_calls = None, len(start_dates) + 1
+    sorted_dates = sorted(start_dates)
+    for index, cutoff in enumerate(sorted_dates):
+        if index > 0 and cutoff == sorted_dates[index - 1]:
+            continue
+        # 起始日期早于 cutoff 的股票逐只下载, 其余股票按 cutoff 之后的交易日下载
+        calls = index + len(trade_days) - bisect_left(trade_days, cutoff)
+        if calls < best_calls:
+            best_cutoff, best_calls = cutoff, calls
+    return best_cutoff
+
+
+def update_by_trade_date(datasets: List, fetch_of_date: Callable[[date], pd.DataFrame], name: str,
+                         update_rest: bool = True) -> List:
+    """
+    按交易日下载全市场数据, 再按 ts_code 分发到各股票的数据集中, 每个交易日只调用一次接口.
+    数据集需要提供 should_update(), start_date(), save(df_list, covered_date) 和 update(), 例如 AdjFactor 和 MoneyFlow.
+    本地还没有数据的股票, 以及缺失的交易日太多、按交易日下载反而调用次数更多的股票 (参考 cross_section_cutoff),
+    仍然逐只股票按日期区间下载
+    :param datasets: 各股票的数据集对象
+    :param fetch_of_date: 下载指定交易日全市场数据的函数, 返回的数据包含 ts_code 字段
+    :param name: 数据集名称, 用于输出日志
+    :param update_rest: 是否立即逐只更新需要按日期区间下载的股票, 为 False 时由调用方安排 (例如交给并发执行器)
+    :return: 需要按日期区间逐只下载的数据集
+    """
+    from sz.stock_data.stock_data import StockData
+
+    start_dates: Dict[str, Tuple[object, date]] = dict()
+    per_stock: List = []
+    for dataset in datasets:
+        dataset._setup_dir_()
+        if not dataset.should_update():
+            continue
+        if os.path.exists(dataset.file_path()):
+            start_dates[dataset.stock_code] = (dataset, dataset.start_date())
+        else:
+            per_stock.append(dataset)
+
+    trade_days: List[date] = []
+    if len(start_dates) > 0:
+        first_date = min(start_date for _, start_date in start_dates.values())
+        trade_days = list(StockData().trade_calendar.trade_day_between(
+            first_date, StockData().trade_calendar.latest_trade_day()))
+        cutoff = cross_section_cutoff([start_date for _, start_date in start_dates.values()], trade_days)
+        # 缺失交易日太多的股票 (例如长期停牌后复牌) 逐只下载, 其余股票仍然按交易日下载
+        for stock_code, (dataset, start_date) in list(start_dates.items()):
+            if cutoff is None or start_date < cutoff:
+                per_stock.append(dataset)
+                del start_dates[stock_code]
+        trade_days = [trade_date for trade_date in trade_days if cutoff is not None and trade_date >= cutoff]
+
+    df_lists: Dict[str, List[pd.DataFrame]] = {stock_code: [] for stock_code in start_dates}
+    covered_date = None
+    for trade_date in trade_days:
+        df = fetch_of_date(trade_date)
+        if df.empty:
+            # 当天的数据还没有发布, 下次更新时再下载
+            logging.warning(colorama.Fore.RED + '没有 %s 的全市场 [%s] 数据' % (trade_date, name))
+            break
+        covered_date = trade_date
+        for stock_code, df_stock in df.groupby('ts_code'):
+            if stock_code in start_dates and trade_date >= start_dates[stock_code][1]:
+                df_lists[stock_code].append(df_stock)
+
+    if covered_date is not None:
+        for stock_code, (dataset, _) in start_dates.items():
+            # 没有新增记录 (例如停牌) 时只更新清单中的最后日期, 不重写数据文件
+            if len(df_lists[stock_code]) > 0 or not advance_covered_date(dataset.file_path(), covered_date):
+                dataset.save(df_lists[stock_code], covered_date = covered_date)
+
+    logging.info(colorama.Fore.YELLOW + '[%s] 按交易日下载 %s 天, 更新 %s 只股票; 按股票下载 %s 只股票' %
+                 (name, len(trade_days), len(start_dates), len(per_stock)))
+    if update_rest:
+        for dataset in per_stock:
+            dataset.update()
+    return per_stock
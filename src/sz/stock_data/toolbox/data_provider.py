@@ -1,10 +1,21 @@
 import logging
+import threading
+from collections import namedtuple
+from typing import Callable, Dict, Iterable, Union
 
 import baostock as bao
 import colorama
+import numpy as np
+import pandas as pd
 import tushare as ts
 from tushare.pro.client import DataApi
 
+# baostock 的所有查询共用一个全局的 socket 会话, 不是线程安全的
+__bao_lock__ = threading.RLock()
+
+# baostock K 线下载任务: 证券代码, K 线频率, 起止日期 (yyyy-mm-dd), 字段列表
+BaoTask = namedtuple('BaoTask', ['code', 'frequency', 'start_date', 'end_date', 'fields'])
+
 
 def ts_pro_api() -> DataApi:
     return ts.pro_api(ts_token())
@@ -28,6 +39,35 @@ def bao_logout():
     logging.info(colorama.Fore.GREEN + 'baostock logout success!')
 
 
+def bao_query(query, **kwargs) -> pd.DataFrame:
+    """
+    在 baostock 会话锁内执行查询并读取全部结果, 多个线程并发更新时, 查询和分页读取不会交错
+    例如: bao_query(bao.query_history_k_data_plus, code = 'sh.600000', ...)
+    :param query: baostock 的查询函数
+    :param kwargs: 查询参数
+    :return:
+    """
+    with __bao_lock__:
+        return query(**kwargs).get_data()
+
+
+def bao_fetch(task: BaoTask) -> pd.DataFrame:
+    """
+    在当前进程的 baostock 会话中下载一个 K 线任务 (不复权)
+    :param task:
+    :return: baostock 返回的原始数据, 字段都是字符串
+    """
+    return bao_query(
+        bao.query_history_k_data_plus,
+        code = task.code,
+        start_date = task.start_date,
+        end_date = task.end_date,
+        frequency = task.frequency,
+        fields = task.fields,
+        adjustflag = '3'
+    )
+
+
 def ts_code(code: str) -> str:
     """
     转换证券代码为 tushare 标准格式
@@ -57,6 +97,61 @@ def bao_code(code: str) -> str:
     if stock_code.startswith('sz.') or stock_code.startswith('sh.'):
         return stock_code
     elif stock_code.endswith('.sz') or stock_code.endswith('.sh'):
-        return '%s.%s' % (stock_code[0:6], stock_code[7:])
+        return '%s.%s' % (stock_code[7:], stock_code[0:6])
     else:
         raise Exception('无效的证券代码: %s' % code)
+
+
+# 已经转换过的证券代码: 原始代码 -> 标准格式, 全市场只有几千个代码, 每个代码只转换一次
+__ts_codes__: Dict[str, str] = dict()
+__bao_codes__: Dict[str, str] = dict()
+
+
+def _intern_code_(code: str, convert: Callable[[str], str], interned: Dict[str, str]) -> str:
+    converted = interned.get(code, None)
+    if converted is None:
+        converted = convert(code)
+        interned[code] = converted
+    return converted
+
+
+def _convert_codes_(codes: Union[Iterable[str], pd.Series], convert: Callable[[str], str],
+                    interned: Dict[str, str]) -> pd.Series:
+    """
+    批量转换证券代码: 只转换去重后的代码, 再按位置取回. 分类类型的列只转换分类值, 返回分类类型
+    :param codes:
+    :param convert: 单个代码的转换函数
+    :param interned: 转换结果的缓存
+    :return: 与 codes 对齐的 Series, 缺失值保持为缺失
+    """
+    if not isinstance(codes, pd.Series):
+        codes = pd.Series(list(codes), dtype = object)
+    if isinstance(codes.dtype, pd.CategoricalDtype):
+        categories = [_intern_code_(code, convert, interned) for code in codes.cat.categories]
+        if len(set(categories)) == len(categories):
+            return codes.cat.rename_categories(categories)
+        # 不同格式的同一个代码转换后合并为一个分类
+        return _convert_codes_(codes.astype(object), convert, interned).astype('category')
+
+    ids, uniques = pd.factorize(codes)
+    converted = np.array([_intern_code_(code, convert, interned) for code in uniques] + [None], dtype = object)
+    # 缺失值的 id 为 -1, 对应末尾的 None
+    return pd.Series(converted.take(ids), index = codes.index, name = codes.name)
+
+
+def ts_codes(codes: Union[Iterable[str], pd.Series]) -> pd.Series:
+    """
+    批量转换证券代码为 tushare 标准格式, 例如 df['code'] = ts_codes(df['code'])
+    :param codes:
+    :return:
+    """
+    return _convert_codes_(codes, ts_code, __ts_codes__)
+
+
+def bao_codes(codes: Union[Iterable[str], pd.Series]) -> pd.Series:
+    """
+    批量转换证券代码为 baostock 标准格式
+    :param codes:
+    :return:
+    """
+    return _convert_codes_(codes, bao_code, __bao_codes__)
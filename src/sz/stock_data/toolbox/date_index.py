@@ -0,0 +1,133 @@
+import io
+import json
+import logging
+import os
+from datetime import date
+from typing import Dict, List, Union
+
+import colorama
+import numpy as np
+import pandas as pd
+
+from sz.stock_data.toolbox.storage import read_csv_file
+
+
+class DateOffsetIndex(object):
+    """
+    按日期升序排列的 csv 数据文件的日期索引: 每个日期第一行记录在文件中的字节偏移量, 保存在数据文件旁边的 json 文件中.
+    读取某一天或者某个日期区间时, 只需要读取表头和对应的字节区间, 不需要解析整个文件.
+    数据文件的大小或者修改时间变化时, 索引自动重建; 文件没有按日期排列 (或者记录中有换行) 时, 退回到逐块过滤
+    """
+
+    def __init__(self, fpath: str, date_column: str = 'trade_date'):
+        """
+        :param fpath: csv 数据文件路径
+        :param date_column: 文件排序使用的日期字段
+        """
+        self.fpath = fpath
+        self.date_column = date_column
+        self.days: Union[None, np.ndarray] = None
+        self.offsets: Union[None, np.ndarray] = None
+        self.header_size = 0
+        self._stat_ = None
+
+    def index_path(self) -> str:
+        return os.path.splitext(self.fpath)[0] + '.date_index.json'
+
+    def _file_stat_(self) -> List[int]:
+        stat = os.stat(self.fpath)
+        return [stat.st_size, stat.st_mtime_ns]
+
+    def build(self, dates: Union[None, pd.Series] = None) -> bool:
+        """
+        扫描数据文件中每一行的起始位置, 生成日期索引
+        :param dates: 数据文件中每一行的日期 (例如刚刚写入文件的 DataFrame 的日期列), 默认从文件中读取
+        :return: 能否建立索引
+        """
+        index_path = self.index_path()
+        self.days, self.offsets = None, None
+        if not os.path.exists(self.fpath):
+            return False
+        if dates is None:
+            dates = read_csv_file(self.fpath, parse_dates = [self.date_column],
+                                  columns = [self.date_column])[self.date_column]
+        days = pd.DatetimeIndex(dates).values.astype('datetime64[D]')
+
+        with open(self.fpath, 'rb') as f:
+            content = np.frombuffer(f.read(), dtype = np.uint8)
+        line_ends = np.flatnonzero(content == ord('\n'))
+        if len(line_ends) > 0 and line_ends[-1] != len(content) - 1:
+            line_ends = np.append(line_ends, len(content) - 1)
+        # 第一行为表头, 之后每一行对应一条记录
+        if len(line_ends) != len(days) + 1 or np.isnat(days).any() or (np.diff(days.astype(np.int64)) < 0).any():
+            if os.path.exists(index_path):
+                os.remove(index_path)
+            logging.debug(colorama.Fore.YELLOW + '数据文件没有按 %s 排列, 不建立日期索引: %s' % (self.date_column, self.fpath))
+            return False
+
+        row_starts = line_ends[:-1] + 1
+        first_rows = np.flatnonzero(np.concatenate([[True], days[1:] != days[:-1]])) if len(days) > 0 else \
+            np.array([], dtype = np.int64)
+        self.days = days[first_rows]
+        self.offsets = np.append(row_starts[first_rows], len(content)).astype(np.int64)
+        self.header_size = int(line_ends[0]) + 1
+        self._stat_ = self._file_stat_()
+
+        tmp_path = index_path + '.tmp'
+        with open(tmp_path, 'w', encoding = 'utf-8') as f:
+            json.dump({
+                'date_column': self.date_column,
+                'file_stat': self._stat_,
+                'header_size': self.header_size,
+                'days': [str(day) for day in self.days],
+                'offsets': self.offsets.tolist()
+            }, f)
+        os.replace(tmp_path, index_path)
+        return True
+
+    def prepare(self) -> bool:
+        """
+        加载日期索引, 索引不存在或者已经过期时重建
+        :return: 索引是否可用
+        """
+        if not os.path.exists(self.fpath):
+            return False
+        stat = self._file_stat_()
+        if self.offsets is not None and self._stat_ == stat:
+            return True
+
+        if os.path.exists(self.index_path()):
+            with open(self.index_path(), 'r', encoding = 'utf-8') as f:
+                index: Dict = json.load(f)
+            if index.get('file_stat', None) == stat and index.get('date_column', None) == self.date_column:
+                self.days = np.array(index['days'], dtype = 'datetime64[D]')
+                self.offsets = np.array(index['offsets'], dtype = np.int64)
+                self.header_size = index['header_size']
+                self._stat_ = stat
+                return True
+        return self.build()
+
+    def read(self, start: Union[str, date], end: Union[str, date],
+             parse_dates: Union[None, List[str]] = None) -> pd.DataFrame:
+        """
+        读取 [start, end] 之间的记录, 只读取表头和对应的字节区间
+        :param start:
+        :param end:
+        :param parse_dates:
+        :return:
+        """
+        if not self.prepare():
+            if not os.path.exists(self.fpath):
+                return pd.DataFrame()
+            return read_csv_file(self.fpath, parse_dates = parse_dates, date_column = self.date_column,
+                                 start = start, end = end)
+
+        first = np.searchsorted(self.days, pd.Timestamp(start).to_datetime64().astype('datetime64[D]'), side = 'left')
+        last = np.searchsorted(self.days, pd.Timestamp(end).to_datetime64().astype('datetime64[D]'), side = 'right')
+        with open(self.fpath, 'rb') as f:
+            header = f.read(self.header_size)
+            content = b''
+            if first < last:
+                f.seek(self.offsets[first])
+                content = f.read(self.offsets[last] - self.offsets[first])
+        return pd.read_csv(io.BytesIO(header + content), parse_dates = parse_dates)
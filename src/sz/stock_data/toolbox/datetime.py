@@ -1,9 +1,21 @@
-from typing import Union
+import re
+from typing import Iterable, List, Tuple, Union
 
 import pandas as pd
 import numpy as np
 from datetime import datetime, date
 
+# 数据接口返回的日期格式: (正则表达式, strptime 格式), 按顺序匹配
+date_formats: List[Tuple[str, str]] = [
+    (r'^\d{6}$', '%Y%m'),
+    (r'^\d{8}$', '%Y%m%d'),
+    (r'^\d{14}$', '%Y%m%d%H%M%S'),
+    # baostock 5min 线的 time 字段, 例如 20200102093500000
+    (r'^\d{17}$', '%Y%m%d%H%M%S%f'),
+    (r'^\d{4}-\d{2}-\d{2}$', '%Y-%m-%d'),
+    (r'^\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}$', '%Y-%m-%d %H:%M:%S'),
+]
+
 
 def yyyymmdd_date_parser(x):
     """
@@ -13,7 +25,7 @@ def yyyymmdd_date_parser(x):
     """
     item = str(x)
     if item and item != 'nan':
-        return pd.datetime.strptime(item, "%Y%m%d")
+        return datetime.strptime(item, "%Y%m%d")
     else:
         return np.nan
 
@@ -23,20 +35,70 @@ def ts_date(day: date) -> str:
 
 
 def to_datetime64(x: Union[str, pd.Timestamp, date]) -> Union[np.datetime64, None]:
+    """
+    转换单个日期. 转换整列数据时使用 to_datetime_column
+    :param x:
+    :return:
+    """
     if x is None:
         return None
-    if x is date:
-        return x
-    if x is pd.Timestamp:
+    if isinstance(x, pd.Timestamp):
         return pd.to_datetime(datetime(x.year, x.month, x.day))
+    if isinstance(x, date):
+        return pd.to_datetime(x)
 
-    if len(x) == 6:
-        return pd.to_datetime(x, format = '%Y%m')
-    elif len(x) == 8:
-        return pd.to_datetime(x, format = '%Y%m%d')
-    elif len(x) == 10:
-        return pd.to_datetime(x, format = '%Y-%m-%d')
-    elif len(x) == 10:
-        return pd.to_datetime(x, format = '%Y-%m-%d %H:%M:%S')
-    else:
+    date_format = date_format_of([x])
+    if date_format is None:
+        return None
+    return pd.to_datetime(str(x).strip(), format = date_format)
+
+
+def date_format_of(values: Union[Iterable, pd.Series]) -> Union[None, str]:
+    """
+    根据第一个非空的值识别日期格式
+    :param values:
+    :return: strptime 格式, 无法识别或者全部为空时返回 None
+    """
+    for value in values:
+        if value is None or (isinstance(value, float) and np.isnan(value)):
+            continue
+        text = str(value).strip()
+        if text == '' or text.lower() == 'nan':
+            continue
+        for pattern, date_format in date_formats:
+            if re.match(pattern, text):
+                return date_format
         return None
+    return None
+
+
+def to_datetime_column(values: pd.Series, date_format: Union[None, str] = None) -> pd.Series:
+    """
+    转换一整列日期: 只识别一次格式, 然后一次向量化转换. 无法解析的值转换为 NaT
+    :param values: 字符串或者整数 (例如 20200102) 的日期列, 已经是日期类型时直接返回
+    :param date_format: 指定格式时不再识别
+    :return:
+    """
+    if pd.api.types.is_datetime64_any_dtype(values):
+        return values
+    if pd.api.types.is_numeric_dtype(values):
+        # 从 csv 读取的 yyyymmdd 可能是整数或者带缺失值的浮点数
+        values = values.astype('Int64').astype(str).where(values.notna(), None)
+    if date_format is None:
+        date_format = date_format_of(values.dropna().head(16))
+    if date_format is None:
+        return pd.Series(pd.NaT, index = values.index, name = values.name, dtype = 'datetime64[ns]')
+    return pd.to_datetime(values, format = date_format, errors = 'coerce')
+
+
+def normalize_dates(df: pd.DataFrame, columns: Iterable[str]) -> pd.DataFrame:
+    """
+    原地转换数据接口返回的日期列, 不存在的列跳过
+    :param df:
+    :param columns:
+    :return: df
+    """
+    for column in columns:
+        if column in df.columns:
+            df[column] = to_datetime_column(df[column])
+    return df
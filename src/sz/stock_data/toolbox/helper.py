@@ -1,7 +1,11 @@
 import os
 from datetime import date
+from typing import Union, List
+
 import pandas as pd
 
+from sz.stock_data.toolbox.manifest import last_date_of
+
 
 def need_update(fpath: str, outdate_days: int) -> bool:
     """
@@ -38,6 +42,20 @@ def need_update_by_trade_date(df: pd.DataFrame, column_name: str) -> bool:
         return df.iloc[-1].loc[column_name].date() < StockData().trade_calendar.latest_trade_day()
 
 
+def need_update_by_manifest(fpath: str) -> Union[None, bool]:
+    """
+    根据清单中记录的最后日期判断是否需要更新, 不需要读取数据文件
+    :param fpath: 数据文件路径
+    :return: 清单中没有该数据文件的记录时返回 None, 由调用方读取数据文件后判断
+    """
+    last_date = last_date_of(fpath)
+    if last_date is None:
+        return None
+    else:
+        from sz.stock_data.stock_data import StockData
+        return last_date < StockData().trade_calendar.latest_trade_day()
+
+
 def mtime_of_file(fpath: str) -> date:
     """
     获取文件的最后修改日期
@@ -45,3 +63,45 @@ def mtime_of_file(fpath: str) -> date:
     :return:
     """
     return date.fromtimestamp(os.stat(fpath).st_mtime)
+
+
+def upsert_tail(df: pd.DataFrame, df_new: Union[pd.DataFrame, List[pd.DataFrame]], keys: List[str],
+                sort_column: Union[None, str] = None) -> pd.DataFrame:
+    """
+    按主键将新记录合并到已有数据中, 主键相同时以新记录为准
+    已有数据按 sort_column 升序排列时, 只对 sort_column 不小于新记录最小值的尾部做去重和排序,
+    历史部分不参与去重和排序. 最后拼接历史和尾部时仍然要复制全部历史, 因此开销为 O(历史) 的内存复制加上
+    O(尾部) 的去重排序, 比整体去重排序快, 但仍然随历史长度线性增长; 调用方写入文件时也仍然写入全部数据.
+    不指定 sort_column 时 (例如每次都返回完整数据的接口), 对全部记录按主键去重
+    :param df: 已有数据
+    :param df_new: 新记录, 可以是多个 DataFrame 的列表
+    :param keys: 主键字段, 例如 ['trade_date'], ['ts_code', 'trade_date']
+    :param sort_column: 排序字段, 例如 'trade_date', 'time'
+    :return: 合并后的数据
+    """
+    if isinstance(df_new, list):
+        df_new = [item for item in df_new if item is not None and not item.empty]
+        df_new = pd.concat(df_new) if len(df_new) > 0 else None
+    if df_new is None or df_new.empty:
+        return df
+
+    if df is None or df.empty:
+        head = None
+        tail = df_new
+    elif sort_column is None:
+        head = None
+        tail = pd.concat([df, df_new])
+    else:
+        position = df[sort_column].searchsorted(df_new[sort_column].min(), side = 'left')
+        head = df.iloc[:position]
+        tail = pd.concat([df.iloc[position:], df_new])
+
+    tail = tail.drop_duplicates(subset = keys, keep = 'last')
+    if sort_column is not None:
+        # 日期字段同时也是索引名称时, sort_values(by = ...) 会有歧义, 所以按字段的值排序
+        tail = tail.iloc[tail[sort_column].values.argsort(kind = 'mergesort')]
+
+    if head is None or head.empty:
+        return tail
+    else:
+        return pd.concat([head, tail])
@@ -0,0 +1,131 @@
+import json
+import logging
+import os
+import shutil
+from datetime import date, timedelta
+from typing import Dict, List, Tuple, Union
+
+import colorama
+import pandas as pd
+
+from sz.stock_data.toolbox.manifest import dataset_name
+from sz.stock_data.toolbox.storage import current_storage
+
+__resume__ = False
+
+
+def set_resume(resume: bool):
+    """
+    是否从上次中断的位置继续更新. 不继续时, 开始更新前会丢弃遗留的断点日志
+    :param resume:
+    :return:
+    """
+    global __resume__
+    __resume__ = resume
+
+
+def resume_enabled() -> bool:
+    return __resume__
+
+
+def _to_date_(value: Union[str, date]) -> date:
+    return pd.Timestamp(value).date()
+
+
+class UpdateJournal(object):
+    """
+    增量更新的断点日志. 每下载完成一个分块 (一段日期区间或者一个交易日), 立即保存到数据文件所在目录的
+    .journal/<数据集名称>/ 下; 中断之后以 resume 方式重新运行时, 从起始日期开始连续的已完成分块直接读取,
+    只下载之后的分块. 数据合并写入数据文件之后, 清除断点日志
+    """
+    index_name = 'journal.json'
+
+    def __init__(self, fpath: str):
+        """
+        :param fpath: 数据文件 (或者分段存储目录) 的路径
+        """
+        self.dir_path = os.path.join(os.path.dirname(fpath), '.journal', dataset_name(fpath))
+
+    def index_path(self) -> str:
+        return os.path.join(self.dir_path, self.index_name)
+
+    def chunks(self) -> List[Dict]:
+        """
+        已完成的分块, 按起始日期排序
+        :return: [{'start_date', 'end_date', 'file', 'parse_dates', 'index'}]
+        """
+        if not os.path.exists(self.index_path()):
+            return []
+        with open(self.index_path(), 'r', encoding = 'utf-8') as f:
+            return sorted(json.load(f), key = lambda chunk: chunk['start_date'])
+
+    def checkpoint(self, start_date: Union[str, date], end_date: Union[str, date], df: pd.DataFrame):
+        """
+        记录一个已完成的分块
+        :param start_date: 分块的起始日期
+        :param end_date: 分块的结束日期
+        :param df: 分块的数据, 可以为空 (例如当天没有龙虎榜数据)
+        :return:
+        """
+        os.makedirs(self.dir_path, exist_ok = True)
+        start_date, end_date = _to_date_(start_date), _to_date_(end_date)
+        chunk = {
+            'start_date': str(start_date),
+            'end_date': str(end_date),
+            'file': None,
+            'parse_dates': [str(column) for column in df.columns if pd.api.types.is_datetime64_any_dtype(df[column])],
+            'index': df.index.name if df.index.name in df.columns else None
+        }
+        if not df.empty:
+            chunk['file'] = '%s_%s%s' % (start_date.strftime('%Y%m%d'), end_date.strftime('%Y%m%d'),
+                                         current_storage().suffix)
+            fpath = os.path.join(self.dir_path, chunk['file'])
+            current_storage().write(df, fpath + '.tmp')
+            os.replace(fpath + '.tmp', fpath)
+
+        chunks = [c for c in self.chunks() if c['start_date'] != chunk['start_date']] + [chunk]
+        with open(self.index_path() + '.tmp', 'w', encoding = 'utf-8') as f:
+            json.dump(chunks, f, ensure_ascii = False, indent = 2)
+        os.replace(self.index_path() + '.tmp', self.index_path())
+
+    def resume(self, start_date: date) -> Tuple[List[pd.DataFrame], date]:
+        """
+        读取从 start_date 开始连续的已完成分块
+        :param start_date: 本次更新的起始日期
+        :return: (已完成分块的数据, 之后需要下载的起始日期)
+        """
+        if not resume_enabled():
+            self.clear()
+            return [], start_date
+
+        from sz.stock_data.stock_data import StockData
+        df_list: List[pd.DataFrame] = []
+        next_date = start_date
+        for chunk in self.chunks():
+            chunk_start, chunk_end = _to_date_(chunk['start_date']), _to_date_(chunk['end_date'])
+            if chunk_end < next_date:
+                continue
+            # 两个分块之间不能有遗漏的交易日
+            if chunk_start > next_date and StockData().trade_calendar.count_trade_days(
+                    next_date, chunk_start - timedelta(days = 1)) > 0:
+                break
+            if chunk['file'] is not None:
+                df = current_storage().read(os.path.join(self.dir_path, chunk['file']),
+                                            parse_dates = chunk['parse_dates'])
+                if chunk['index'] is not None:
+                    df.set_index(keys = chunk['index'], drop = False, inplace = True)
+                df_list.append(df)
+            next_date = chunk_end + timedelta(days = 1)
+
+        if next_date > start_date:
+            logging.info(colorama.Fore.YELLOW + '从断点日志恢复: %s -- %s, %s 个分块 path: %s' % (
+                start_date, next_date - timedelta(days = 1), len(df_list), self.dir_path))
+        return df_list, next_date
+
+    def clear(self):
+        """
+        数据已经写入数据文件, 清除断点日志
+        :return:
+        """
+        if os.path.isdir(self.dir_path):
+            shutil.rmtree(self.dir_path, ignore_errors = True)
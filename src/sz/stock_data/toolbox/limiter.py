@@ -1,3 +1,171 @@
-from ratelimiter import RateLimiter
+import asyncio
+import threading
+import time
+from functools import wraps
+from typing import Dict, Tuple
 
-ts_rate_limiter = RateLimiter(max_calls = 1, period = 1)
+import pandas as pd
+
+
+class TokenBucket(object):
+    """
+    令牌桶限速器: 桶内最多保存 capacity 个令牌 (允许的突发调用次数), 每秒补充 refill_rate 个令牌
+    获取令牌时先在锁内预约, 然后在锁外等待, 多个线程 (或协程) 按预约顺序依次通过
+    """
+
+    def __init__(self, capacity: float, refill_rate: float):
+        """
+        :param capacity: 令牌桶容量
+        :param refill_rate: 每秒补充的令牌数量
+        """
+        self.capacity = float(capacity)
+        self.refill_rate = float(refill_rate)
+        self._tokens = float(capacity)
+        self._last_time = time.monotonic()
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+
+    def _reserve_(self, tokens: float) -> float:
+        """
+        预约令牌, 返回需要等待的秒数. 令牌不足时余额为负, 后来的调用需要等待更长的时间
+        :param tokens:
+        :return:
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._last_time) * self.refill_rate)
+            self._last_time = now
+            self._tokens -= tokens
+            wait = 0.0 if self._tokens >= 0 else -self._tokens / self.refill_rate
+            self.calls += 1
+            self.wait_seconds += wait
+            self.max_wait_seconds = max(self.max_wait_seconds, wait)
+            return wait
+
+    def acquire(self, tokens: float = 1) -> float:
+        """
+        获取令牌, 令牌不足时阻塞当前线程
+        :param tokens:
+        :return: 等待的秒数
+        """
+        wait = self._reserve_(tokens)
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    async def acquire_async(self, tokens: float = 1) -> float:
+        """
+        获取令牌, 令牌不足时只挂起当前协程
+        :param tokens:
+        :return: 等待的秒数
+        """
+        wait = self._reserve_(tokens)
+        if wait > 0:
+            await asyncio.sleep(wait)
+        return wait
+
+
+class RateLimiterRegistry(object):
+    """
+    按接口名称管理令牌桶, 每个接口单独计算配额
+    """
+
+    def __init__(self, default_quota: Tuple[float, float], quotas: Dict[str, Tuple[float, float]]):
+        """
+        :param default_quota: 未单独配置的接口使用的配额: (每分钟调用次数, 突发调用次数)
+        :param quotas: 接口名称 -> (每分钟调用次数, 突发调用次数)
+        """
+        self.default_quota = default_quota
+        self.quotas = dict(quotas)
+        self._buckets: Dict[str, TokenBucket] = dict()
+        self._lock = threading.Lock()
+
+    def configure(self, endpoint: str, calls_per_minute: float, burst: float = 1):
+        """
+        设置接口的配额. 已经创建的令牌桶会被替换
+        :param endpoint: 接口名称, 例如 daily, moneyflow
+        :param calls_per_minute: 每分钟调用次数
+        :param burst: 突发调用次数 (令牌桶容量)
+        :return:
+        """
+        with self._lock:
+            self.quotas[endpoint] = (calls_per_minute, burst)
+            self._buckets.pop(endpoint, None)
+
+    def bucket(self, endpoint: str) -> TokenBucket:
+        with self._lock:
+            if endpoint not in self._buckets:
+                calls_per_minute, burst = self.quotas.get(endpoint, self.default_quota)
+                self._buckets[endpoint] = TokenBucket(capacity = burst, refill_rate = calls_per_minute / 60.0)
+            return self._buckets[endpoint]
+
+    def limit(self, endpoint: str):
+        """
+        限速装饰器, 例如:
+
+        @ts_rate_limit('moneyflow')
+        def ts_money_flow(...):
+            ...
+
+        :param endpoint: 接口名称
+        :return:
+        """
+
+        def decorator(func):
+            @wraps(func)
+            def wrapper(*args, **kwargs):
+                self.bucket(endpoint).acquire()
+                return func(*args, **kwargs)
+
+            return wrapper
+
+        return decorator
+
+    def stats(self) -> pd.DataFrame:
+        """
+        各接口的调用次数和等待时间
+        :return:
+        """
+        with self._lock:
+            buckets = dict(self._buckets)
+        return pd.DataFrame(
+            data = [[endpoint, bucket.calls, bucket.wait_seconds, bucket.max_wait_seconds]
+                    for endpoint, bucket in sorted(buckets.items())],
+            columns = ['endpoint', 'calls', 'wait_seconds', 'max_wait_seconds']
+        )
+
+
+# tushare 各接口的配额: (每分钟调用次数, 突发调用次数), 按账号的积分等级调整
+ts_rate_limiters = RateLimiterRegistry(
+    default_quota = (60, 1),
+    quotas = {
+        'daily': (500, 10),
+        'adj_factor': (500, 10),
+        'moneyflow': (300, 5),
+        'top_list': (200, 5),
+        'top_inst': (200, 5),
+        'block_trade': (200, 5),
+        'margin': (200, 5),
+        'margin_detail': (200, 5),
+        'top10_holders': (200, 5),
+        'top10_floatholders': (200, 5),
+        'stk_holdernumber': (200, 5),
+        'stk_holdertrade': (200, 5),
+        'pledge_stat': (200, 5),
+        'pledge_detail': (200, 5),
+        'suspend': (200, 5),
+        'concept': (200, 5),
+        'concept_detail': (200, 5),
+    }
+)
+
+
+def ts_rate_limit(endpoint: str):
+    """
+    tushare 接口的限速装饰器
+    :param endpoint: tushare 接口名称
+    :return:
+    """
+    return ts_rate_limiters.limit(endpoint)
@@ -0,0 +1,66 @@
+from typing import Dict, Iterable, List, Union
+
+import numpy as np
+import pandas as pd
+
+
+class CodeLookup(object):
+    """
+    按证券代码查询字段的索引, 加载数据时生成一次.
+    单个代码的查询是一次字典查找加一次列表下标, 不经过 DataFrame 的索引;
+    批量查询按代码数组一次取出, 返回与输入对齐的 Series
+    """
+
+    def __init__(self, df: pd.DataFrame, key: str, fields: List[str]):
+        """
+        :param df:
+        :param key: 代码字段, 例如 ts_code. 代码重复时以第一条记录为准
+        :param fields: 需要查询的字段
+        """
+        if df.empty or key not in df.columns:
+            df = pd.DataFrame(columns = [key] + fields)
+        df = df.drop_duplicates(subset = key, keep = 'first')
+        self.key = key
+        self.index = pd.Index(df[key].values)
+        self._rows: Dict[str, int] = {code: row for row, code in enumerate(df[key].values)}
+        # 数组末尾追加一个缺失值, 批量查询时找不到的代码映射到这个位置
+        self._arrays: Dict[str, np.ndarray] = dict()
+        self._scalars: Dict[str, list] = dict()
+        for field in fields:
+            values = df[field] if field in df.columns else pd.Series([None] * len(df), dtype = object)
+            if pd.api.types.is_datetime64_any_dtype(values):
+                array = pd.DatetimeIndex(values).values
+                self._arrays[field] = np.append(array, np.datetime64('NaT')).astype(array.dtype)
+                self._scalars[field] = [None if pd.isnull(value) else value.date()
+                                        for value in pd.DatetimeIndex(values)]
+            else:
+                self._arrays[field] = np.append(values.values.astype(object), None)
+                self._scalars[field] = [None if pd.isnull(value) else value for value in values.values]
+
+    def __contains__(self, code: str) -> bool:
+        return code in self._rows
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    def get(self, code: str, field: str):
+        """
+        查询单个代码的字段值, 日期字段返回 date, 缺失值返回 None
+        :param code:
+        :param field:
+        :return:
+        """
+        return self._scalars[field][self._rows[code]]
+
+    def bulk(self, codes: Union[Iterable[str], pd.Series], field: str) -> pd.Series:
+        """
+        批量查询, 找不到的代码返回缺失值 (日期字段为 NaT, 其他字段为 None)
+        :param codes:
+        :param field:
+        :return: 与 codes 对齐的 Series, codes 为 Series 时沿用其索引
+        """
+        index = codes.index if isinstance(codes, pd.Series) else None
+        positions = self.index.get_indexer(np.asarray(codes, dtype = object))
+        array = self._arrays[field]
+        positions[positions < 0] = len(array) - 1
+        return pd.Series(array.take(positions), index = index, name = field)
@@ -0,0 +1,161 @@
+import json
+import os
+import threading
+import zlib
+from datetime import date, datetime
+from typing import Union, Dict
+
+import pandas as pd
+
+# 数据文件结构发生不兼容的变化时, 增加版本号
+SCHEMA_VERSION = 1
+
+__manifest_locks__: Dict[str, threading.Lock] = dict()
+__manifest_locks_lock__ = threading.Lock()
+
+
+def manifest_path(fpath: str) -> str:
+    """
+    数据文件所在目录的清单文件路径. 同一个目录下的数据文件 (例如 stocks/<code>/ 下的各个数据集) 共用一个清单
+    :param fpath: 数据文件 (或者分段存储目录) 的路径
+    :return:
+    """
+    return os.path.join(os.path.dirname(fpath), 'manifest.json')
+
+
+def dataset_name(fpath: str) -> str:
+    """
+    数据集在清单中的名称: 去掉扩展名的文件名, 与存储格式无关
+    :param fpath:
+    :return:
+    """
+    return os.path.splitext(os.path.basename(fpath))[0]
+
+
+def _lock_of_(path: str) -> threading.Lock:
+    with __manifest_locks_lock__:
+        if path not in __manifest_locks__:
+            __manifest_locks__[path] = threading.Lock()
+        return __manifest_locks__[path]
+
+
+def read_manifest(fpath: str) -> Dict[str, Dict]:
+    """
+    读取数据文件所在目录的清单
+    :param fpath:
+    :return: 数据集名称 -> 清单记录
+    """
+    path = manifest_path(fpath)
+    if not os.path.exists(path):
+        return dict()
+    with open(path, 'r', encoding = 'utf-8') as f:
+        return json.load(f)
+
+
+def read_manifest_entry(fpath: str) -> Union[None, Dict]:
+    """
+    读取数据文件的清单记录, 清单不存在或者版本不一致时返回 None
+    :param fpath:
+    :return:
+    """
+    entry = read_manifest(fpath).get(dataset_name(fpath), None)
+    if entry is None or entry.get('schema_version', None) != SCHEMA_VERSION:
+        return None
+    return entry
+
+
+def last_date_of(fpath: str) -> Union[None, date]:
+    """
+    从清单中读取数据文件最后一条记录的日期
+    :param fpath:
+    :return: 没有清单记录时返回 None
+    """
+    entry = read_manifest_entry(fpath)
+    if entry is None or entry.get('last_date', None) is None:
+        return None
+    return datetime.strptime(entry['last_date'], '%Y-%m-%d').date()
+
+
+def checksum_of(fpath: str) -> str:
+    """
+    数据文件的 crc32 校验值. 分段存储的目录只对各分段的文件名和大小做校验, 避免读取全部历史数据
+    :param fpath:
+    :return:
+    """
+    crc = 0
+    if os.path.isdir(fpath):
+        for fname in sorted(os.listdir(fpath)):
+            crc = zlib.crc32(('%s:%s;' % (fname, os.path.getsize(os.path.join(fpath, fname)))).encode(), crc)
+    else:
+        with open(fpath, 'rb') as f:
+            for block in iter(lambda: f.read(1024 * 1024), b''):
+                crc = zlib.crc32(block, crc)
+    return '%08x' % crc
+
+
+def write_manifest_entry(fpath: str, df: pd.DataFrame, date_column: Union[None, str] = None,
+                         covered_date: Union[None, date] = None, extra: Union[None, Dict] = None):
+    """
+    数据文件写入完成后, 更新清单中对应的记录. 清单先写入临时文件再替换, 保证原子性
+    :param fpath: 数据文件 (或者分段存储目录) 的路径
+    :param df: 已经写入的完整数据
+    :param date_column: 记录日期的字段, 用于计算最后日期
+    :param covered_date: 数据已经检查到的日期 (例如按交易日下载全市场数据时, 停牌的股票当天没有记录),
+                         晚于最后一条记录的日期时, 作为清单中的最后日期
+    :param extra: 数据集自定义的附加字段 (例如复权缓存对应的因子), 与标准字段一起保存
+    :return:
+    """
+    last_date = None
+    if date_column is not None and not df.empty and date_column in df.columns:
+        last_value = pd.to_datetime(df[date_column]).max()
+        if not pd.isnull(last_value):
+            last_date = last_value.strftime('%Y-%m-%d')
+    if covered_date is not None and (last_date is None or covered_date.strftime('%Y-%m-%d') > last_date):
+        last_date = covered_date.strftime('%Y-%m-%d')
+
+    entry = {
+        'last_date': last_date,
+        'row_count': int(df.shape[0]),
+        'columns': [str(column) for column in df.columns],
+        'schema_version': SCHEMA_VERSION,
+        'checksum': checksum_of(fpath),
+        'updated_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    }
+    if extra is not None:
+        entry.update(extra)
+
+    path = manifest_path(fpath)
+    with _lock_of_(path):
+        manifest = read_manifest(fpath)
+        manifest[dataset_name(fpath)] = entry
+        _write_manifest_(path, manifest)
+
+
+def advance_covered_date(fpath: str, covered_date: date) -> bool:
+    """
+    数据文件没有新增记录, 只是检查到了更晚的日期时 (例如停牌的股票), 只更新清单中的最后日期, 不重写数据文件
+    :param fpath: 数据文件 (或者分段存储目录) 的路径
+    :param covered_date: 数据已经检查到的日期
+    :return: 清单中没有该数据文件的有效记录时返回 False, 需要由调用方完整写入一次
+    """
+    path = manifest_path(fpath)
+    with _lock_of_(path):
+        manifest = read_manifest(fpath)
+        entry = manifest.get(dataset_name(fpath), None)
+        if entry is None or entry.get('schema_version', None) != SCHEMA_VERSION:
+            return False
+        if entry.get('last_date', None) is None or covered_date.strftime('%Y-%m-%d') > entry['last_date']:
+            entry['last_date'] = covered_date.strftime('%Y-%m-%d')
+            entry['updated_at'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+            _write_manifest_(path, manifest)
+    return True
+
+
+def _write_manifest_(path: str, manifest: Dict[str, Dict]):
+    """
+    清单先写入临时文件再替换, 保证原子性
+    """
+    tmp_path = '%s.%s.tmp' % (path, threading.get_ident())
+    with open(tmp_path, 'w', encoding = 'utf-8') as f:
+        json.dump(manifest, f, ensure_ascii = False, indent = 2, sort_keys = True)
+    os.replace(tmp_path, path)
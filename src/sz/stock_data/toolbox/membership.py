@@ -0,0 +1,146 @@
+from datetime import date
+from typing import Dict, Tuple, Union
+
+import numpy as np
+import pandas as pd
+
+# 没有纳入日期或者剔除日期时使用的边界
+__min_day__ = np.datetime64('1900-01-01', 'D')
+__max_day__ = np.datetime64('2200-01-01', 'D')
+
+
+def _interval_days_(values: Union[None, pd.Series], length: int, fill: np.datetime64) -> np.ndarray:
+    if values is None:
+        return np.full(length, fill, dtype = 'datetime64[D]')
+    days = pd.DatetimeIndex(pd.to_datetime(values, errors = 'coerce')).values.astype('datetime64[D]')
+    days[np.isnat(days)] = fill
+    return days
+
+
+class MembershipIndex(object):
+    """
+    板块 (概念, 行业等) 与股票的双向成员索引, 以 CSR 数组保存:
+        板块 -> 股票: group_ptr[g]:group_ptr[g + 1] 是板块 g 的成员在 group_members 中的区间
+        股票 -> 板块: code_ptr[c]:code_ptr[c + 1] 是股票 c 所属板块在 code_groups 中的区间
+    每条成员关系带有有效区间 [纳入日期, 剔除日期), 缺失的纳入日期视为一直有效, 缺失的剔除日期视为至今有效
+    """
+
+    def __init__(self, df: pd.DataFrame, group_column: str, code_column: str = 'ts_code',
+                 name_column: Union[None, str] = None, in_column: Union[None, str] = None,
+                 out_column: Union[None, str] = None):
+        """
+        :param df: 成员关系表, 每行一条 (板块, 股票) 关系
+        :param group_column: 板块字段, 例如概念 id 或者行业名称
+        :param code_column: 股票代码字段
+        :param name_column: 板块名称字段
+        :param in_column: 纳入日期字段
+        :param out_column: 剔除日期字段
+        """
+        if df.empty or group_column not in df.columns or code_column not in df.columns:
+            df = pd.DataFrame(columns = [group_column, code_column])
+        df = df[df[group_column].notna() & df[code_column].notna() & (df[group_column].astype(str) != '')]
+
+        group_ids, self.groups = pd.factorize(df[group_column], sort = True)
+        code_ids, self.codes = pd.factorize(df[code_column], sort = True)
+        in_days = _interval_days_(df[in_column] if in_column in df.columns else None, len(df), __min_day__)
+        out_days = _interval_days_(df[out_column] if out_column in df.columns else None, len(df), __max_day__)
+
+        if name_column is not None and name_column in df.columns:
+            self.group_names = pd.Series(df[name_column].values, index = group_ids).groupby(level = 0).first() \
+                .reindex(range(len(self.groups))).values
+        else:
+            self.group_names = np.asarray(self.groups, dtype = object)
+
+        order = np.lexsort((code_ids, group_ids))
+        self.group_ptr = np.concatenate([[0], np.cumsum(np.bincount(group_ids, minlength = len(self.groups)))])
+        self.group_members = code_ids[order].astype(np.int32)
+        self.group_in = in_days[order]
+        self.group_out = out_days[order]
+
+        order = np.lexsort((group_ids, code_ids))
+        self.code_ptr = np.concatenate([[0], np.cumsum(np.bincount(code_ids, minlength = len(self.codes)))])
+        self.code_groups = group_ids[order].astype(np.int32)
+        self.code_in = in_days[order]
+        self.code_out = out_days[order]
+
+        self._group_position: Dict = {group: index for index, group in enumerate(self.groups)}
+        self._code_position: Dict[str, int] = {code: index for index, code in enumerate(self.codes)}
+
+    @staticmethod
+    def _valid_(in_days: np.ndarray, out_days: np.ndarray, on: Union[None, str, date]) -> np.ndarray:
+        if on is None:
+            return np.ones(len(in_days), dtype = bool)
+        day = pd.Timestamp(on).to_datetime64().astype('datetime64[D]')
+        return (in_days <= day) & (day < out_days)
+
+    def members_of(self, group, on: Union[None, str, date] = None) -> np.ndarray:
+        """
+        板块的成员股票
+        :param group: 板块, 例如概念 id
+        :param on: 指定日期时只返回当天有效的成员, 否则返回全部历史成员
+        :return: 股票代码数组
+        """
+        position = self._group_position.get(group, None)
+        if position is None:
+            return np.array([], dtype = object)
+        start, end = self.group_ptr[position], self.group_ptr[position + 1]
+        valid = self._valid_(self.group_in[start:end], self.group_out[start:end], on)
+        return np.asarray(self.codes)[self.group_members[start:end][valid]]
+
+    def groups_of(self, code: str, on: Union[None, str, date] = None) -> np.ndarray:
+        """
+        股票所属的板块
+        :param code: 股票代码
+        :param on: 指定日期时只返回当天有效的板块, 否则返回全部历史板块
+        :return: 板块数组
+        """
+        position = self._code_position.get(code, None)
+        if position is None:
+            return np.array([], dtype = object)
+        start, end = self.code_ptr[position], self.code_ptr[position + 1]
+        valid = self._valid_(self.code_in[start:end], self.code_out[start:end], on)
+        return np.asarray(self.groups)[self.code_groups[start:end][valid]]
+
+    def name_of_group(self, group) -> str:
+        return self.group_names[self._group_position[group]]
+
+    def edges(self, on: Union[None, str, date] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        指定日期有效的全部成员关系
+        :param on:
+        :return: (板块序号数组, 股票序号数组), 序号对应 groups 和 codes
+        """
+        group_ids = np.repeat(np.arange(len(self.groups), dtype = np.int32), np.diff(self.group_ptr))
+        valid = self._valid_(self.group_in, self.group_out, on)
+        return group_ids[valid], self.group_members[valid]
+
+    def member_counts(self, on: Union[None, str, date] = None) -> pd.Series:
+        """
+        每个板块的成员数量
+        :param on:
+        :return: index 为板块
+        """
+        group_ids, _ = self.edges(on)
+        return pd.Series(np.bincount(group_ids, minlength = len(self.groups)), index = self.groups)
+
+    def aggregate(self, values: pd.Series, on: Union[None, str, date] = None, how: str = 'mean') -> pd.Series:
+        """
+        按板块汇总个股的数值, 例如板块的平均涨跌幅. 缺失值不参与计算
+        :param values: index 为股票代码的数值
+        :param on: 成员关系的有效日期
+        :param how: sum, mean 或者 count
+        :return: index 为板块
+        """
+        group_ids, code_ids = self.edges(on)
+        code_values = values.reindex(self.codes).values.astype(np.float64)[code_ids]
+        present = ~np.isnan(code_values)
+        count = np.bincount(group_ids[present], minlength = len(self.groups))
+        if how == 'count':
+            return pd.Series(count, index = self.groups)
+        total = np.bincount(group_ids[present], weights = code_values[present], minlength = len(self.groups))
+        if how == 'sum':
+            return pd.Series(total, index = self.groups)
+        if how == 'mean':
+            with np.errstate(invalid = 'ignore', divide = 'ignore'):
+                return pd.Series(total / count, index = self.groups)
+        raise Exception('不支持的汇总方式: %s' % how)
@@ -0,0 +1,197 @@
+import logging
+import threading
+from datetime import date, timedelta
+from typing import Callable, Dict, Iterator, List, Tuple
+
+import colorama
+import pandas as pd
+
+
+class RangeFetcher(object):
+    """
+    按日期区间分块下载, 自适应调整区间长度.
+    根据已下载的数据学习每个自然日的平均记录条数 (密度), 下一个区间的长度取 row_limit * fill_ratio / 密度,
+    数据稀疏时区间变长, 减少调用次数; 数据密集时区间变短, 避免超出接口单次返回的记录条数上限.
+    返回的记录条数达到上限时, 认为数据被截断, 将区间一分为二重新下载.
+    同一个接口的所有数据集 (例如每只股票) 共用一个 RangeFetcher, 密度在多次更新之间持续学习
+    """
+
+    def __init__(self, name: str, row_limit: int, initial_days: int, min_days: int = 1, max_days: int = 3650,
+                 fill_ratio: float = 0.8, truncates: bool = True):
+        """
+        :param name: 接口名称
+        :param row_limit: 单次调用返回的记录条数上限
+        :param initial_days: 初始区间长度 (自然日)
+        :param min_days: 最短区间长度
+        :param max_days: 最长区间长度
+        :param fill_ratio: 区间的预期记录条数占上限的比例, 留出余量应对密度波动
+        :param truncates: 达到上限时接口是否会截断数据. 没有硬性上限的接口 (例如 baostock), row_limit 只是单次调用的目标条数
+        """
+        self.name = name
+        self.row_limit = row_limit
+        self.min_days = max(1, min_days)
+        self.max_days = max(self.min_days, max_days)
+        self.fill_ratio = fill_ratio
+        self.truncates = truncates
+        # 初始密度按初始区间长度反推
+        self._density = row_limit * fill_ratio / max(1, initial_days)
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.rows = 0
+        self.splits = 0
+
+    def density(self) -> float:
+        """
+        每个自然日的平均记录条数
+        :return:
+        """
+        return self._density
+
+    def window_days(self) -> int:
+        """
+        下一个区间的长度 (自然日)
+        :return:
+        """
+        if self._density <= 0:
+            return self.max_days
+        days = int(self.row_limit * self.fill_ratio / self._density)
+        return min(self.max_days, max(self.min_days, days))
+
+    def observe(self, start_date: date, end_date: date, rows: int):
+        """
+        根据一次下载的结果更新密度. 密度变大时立即采用, 变小时逐步衰减,
+        因此遇到空区间时区间长度最多翻倍, 不会一次跳到很长的区间
+        :param start_date:
+        :param end_date:
+        :param rows: 返回的记录条数
+        :return:
+        """
+        days = (end_date - start_date).days + 1
+        density = rows / max(1, days)
+        with self._lock:
+            self.calls += 1
+            self.rows += rows
+            if density >= self._density:
+                self._density = density
+            else:
+                self._density = (self._density + density) / 2
+
+    def is_truncated(self, df: pd.DataFrame) -> bool:
+        return self.truncates and df.shape[0] >= self.row_limit
+
+    def ranges(self, start_date: date, end_date: date) -> List[Tuple[date, date]]:
+        """
+        按当前的密度划分日期区间, 用于预先生成下载任务 (例如 baostock 多进程下载)
+        :param start_date:
+        :param end_date:
+        :return: [(区间起始日期, 区间结束日期)]
+        """
+        result: List[Tuple[date, date]] = []
+        days = self.window_days()
+        while start_date <= end_date:
+            window_end = min(start_date + timedelta(days = days - 1), end_date)
+            result.append((start_date, window_end))
+            start_date = window_end + timedelta(days = 1)
+        return result
+
+    def fetch(self, fetch: Callable[[date, date], pd.DataFrame], start_date: date,
+              end_date: date) -> Iterator[Tuple[date, date, pd.DataFrame]]:
+        """
+        分块下载 start_date -- end_date 之间的数据, 按日期顺序返回每个完整的区间.
+        数据被截断的区间拆分后重新下载, 只有一天的区间仍然被截断时抛出异常
+        :param fetch: 下载函数, 参数为 (区间起始日期, 区间结束日期)
+        :param start_date:
+        :param end_date:
+        :return: (区间起始日期, 区间结束日期, 数据)
+        """
+        while start_date <= end_date:
+            window_end = min(start_date + timedelta(days = self.window_days() - 1), end_date)
+            pending: List[Tuple[date, date]] = [(start_date, window_end)]
+            while len(pending) > 0:
+                chunk_start, chunk_end = pending.pop()
+                df = fetch(chunk_start, chunk_end)
+                if self.is_truncated(df):
+                    if chunk_start >= chunk_end:
+                        raise Exception('[%s] 超出记录条数上限[%s], %s' % (self.name, self.row_limit, chunk_start))
+                    middle = chunk_start + timedelta(days = (chunk_end - chunk_start).days // 2)
+                    # 截断时真实密度至少是 上限 / 区间长度
+                    self.observe(chunk_start, chunk_end, df.shape[0])
+                    with self._lock:
+                        self.splits += 1
+                    logging.debug(colorama.Fore.YELLOW + '[%s] 返回 %s 条记录达到上限, 拆分区间: %s -- %s' % (
+                        self.name, df.shape[0], chunk_start, chunk_end))
+                    pending.append((middle + timedelta(days = 1), chunk_end))
+                    pending.append((chunk_start, middle))
+                    continue
+                self.observe(chunk_start, chunk_end, df.shape[0])
+                yield chunk_start, chunk_end, df
+            start_date = window_end + timedelta(days = 1)
+
+
+__fetchers__: Dict[str, RangeFetcher] = dict()
+__fetchers_lock__ = threading.Lock()
+
+# tushare 各接口单次调用返回的记录条数上限, 按账号的积分等级调整
+ts_row_limits: Dict[str, int] = {
+    'block_trade': 1000,
+    'margin': 4000,
+}
+ts_default_row_limit = 4000
+
+
+def shared_range_fetcher(name: str, row_limit: int, initial_days: int, max_days: int = 3650,
+                         truncates: bool = True) -> RangeFetcher:
+    """
+    按名称共用 RangeFetcher, 第一次调用时创建
+    :param name:
+    :param row_limit:
+    :param initial_days:
+    :param max_days:
+    :param truncates:
+    :return:
+    """
+    with __fetchers_lock__:
+        if name not in __fetchers__:
+            __fetchers__[name] = RangeFetcher(name = name, row_limit = row_limit, initial_days = initial_days,
+                                              max_days = max_days, truncates = truncates)
+        return __fetchers__[name]
+
+
+def ts_range_fetcher(endpoint: str, initial_days: int, max_days: int = 3650) -> RangeFetcher:
+    """
+    tushare 接口的 RangeFetcher, 记录条数达到上限时拆分区间
+    :param endpoint: tushare 接口名称
+    :param initial_days:
+    :param max_days:
+    :return:
+    """
+    return shared_range_fetcher(name = endpoint, row_limit = ts_row_limits.get(endpoint, ts_default_row_limit),
+                                initial_days = initial_days, max_days = max_days)
+
+
+def bao_range_fetcher(name: str, rows_per_call: int, initial_days: int, max_days: int = 3650) -> RangeFetcher:
+    """
+    baostock 接口的 RangeFetcher. baostock 不截断数据, 但是单次查询的数据过多时容易超时,
+    按 rows_per_call 控制每次查询的记录条数
+    :param name: 例如 bao_5min
+    :param rows_per_call: 单次查询的目标记录条数
+    :param initial_days:
+    :param max_days:
+    :return:
+    """
+    return shared_range_fetcher(name = name, row_limit = rows_per_call, initial_days = initial_days,
+                                max_days = max_days, truncates = False)
+
+
+def range_fetcher_stats() -> pd.DataFrame:
+    """
+    各接口的调用次数, 记录条数, 拆分次数和当前的区间长度
+    :return:
+    """
+    with __fetchers_lock__:
+        fetchers = dict(__fetchers__)
+    return pd.DataFrame(
+        data = [[name, fetcher.calls, fetcher.rows, fetcher.splits, fetcher.density(), fetcher.window_days()]
+                for name, fetcher in sorted(fetchers.items())],
+        columns = ['endpoint', 'calls', 'rows', 'splits', 'rows_per_day', 'window_days']
+    )
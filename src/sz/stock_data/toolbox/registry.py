@@ -0,0 +1,129 @@
+import logging
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, Tuple, Union
+
+import colorama
+import pandas as pd
+
+from sz.stock_data.toolbox.data_provider import ts_code
+from sz.stock_data.toolbox.manifest import read_manifest_entry
+
+
+def version_of(fpath: str) -> Union[None, Tuple]:
+    """
+    数据文件当前的版本: 优先使用清单记录 (每次写入数据都会更新), 没有清单记录时使用文件的修改时间
+    :param fpath: 数据文件 (或者分段存储目录) 的路径
+    :return: 文件不存在时返回 None
+    """
+    entry = read_manifest_entry(fpath)
+    if entry is not None:
+        return entry.get('checksum', None), entry.get('updated_at', None), entry.get('row_count', None)
+    if os.path.exists(fpath):
+        return 'mtime', os.stat(fpath).st_mtime_ns
+    return None
+
+
+def memory_of(dataset) -> int:
+    df = getattr(dataset, 'dataframe', None)
+    if isinstance(df, pd.DataFrame):
+        return int(df.memory_usage(index = True, deep = True).sum())
+    return 0
+
+
+class DatasetRegistry(object):
+    """
+    已加载数据集的共享缓存, 按 (数据集类, 股票代码) 返回同一个已经 load() 的实例.
+    缓存按最近使用顺序淘汰, 总内存 (DataFrame.memory_usage(deep = True)) 不超过预算;
+    每次获取时检查数据文件的清单记录, 数据更新之后自动重新加载. 返回的实例是共享的, 调用方不应修改其中的数据
+    """
+
+    def __init__(self, data_dir: str, max_bytes: int = 1 << 30):
+        """
+        :param data_dir: 本地数据目录
+        :param max_bytes: 缓存的内存预算, 单个数据集超过预算时不缓存
+        """
+        self.data_dir = data_dir
+        self.max_bytes = max_bytes
+        # key -> (数据集实例, 数据文件版本, 内存大小)
+        self._entries: OrderedDict = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, dataset_class, stock_code: Union[None, str] = None, **kwargs):
+        """
+        获取已经加载的数据集
+        :param dataset_class: 数据集类, 例如 StockDaily
+        :param stock_code: 个股数据集的股票代码, 全市场数据集为 None
+        :param kwargs: 数据集构造函数的其他参数, 例如 ResampledBars 的 frequency
+        :return: 数据集实例
+        """
+        stock_code = ts_code(stock_code) if stock_code is not None else None
+        key = (dataset_class, stock_code, tuple(sorted(kwargs.items())))
+        with self._lock:
+            cached = self._entries.get(key, None)
+        if cached is not None:
+            dataset, version, _ = cached
+            if version_of(dataset.file_path()) == version:
+                with self._lock:
+                    if key in self._entries:
+                        self._entries.move_to_end(key)
+                    self.hits += 1
+                return dataset
+            logging.debug(colorama.Fore.YELLOW + '数据已更新, 重新加载: %s %s' % (dataset_class.__name__, stock_code))
+
+        if stock_code is None:
+            dataset = dataset_class(self.data_dir, **kwargs)
+        else:
+            dataset = dataset_class(self.data_dir, stock_code, **kwargs)
+        # 先读取版本再加载, 加载期间数据被更新时, 下次获取会重新加载
+        version = version_of(dataset.file_path())
+        dataset.load()
+        self._put_(key, dataset, version)
+        return dataset
+
+    def _put_(self, key: Tuple, dataset, version: Union[None, Tuple]):
+        size = memory_of(dataset)
+        with self._lock:
+            self.misses += 1
+            self._remove_(key)
+            if size > self.max_bytes:
+                return
+            self._entries[key] = (dataset, version, size)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                self._remove_(next(iter(self._entries)))
+                self.evictions += 1
+
+    def _remove_(self, key: Tuple):
+        cached = self._entries.pop(key, None)
+        if cached is not None:
+            self._bytes -= cached[2]
+
+    def invalidate(self, dataset_class = None, stock_code: Union[None, str] = None):
+        """
+        删除缓存
+        :param dataset_class: 默认删除全部
+        :param stock_code: 只删除指定股票的缓存
+        :return:
+        """
+        with self._lock:
+            for key in list(self._entries.keys()):
+                if (dataset_class is None or key[0] is dataset_class) and \
+                        (stock_code is None or key[1] == ts_code(stock_code)):
+                    self._remove_(key)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions
+            }
@@ -0,0 +1,238 @@
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from datetime import datetime
+from typing import Callable, Dict, Iterable, List, Tuple, Union
+
+import colorama
+
+from sz.stock_data.toolbox.helper import need_update_by_manifest
+
+# 子任务: (名称, 更新函数, 是否已经是最新的判断函数)
+Job = Tuple[str, Callable[[], None], Union[None, Callable[[], bool]]]
+
+
+class Node(object):
+    """
+    任务图中的一个节点
+    更新函数返回子任务列表时, 节点展开为一组子任务 (例如每只股票一个子任务), 全部子任务结束后节点才算完成
+    """
+    pending = 'pending'
+    running = 'running'
+    expanded = 'expanded'
+    done = 'done'
+    fresh = 'fresh'
+    failed = 'failed'
+    skipped = 'skipped'
+
+    def __init__(self, name: str, fn: Callable, dependencies: Iterable[str] = (),
+                 is_fresh: Union[None, Callable[[], bool]] = None, parent: Union[None, 'Node'] = None):
+        self.name = name
+        self.fn = fn
+        self.dependencies = list(dependencies)
+        self.is_fresh = is_fresh
+        self.parent = parent
+        self.children: List[Node] = []
+        self.status = Node.pending
+        self.start_time: Union[None, datetime] = None
+        self.end_time: Union[None, datetime] = None
+        self.error: Union[None, Exception] = None
+
+    def finished(self) -> bool:
+        return self.status in (Node.done, Node.fresh, Node.failed, Node.skipped)
+
+    def succeeded(self) -> bool:
+        return self.status in (Node.done, Node.fresh)
+
+    def seconds(self) -> float:
+        if self.start_time is None or self.end_time is None:
+            return 0.0
+        return (self.end_time - self.start_time).total_seconds()
+
+
+def dataset_job(name: str, dataset) -> Job:
+    """
+    数据集对象的子任务, 清单中记录的数据已经是最新时跳过
+    :param name:
+    :param dataset: 提供 file_path() 和 update() 的数据集对象
+    :return:
+    """
+    return name, dataset.update, lambda: need_update_by_manifest(dataset.file_path()) is False
+
+
+class UpdateScheduler(object):
+    """
+    按依赖关系并发执行数据更新任务. 依赖的节点全部成功之后, 节点才会开始执行, 相互独立的节点并发执行;
+    依赖的节点失败时, 跳过后续节点. 全部执行完毕后输出关键路径的耗时
+    数据集类通过类属性 dependencies 声明依赖的数据集类名, 例如 StockDaily.dependencies = ['TradeCalendar', 'StockBasic', ...]
+    """
+
+    def __init__(self, max_workers: int = 4):
+        self.max_workers = max(1, max_workers)
+        self.nodes: Dict[str, Node] = OrderedDict()
+        self._lock = threading.Lock()
+        self.start_time: Union[None, datetime] = None
+        self.end_time: Union[None, datetime] = None
+
+    def add(self, name: str, fn: Callable, dependencies: Iterable[str] = (),
+            is_fresh: Union[None, Callable[[], bool]] = None) -> Node:
+        """
+        添加节点
+        :param name: 节点名称, 一般为数据集类名
+        :param fn: 更新函数. 返回子任务 (Job) 列表时, 节点展开为一组并发执行的子任务
+        :param dependencies: 依赖的节点名称
+        :param is_fresh: 判断数据是否已经是最新的函数, 返回 True 时跳过该节点
+        :return:
+        """
+        node = Node(name = name, fn = fn, dependencies = dependencies, is_fresh = is_fresh)
+        with self._lock:
+            if name in self.nodes:
+                raise Exception('任务节点重复: %s' % name)
+            self.nodes[name] = node
+        return node
+
+    def add_dataset(self, dataset, name: Union[None, str] = None) -> Node:
+        """
+        添加数据集节点, 依赖关系取自数据集类的 dependencies 属性
+        :param dataset: 数据集对象
+        :param name: 默认为数据集类名
+        :return:
+        """
+        name, fn, is_fresh = dataset_job(name if name is not None else type(dataset).__name__, dataset)
+        return self.add(name = name, fn = fn, dependencies = getattr(type(dataset), 'dependencies', []),
+                        is_fresh = is_fresh)
+
+    @staticmethod
+    def _run_node_(node: Node):
+        node.start_time = datetime.now()
+        try:
+            if node.is_fresh is not None and node.is_fresh():
+                return Node.fresh
+            return node.fn()
+        finally:
+            node.end_time = datetime.now()
+
+    def _ready_nodes_(self) -> List[Node]:
+        """
+        检查等待中的节点: 依赖失败的节点标记为跳过, 依赖全部成功的节点返回, 准备执行
+        :return:
+        """
+        ready: List[Node] = []
+        with self._lock:
+            for node in self.nodes.values():
+                if node.status != Node.pending:
+                    continue
+                dependencies = [self.nodes.get(name, None) for name in node.dependencies]
+                missing = [name for name, dependency in zip(node.dependencies, dependencies) if dependency is None]
+                if len(missing) > 0:
+                    node.status = Node.skipped
+                    node.error = Exception('依赖的任务节点不存在: %s' % ', '.join(missing))
+                elif any(dependency.status in (Node.failed, Node.skipped) for dependency in dependencies):
+                    node.status = Node.skipped
+                elif all(dependency.succeeded() for dependency in dependencies):
+                    node.status = Node.running
+                    ready.append(node)
+        return ready
+
+    def _finish_expanded_(self, node: Node):
+        """
+        展开的节点在全部子任务结束后完成, 子任务失败不影响后续节点
+        """
+        if node.status == Node.expanded and all(child.finished() for child in node.children):
+            node.status = Node.done
+            node.end_time = max([node.end_time] + [child.end_time for child in node.children if child.end_time])
+
+    def run(self):
+        """
+        执行全部节点
+        :return:
+        """
+        self.start_time = datetime.now()
+        running = dict()
+        with ThreadPoolExecutor(max_workers = self.max_workers, thread_name_prefix = 'update') as pool:
+            while True:
+                for node in self._ready_nodes_():
+                    running[pool.submit(self._run_node_, node)] = node
+                if len(running) == 0:
+                    break
+
+                finished, _ = wait(list(running.keys()), return_when = FIRST_COMPLETED)
+                for future in finished:
+                    node = running.pop(future)
+                    self._on_finished_(node, future, pool, running)
+
+        self.end_time = datetime.now()
+
+    def _on_finished_(self, node: Node, future, pool: ThreadPoolExecutor, running: Dict):
+        ex = future.exception()
+        if ex is not None:
+            node.status = Node.failed
+            node.error = ex
+            logging.warning(colorama.Fore.RED + '[%s] 更新失败: %s' % (node.name, ex))
+        elif future.result() == Node.fresh:
+            node.status = Node.fresh
+        elif isinstance(future.result(), list) and len(future.result()) > 0:
+            node.status = Node.expanded
+            for name, fn, is_fresh in future.result():
+                child = Node(name = '%s:%s' % (node.name, name), fn = fn, is_fresh = is_fresh, parent = node)
+                child.status = Node.running
+                node.children.append(child)
+                running[pool.submit(self._run_node_, child)] = child
+            logging.debug(colorama.Fore.YELLOW + '[%s] 展开为 %s 个子任务' % (node.name, len(node.children)))
+        else:
+            node.status = Node.done
+
+        if node.parent is not None:
+            children = node.parent.children
+            finished_count = sum(1 for child in children if child.finished())
+            logging.info(colorama.Fore.LIGHTGREEN_EX + '%s %s, 进度: (%s/%s) %.2f %%' % (
+                node.name, node.status, finished_count, len(children), finished_count * 100.0 / len(children)))
+            self._finish_expanded_(node.parent)
+            if node.parent.finished():
+                logging.debug(colorama.Fore.LIGHTGREEN_EX + '[%s] 更新完毕: %s 个子任务, %s 个失败' % (
+                    node.parent.name, len(node.parent.children),
+                    sum(1 for child in node.parent.children if child.status == Node.failed)))
+        elif node.finished():
+            logging.debug(colorama.Fore.LIGHTGREEN_EX + '[%s] %s, 耗时 %.1f 秒' % (node.name, node.status, node.seconds()))
+
+    def critical_path(self) -> List[Node]:
+        """
+        关键路径: 从最后完成的节点开始, 每次回溯到最后完成的依赖节点
+        :return: 按执行顺序排列的节点
+        """
+        nodes = [node for node in self.nodes.values() if node.end_time is not None]
+        if len(nodes) == 0:
+            return []
+        path: List[Node] = []
+        node = max(nodes, key = lambda n: n.end_time)
+        while node is not None:
+            path.append(node)
+            dependencies = [self.nodes[name] for name in node.dependencies
+                            if name in self.nodes and self.nodes[name].end_time is not None]
+            node = max(dependencies, key = lambda n: n.end_time) if len(dependencies) > 0 else None
+        path.reverse()
+        return path
+
+    def report(self) -> str:
+        """
+        输出各状态的节点数量和关键路径上各节点的耗时
+        :return:
+        """
+        nodes = list(self.nodes.values())
+        children = [child for node in nodes for child in node.children]
+        lines = ['任务节点: %s 个, 子任务: %s 个, 总耗时: %s' % (len(nodes), len(children), self.end_time - self.start_time)]
+        for status in (Node.done, Node.fresh, Node.failed, Node.skipped):
+            count = sum(1 for node in nodes + children if node.status == status)
+            if count > 0:
+                lines.append('    %-8s %s' % (status, count))
+
+        lines.append('关键路径:')
+        for node in self.critical_path():
+            line = '    %-24s 开始 +%8.1f 秒, 耗时 %8.1f 秒' % (
+                node.name, (node.start_time - self.start_time).total_seconds(), node.seconds())
+            if len(node.children) > 0:
+                slowest = max(node.children, key = lambda n: n.seconds())
+                line += ', %s 个子任务, 最慢: %s %.1f 秒' % (len(node.children), slowest.name, slowest.seconds())
+            lines.append(line)
+        return '\n'.join(lines)
@@ -0,0 +1,177 @@
+import logging
+import os
+from datetime import date
+from typing import Union, List, Dict
+
+import colorama
+import pandas as pd
+
+from sz.stock_data.toolbox.storage import current_storage, with_columns
+
+
+class SegmentStore(object):
+    """
+    分段追加存储. 一个目录下保存同一份数据的多个分段文件:
+        <year>.csv                      已经合并的按年分段
+        tail_<seq>_<first_time>.csv     每次增量更新追加的小分段, 按写入顺序编号
+    每次更新只写入新增的记录, 不再重写全部历史数据; 小分段数量超过上限时, 合并到对应年份的分段中.
+    分段文件的格式跟随当前的存储格式 (csv/parquet)
+    """
+    tail_prefix = 'tail_'
+
+    def __init__(self, dir_path: str, time_column: str, max_tail_segments: int = 20,
+                 key_columns: Union[None, List[str]] = None):
+        """
+        :param dir_path: 分段文件所在目录
+        :param time_column: 记录的时间字段, 用于分段
+        :param max_tail_segments: 小分段数量的上限, 超过时自动合并
+        :param key_columns: 用于去重的主键字段, 默认为 time_column
+        """
+        self.dir_path = dir_path
+        self.time_column = time_column
+        self.max_tail_segments = max_tail_segments
+        self.key_columns = key_columns if key_columns is not None else [time_column]
+
+    def exists(self) -> bool:
+        return len(self.year_segments()) + len(self.tail_segments()) > 0
+
+    def _segment_files_(self, tail: bool) -> List[str]:
+        if not os.path.isdir(self.dir_path):
+            return []
+        suffix = current_storage().suffix
+        if tail:
+            fnames = [fname for fname in os.listdir(self.dir_path)
+                      if fname.endswith(suffix) and fname.startswith(self.tail_prefix)]
+        else:
+            fnames = [fname for fname in os.listdir(self.dir_path)
+                      if fname.endswith(suffix) and fname[:-len(suffix)].isdigit()]
+        return [os.path.join(self.dir_path, fname) for fname in sorted(fnames)]
+
+    def year_segments(self, years: Union[None, List[int]] = None) -> List[str]:
+        """
+        按年份排序的年度分段文件
+        :param years: 只返回指定年份的分段
+        :return:
+        """
+        fpaths = self._segment_files_(tail = False)
+        if years is None:
+            return fpaths
+        suffix = current_storage().suffix
+        return [fpath for fpath in fpaths if int(os.path.basename(fpath)[:-len(suffix)]) in years]
+
+    def tail_segments(self) -> List[str]:
+        """
+        按写入顺序排序的追加分段文件
+        :return:
+        """
+        return self._segment_files_(tail = True)
+
+    def year_segment_path(self, year: int) -> str:
+        return os.path.join(self.dir_path, '%s%s' % (year, current_storage().suffix))
+
+    def load(self, parse_dates: Union[None, List[str]] = None, dtype: Union[None, Dict] = None,
+             years: Union[None, List[int]] = None, columns: Union[None, List[str]] = None,
+             start: Union[None, str, date] = None, end: Union[None, str, date] = None) -> pd.DataFrame:
+        """
+        依次读取分段并拼接
+        :param parse_dates:
+        :param dtype:
+        :param years: 只读取指定年份的年度分段 (追加分段总是读取)
+        :param columns: 只读取指定的字段
+        :param start: 只读取不早于这一天的记录, 早于这一年的年度分段直接跳过
+        :param end: 只读取不晚于这一天的记录, 晚于这一年的年度分段直接跳过
+        :return:
+        """
+        if start is not None or end is not None:
+            first_year = pd.Timestamp(start).year if start is not None else 0
+            last_year = pd.Timestamp(end).year if end is not None else 9999
+            fpaths = [fpath for fpath in self.year_segments(years)
+                      if first_year <= int(os.path.basename(fpath)[:-len(current_storage().suffix)]) <= last_year]
+        else:
+            fpaths = self.year_segments(years)
+        read_columns = with_columns(columns, *self.key_columns)
+        df_list = [current_storage().read(fpath, parse_dates = parse_dates, dtype = dtype, columns = read_columns,
+                                          date_column = self.time_column, start = start, end = end)
+                   for fpath in fpaths + self.tail_segments()]
+        if len(df_list) == 0:
+            return pd.DataFrame()
+
+        df = pd.concat(df_list, ignore_index = True)
+        # 合并过程中断时, 年度分段和追加分段可能有重复记录, 以后写入的为准
+        df = df.drop_duplicates(subset = self.key_columns, keep = 'last')
+        if read_columns is not None and len(read_columns) > len(columns):
+            df = df[[column for column in df.columns if column in columns]]
+        return df
+
+    def append(self, df: pd.DataFrame):
+        """
+        将新增记录写入一个新的追加分段
+        :param df: 按时间排序的新增记录
+        :return:
+        """
+        if df.empty:
+            return
+        os.makedirs(self.dir_path, exist_ok = True)
+        first_time = pd.Timestamp(df[self.time_column].min())
+        tail_files = self.tail_segments()
+        seq = int(os.path.basename(tail_files[-1])[len(self.tail_prefix):].split('_')[0]) + 1 if tail_files else 1
+        fpath = os.path.join(self.dir_path, '%s%06d_%s%s' % (
+            self.tail_prefix, seq, first_time.strftime('%Y%m%d%H%M%S'), current_storage().suffix))
+        self._write_(df, fpath)
+
+    def write_all(self, df: pd.DataFrame):
+        """
+        将完整的历史数据按年份写成年度分段 (用于从单一数据文件转换为分段存储)
+        :param df:
+        :return:
+        """
+        os.makedirs(self.dir_path, exist_ok = True)
+        years = pd.DatetimeIndex(df[self.time_column]).year
+        for year, df_year in df.groupby(years):
+            self._write_(df_year, self.year_segment_path(year))
+
+    def clear(self):
+        """
+        删除全部分段, 用于重新写入全部历史数据
+        :return:
+        """
+        for fpath in self.year_segments() + self.tail_segments():
+            os.remove(fpath)
+
+    def compact(self):
+        """
+        将所有追加分段合并到对应年份的年度分段中, 只重写涉及到的年份
+        :return:
+        """
+        tail_files = self.tail_segments()
+        if len(tail_files) == 0:
+            return
+
+        storage = current_storage()
+        df_tail = pd.concat([storage.read(fpath, parse_dates = [self.time_column]) for fpath in tail_files],
+                            ignore_index = True)
+        years = pd.DatetimeIndex(df_tail[self.time_column]).year
+        for year, df_year in df_tail.groupby(years):
+            fpath = self.year_segment_path(year)
+            if os.path.exists(fpath):
+                df_year = pd.concat([storage.read(fpath, parse_dates = [self.time_column]), df_year],
+                                    ignore_index = True)
+            df_year = df_year.drop_duplicates(subset = self.key_columns, keep = 'last')
+            self._write_(df_year.sort_values(by = self.key_columns), fpath)
+
+        # 年度分段全部写入成功之后, 才删除追加分段
+        for fpath in tail_files:
+            os.remove(fpath)
+
+        logging.debug(colorama.Fore.YELLOW + '合并 %s 个追加分段: %s' % (len(tail_files), self.dir_path))
+
+    def compact_if_needed(self):
+        if len(self.tail_segments()) > self.max_tail_segments:
+            self.compact()
+
+    @staticmethod
+    def _write_(df: pd.DataFrame, fpath: str):
+        # 先写临时文件再替换, 避免中断时留下不完整的分段
+        tmp_path = fpath + '.tmp'
+        current_storage().write(df, tmp_path)
+        os.replace(tmp_path, fpath)
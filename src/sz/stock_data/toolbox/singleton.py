@@ -1,3 +1,6 @@
+import threading
+
+
 def singleton(class_):
     """
     example:
@@ -54,8 +57,12 @@ class SingletonMeta(type):
     """
 
     _instances = {}
+    _lock = threading.Lock()
 
     def __call__(cls, *args, **kwargs):
         if cls not in cls._instances:
-            cls._instances[cls] = super(SingletonMeta, cls).__call__(*args, **kwargs)
+            # 多个线程同时第一次访问时, 只创建一个实例
+            with SingletonMeta._lock:
+                if cls not in cls._instances:
+                    cls._instances[cls] = super(SingletonMeta, cls).__call__(*args, **kwargs)
         return cls._instances[cls]
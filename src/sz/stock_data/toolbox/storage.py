@@ -0,0 +1,281 @@
+import logging
+import os
+from datetime import date
+from typing import Union, List, Dict, Tuple
+
+import colorama
+import pandas as pd
+
+
+def date_bounds(start: Union[None, str, date] = None,
+                end: Union[None, str, date] = None) -> Tuple[Union[None, pd.Timestamp], Union[None, pd.Timestamp]]:
+    """
+    读取范围 [start, end] 按天计算, 转换为 [开始时间, 结束日期的下一天) 的半开区间,
+    这样带时间的字段 (例如 5min 线的 time) 也包含结束日期当天的全部记录
+    :param start:
+    :param end:
+    :return:
+    """
+    start_time = pd.Timestamp(start).normalize() if start is not None else None
+    end_time = pd.Timestamp(end).normalize() + pd.Timedelta(days = 1) if end is not None else None
+    return start_time, end_time
+
+
+def is_slice(columns: Union[None, List[str]] = None, start: Union[None, str, date] = None,
+             end: Union[None, str, date] = None) -> bool:
+    """
+    是否只读取部分字段或者部分日期. 数据集只读取切片时, 不替换已经加载的完整数据
+    """
+    return columns is not None or start is not None or end is not None
+
+
+def with_columns(columns: Union[None, List[str]], *required: str) -> Union[None, List[str]]:
+    """
+    在需要读取的字段中加入必须的字段 (例如索引字段), 不指定字段时读取全部字段
+    """
+    if columns is None:
+        return None
+    return list(dict.fromkeys(list(required) + list(columns)))
+
+
+class CsvStorage(object):
+    """
+    csv 文本格式存储 (默认格式, 兼容已有的数据目录)
+    """
+    name = 'csv'
+    suffix = '.csv'
+    # 按日期范围读取时, 每次解析的行数
+    chunk_rows = 100_000
+
+    def read(self, fpath: str, parse_dates: Union[None, List[str]] = None,
+             dtype: Union[None, Dict] = None, columns: Union[None, List[str]] = None,
+             date_column: Union[None, str] = None, start: Union[None, str, date] = None,
+             end: Union[None, str, date] = None) -> pd.DataFrame:
+        """
+        :param fpath:
+        :param parse_dates:
+        :param dtype:
+        :param columns: 只解析指定的字段 (usecols), 文件中不存在的字段忽略
+        :param date_column: 按日期范围读取时使用的字段
+        :param start: 只返回不早于这一天的记录
+        :param end: 只返回不晚于这一天的记录. 文件按 date_column 升序排列时, 读到结束日期之后即停止解析
+        :return:
+        """
+        if columns is None and (date_column is None or (start is None and end is None)):
+            return pd.read_csv(
+                filepath_or_buffer = fpath,
+                parse_dates = parse_dates,
+                dtype = dtype
+            )
+
+        header = list(pd.read_csv(fpath, nrows = 0).columns)
+        filter_dates = date_column is not None and date_column in header and (start is not None or end is not None)
+        wanted = set(header if columns is None else columns) | ({date_column} if filter_dates else set())
+        usecols = [column for column in header if column in wanted]
+        kwargs = {
+            'usecols': usecols,
+            'parse_dates': [column for column in parse_dates or [] if column in usecols] or None,
+            'dtype': {column: value for column, value in (dtype or {}).items() if column in usecols} or None
+        }
+        if not filter_dates:
+            return pd.read_csv(filepath_or_buffer = fpath, **kwargs)
+
+        kwargs['parse_dates'] = list(dict.fromkeys((kwargs['parse_dates'] or []) + [date_column]))
+        start_time, end_time = date_bounds(start, end)
+        df_list: List[pd.DataFrame] = []
+        last_value = None
+        ordered = True
+        for chunk in pd.read_csv(filepath_or_buffer = fpath, chunksize = self.chunk_rows, **kwargs):
+            values = chunk[date_column]
+            mask = pd.Series(True, index = chunk.index)
+            if start_time is not None:
+                mask &= values >= start_time
+            if end_time is not None:
+                mask &= values < end_time
+            df_list.append(chunk[mask])
+            if chunk.empty:
+                continue
+            # 只有确认文件按日期升序排列时, 才能在越过结束日期后停止解析
+            ordered = ordered and values.is_monotonic_increasing and not values.isnull().any() and \
+                (last_value is None or values.iloc[0] >= last_value)
+            last_value = values.iloc[-1]
+            if ordered and end_time is not None and last_value >= end_time:
+                break
+
+        df = pd.concat(df_list, ignore_index = True) if df_list else pd.DataFrame(columns = usecols)
+        if columns is not None and date_column not in columns:
+            df = df.drop(columns = [date_column])
+        return df
+
+    def write(self, df: pd.DataFrame, fpath: str):
+        df.to_csv(
+            path_or_buf = fpath,
+            index = False
+        )
+
+
+class ParquetStorage(object):
+    """
+    Parquet 列式存储, 字段类型保存在文件内, 读取时不需要再做文本解析
+    依赖 pyarrow
+    """
+    name = 'parquet'
+    suffix = '.parquet'
+    compression = 'zstd'
+    # 每个 row group 的行数. row group 中保存了各字段的最小/最大值, 按日期范围读取时可以跳过整个 row group
+    row_group_rows = 50_000
+
+    def read(self, fpath: str, parse_dates: Union[None, List[str]] = None,
+             dtype: Union[None, Dict] = None, columns: Union[None, List[str]] = None,
+             date_column: Union[None, str] = None, start: Union[None, str, date] = None,
+             end: Union[None, str, date] = None) -> pd.DataFrame:
+        """
+        字段类型已经保存在文件中, parse_dates 和 dtype 无须再处理. 参数参考 CsvStorage.read,
+        字段和日期范围交给 pyarrow 处理: 只解码需要的字段, 并根据 row group 的统计信息跳过不在范围内的 row group
+        """
+        if columns is None and (date_column is None or (start is None and end is None)):
+            return pd.read_parquet(fpath)
+
+        import pyarrow.parquet as pq
+        names = pq.read_schema(fpath).names
+        if columns is not None:
+            columns = [column for column in columns if column in names]
+        filters = []
+        if date_column is not None and date_column in names:
+            start_time, end_time = date_bounds(start, end)
+            if start_time is not None:
+                filters.append((date_column, '>=', start_time))
+            if end_time is not None:
+                filters.append((date_column, '<', end_time))
+        return pd.read_parquet(fpath, columns = columns, filters = filters or None)
+
+    def write(self, df: pd.DataFrame, fpath: str):
+        df.to_parquet(
+            fpath,
+            index = False,
+            compression = self.compression,
+            row_group_size = self.row_group_rows
+        )
+
+
+__storages__ = {
+    CsvStorage.name: CsvStorage(),
+    ParquetStorage.name: ParquetStorage()
+}
+
+__current_storage__ = __storages__[CsvStorage.name]
+
+
+def use_storage(name: str):
+    """
+    指定本地数据文件的存储格式
+    :param name: csv 或者 parquet
+    :return:
+    """
+    global __current_storage__
+    if name not in __storages__:
+        raise Exception('不支持的存储格式: %s' % name)
+    __current_storage__ = __storages__[name]
+
+
+def current_storage() -> Union[CsvStorage, ParquetStorage]:
+    return __current_storage__
+
+
+def data_file(fpath_without_suffix: str) -> str:
+    """
+    根据当前的存储格式, 返回数据文件的完整路径
+    :param fpath_without_suffix: 不带扩展名的数据文件路径
+    :return:
+    """
+    return fpath_without_suffix + current_storage().suffix
+
+
+def read_dataframe(fpath: str, parse_dates: Union[None, List[str]] = None,
+                   dtype: Union[None, Dict] = None, columns: Union[None, List[str]] = None,
+                   date_column: Union[None, str] = None, start: Union[None, str, date] = None,
+                   end: Union[None, str, date] = None) -> pd.DataFrame:
+    """
+    使用当前的存储格式读取数据文件
+    :param fpath:
+    :param parse_dates: 需要解析为日期的字段 (仅 csv 格式需要)
+    :param dtype: 指定字段类型 (仅 csv 格式需要)
+    :param columns: 只读取指定的字段, 默认读取全部字段
+    :param date_column: 按日期范围读取时使用的字段
+    :param start: 只读取不早于这一天的记录
+    :param end: 只读取不晚于这一天的记录
+    :return:
+    """
+    return current_storage().read(fpath, parse_dates = parse_dates, dtype = dtype, columns = columns,
+                                  date_column = date_column, start = start, end = end)
+
+
+def read_csv_file(fpath: str, parse_dates: Union[None, List[str]] = None,
+                  dtype: Union[None, Dict] = None, columns: Union[None, List[str]] = None,
+                  date_column: Union[None, str] = None, start: Union[None, str, date] = None,
+                  end: Union[None, str, date] = None) -> pd.DataFrame:
+    """
+    读取固定为 csv 格式的数据文件 (全市场数据, 与个股数据的存储格式无关), 参数参考 read_dataframe
+    """
+    return __storages__[CsvStorage.name].read(fpath, parse_dates = parse_dates, dtype = dtype, columns = columns,
+                                               date_column = date_column, start = start, end = end)
+
+
+def write_dataframe(df: pd.DataFrame, fpath: str):
+    """
+    使用当前的存储格式保存数据文件
+    :param df:
+    :param fpath:
+    :return:
+    """
+    current_storage().write(df, fpath)
+
+
+def date_columns_of(columns: List[str]) -> List[str]:
+    """
+    按照字段命名习惯, 找出日期类型的字段 (xxx_date, updateDate, date, time)
+    :param columns:
+    :return:
+    """
+    return [column for column in columns if column.lower().endswith('date') or column == 'time']
+
+
+def migrate_stocks_dir(data_dir: str, target: str = ParquetStorage.name, remove_source: bool = False) -> int:
+    """
+    将 stocks/<code>/ 目录下的个股 csv 数据文件 (包括分段存储的子目录) 转换为指定的存储格式
+    :param data_dir: 本地数据目录
+    :param target: 目标存储格式
+    :param remove_source: 转换成功后是否删除原来的 csv 文件
+    :return: 转换的文件数量
+    """
+    if target not in __storages__:
+        raise Exception('不支持的存储格式: %s' % target)
+
+    source_storage = __storages__[CsvStorage.name]
+    target_storage = __storages__[target]
+    stocks_dir = os.path.join(data_dir, 'stocks')
+    if not os.path.isdir(stocks_dir) or target_storage is source_storage:
+        return 0
+
+    count = 0
+    for stock_code in sorted(os.listdir(stocks_dir)):
+        stock_dir = os.path.join(stocks_dir, stock_code)
+        if not os.path.isdir(stock_dir):
+            continue
+        # 包括分段存储的子目录, 例如 stocks/<code>/5min/
+        for dir_path, _, fnames in os.walk(stock_dir):
+            for fname in sorted(fnames):
+                if not fname.endswith(source_storage.suffix):
+                    continue
+                source_path = os.path.join(dir_path, fname)
+                target_path = source_path[:-len(source_storage.suffix)] + target_storage.suffix
+                header = pd.read_csv(source_path, nrows = 0)
+                df = source_storage.read(source_path, parse_dates = date_columns_of(list(header.columns)))
+                target_storage.write(df, target_path)
+                if remove_source:
+                    os.remove(source_path)
+                count += 1
+        logging.debug(colorama.Fore.YELLOW + '%s 数据文件已转换为 %s 格式' % (stock_code, target))
+
+    logging.info(colorama.Fore.YELLOW + '共转换 %s 个数据文件为 %s 格式' % (count, target))
+    return count